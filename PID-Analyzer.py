@@ -11,47 +11,71 @@ import sys
 import time
 from ast import literal_eval
 
-from matplotlib import pyplot, pyplot as plt
-
 from pidanalyzer.common import *
-from pidanalyzer import common, loaders, BANNER
-from pidanalyzer.plotting import show_plots
-
-# LaTeX-esque output
-
-plt.rcParams.update({
-    "font.family": "serif",
-    "font.serif": "cmr10",
-    "mathtext.fontset": "cm",
-    "axes.unicode_minus": False,
-    "axes.linewidth": 0.5,
-    "grid.linewidth": 0.3,
-    "lines.linewidth": 0.7,
-    # "text.usetex": True,
-})
-
-def analyze_file(path: str, plot_name: str, hide: bool, noise_bounds: list = DEFAULT_NOISE_BOUNDS):
+from pidanalyzer import common, profiling, BANNER
+
+# the modes import matplotlib, pandas and scipy when they need them, --help and the prompts don't wait for them
+
+
+def analyze_file(path: str, plot_name: str, hide: bool, noise_bounds: list = DEFAULT_NOISE_BOUNDS,
+                 axes: list = AXES, analyses: list = ANALYSES, parallel: bool = False, stream: int = None,
+                 figures: bool = True):
+    from pidanalyzer import analysis, cache
+    if figures:
+        from pidanalyzer.plotting import show_plots, show_stream_plots
     tmp_path = os.path.join(os.path.dirname(path), plot_name)
     if not os.path.isdir(tmp_path):
         os.makedirs(tmp_path)
-    loader = loaders.resolve(path, plot_name)
+    # caching a log reads all of it, streaming only uses logs already cached
+    loader = cache.resolve(path, plot_name, store=not stream)
     for i, header in enumerate(loader.headers):
-        show_plots(plot_name, header, loader.data[i], noise_bounds)
-        if hide:
-            plt.cla()
-            plt.clf()
+        if not figures:
+            analysis.export_session(loader, i, plot_name, axes, analyses, parallel, stream)
+            continue
+        with profiling.span('session', log=path, session=i):
+            if stream:
+                show_stream_plots(plot_name, header, loader, i, noise_bounds, stream * 1024 ** 2, axes, analyses,
+                                  not hide)
+            else:
+                show_plots(plot_name, header, loader.data[i], noise_bounds, axes, analyses, parallel, not hide)
     loader.clean_up()
     log.info('Analysis complete, showing plot. (Close plot to exit.)')
 
 
+def check_precision(path: str, plot_name: str, axes: list):
+    from pidanalyzer import analysis
+    for i, errors in enumerate(analysis.precision_error(path, axes, plot_name)):
+        log.info('Max deviation of the float32 from the float64 step responses of %r (log %d): %s'
+                 % (path, i, ', '.join('%s %.2g' % (axis, error) for axis, error in errors.items())))
+
+
 def arguments_mode(args) -> int:
+    if args.check_precision:
+        for log_path in args.log_paths:
+            check_precision(clean_path(log_path), args.name, args.axes)
+        return 0
+    if args.live:
+        if len(args.log_paths) != 1:
+            parser.error('--live analyzes exactly one source')
+        from pidanalyzer import live
+        source = args.log_paths[0]
+        return live.run(source if source == '-' else clean_path(source), args.name, args.axes, args.analyses,
+                        args.noise_bounds, args.refresh, args.hide)
+    if args.watch:
+        if not args.output:
+            parser.error('--watch needs an --output directory')
+        from pidanalyzer import watch
+        return watch.Watcher([clean_path(directory) for directory in args.log_paths], clean_path(args.output),
+                             args.name, args.noise_bounds, args.axes, args.analyses, args.jobs or 1, args.stream,
+                             args.poll, figures=not args.no_figures).run()
+    if args.jobs:
+        from pidanalyzer import batch
+        return batch.run([clean_path(log_path) for log_path in args.log_paths], args.name, args.noise_bounds,
+                         args.axes, args.analyses, args.jobs, args.stream, not args.no_figures)
     for log_path in args.log_paths:
-        analyze_file(clean_path(log_path), args.name, args.hide, args.noise_bounds)
-    if not args.hide:
-        pyplot.show()
-    else:
-        pyplot.cla()
-        pyplot.clf()
+        analyze_file(clean_path(log_path), args.name, args.hide, args.noise_bounds, args.axes, args.analyses,
+                     args.parallel, args.stream, not args.no_figures)
+    show_figures(args)
     return 0
 
 
@@ -80,50 +104,138 @@ def interactive_mode(args) -> int:
 
         for path in raw_paths:
             if os.path.isfile(clean_path(path)):
-                analyze_file(clean_path(path), name, args.show, args.noise_bounds)
+                analyze_file(clean_path(path), name, args.hide, args.noise_bounds, args.axes, args.analyses,
+                             args.parallel, args.stream, not args.no_figures)
             else:
                 log.info('No valid input path!')
                 return 1
 
-        if not args.hide:
-            pyplot.show()
-        else:
-            pyplot.cla()
-            pyplot.clf()
+        show_figures(args)
 
     return 0
 
 
+def show_figures(args):
+    if args.no_figures:
+        return
+    from matplotlib import pyplot
+    from pidanalyzer.figures.writer import writer
+    # figures are saved in the background, and can't be shown while being saved
+    writer.wait()
+    if not args.hide:
+        pyplot.show()
+
+
+def comma_list(choices):
+    """Returns an argparse type parsing a comma separated selection of choices.
+    """
+    def parse(value: str) -> list:
+        selection = [v.strip() for v in value.split(',') if v.strip()]
+        for v in selection:
+            if v not in choices:
+                raise argparse.ArgumentTypeError('invalid choice: %r (choose from %s)' % (v, ','.join(choices)))
+        return selection
+
+    return parse
+
+
+def decodes_bbl(args) -> bool:
+    # CSV logs given as arguments don't need blackbox_decode, prompted and watched logs may
+    from pidanalyzer.loaders.bbl_loader import LOG_EXTENSIONS
+    return not args.log_paths or args.watch or any(os.path.splitext(strip_quotes(log_path))[1].lower()
+                                                   in LOG_EXTENSIONS for log_path in args.log_paths)
+
+
 def main(args) -> int:
-    blackbox_decode_path = clean_path(args.blackbox_decode)
-    if not os.path.isfile(blackbox_decode_path):
-        parser.error(
-            ('Could not find blackbox_decode (used to generate CSVs from '
-             'your BBL file) at %s. You may need to install it from '
-             'https://github.com/cleanflight/blackbox-tools/releases.')
-            % blackbox_decode_path)
-    common.BLACKBOX_DECODE_PATH = blackbox_decode_path
-    log.info('Decoding with %r' % blackbox_decode_path)
+    if args.native_decoder:
+        common.NATIVE_DECODER = True
+    elif decodes_bbl(args):
+        blackbox_decode_path = clean_path(args.blackbox_decode)
+        if not os.path.isfile(blackbox_decode_path):
+            parser.error(
+                ('Could not find blackbox_decode (used to generate CSVs from '
+                 'your BBL file) at %s. You may need to install it from '
+                 'https://github.com/cleanflight/blackbox-tools/releases, '
+                 'or use --native-decoder.')
+                % blackbox_decode_path)
+        common.BLACKBOX_DECODE_PATH = blackbox_decode_path
+        log.info('Decoding with %r' % blackbox_decode_path)
+    if not args.no_cache:
+        common.CACHE_DIR = clean_path(args.cache_dir)
+    if args.float32:
+        common.DTYPE = 'float32'
     log.info(BANNER)
-
-    if args.log_paths:
-        return arguments_mode(args)
-    else:
-        return interactive_mode(args)
+    if args.hide and args.log_paths:
+        # no plot window is shown, figures are rendered without a GUI backend. matplotlib isn't imported yet.
+        os.environ['MPLBACKEND'] = 'Agg'
+
+    if args.profile:
+        profiling.enable(args.profile_memory)
+    try:
+        if args.log_paths:
+            return arguments_mode(args)
+        else:
+            return interactive_mode(args)
+    finally:
+        if args.profile:
+            profiling.save(clean_path(args.profile))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument(action='append', dest='log_paths', metavar="LOG_PATHS",
+    parser.add_argument(nargs='*', dest='log_paths', metavar="LOG_PATHS",
                         help='log file(s) to analyze or omit for interactive prompt')
     parser.add_argument('-n', '--name', default='tmp', help='plot name')
     parser.add_argument('--blackbox_decode', metavar="PATH", default=get_blackbox_decode_path(),
                         help='path to blackbox_decode tool')
+    parser.add_argument('--native-decoder', action='store_true',
+                        help='decode BBL files with the built-in decoder instead of blackbox_decode, which is '
+                             'slower but needs no external tool')
+    parser.add_argument('--cache-dir', metavar='PATH', default=DEFAULT_CACHE_DIR,
+                        help='directory of the cache of decoded logs')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always decode logs, without reading or writing the cache')
     parser.add_argument('-d', '--hide', action='store_true',
                         help='hide plot window when done')
     parser.add_argument('-b', '--noise-bounds', default=''.join(repr(DEFAULT_NOISE_BOUNDS).split(' ')),
                         type=literal_eval,
                         help='bounds of plots in noise analysis (use "auto" for autoscaling)')
+    parser.add_argument('--axes', default=','.join(AXES), type=comma_list(AXES),
+                        help='comma separated axes to analyze')
+    parser.add_argument('--analyses', default=','.join(ANALYSES), type=comma_list(ANALYSES),
+                        help='comma separated analyses to run and plot')
+    parser.add_argument('-p', '--parallel', action='store_true',
+                        help='analyze the axes of each log in parallel processes')
+    parser.add_argument('-s', '--stream', type=int, nargs='?', const=DEFAULT_STREAM_BUDGET, metavar='MB',
+                        help='analyze long logs chunk by chunk within a memory budget of MB (%d if omitted)'
+                             % DEFAULT_STREAM_BUDGET)
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='headless batch mode: analyze logs and their sessions in N parallel processes')
+    parser.add_argument('--live', action='store_true',
+                        help='live mode: analyze frames of a growing CSV log, a named pipe or stdin (-) as they '
+                             'arrive, until interrupted or the pipe is closed')
+    parser.add_argument('--refresh', type=float, default=1., metavar='SECONDS',
+                        help='refresh interval of the live mode')
+    parser.add_argument('--no-figures', action='store_true',
+                        help='save the analysis results of each log as .npz arrays and a .json summary instead of '
+                             'drawing figures')
+    parser.add_argument('--watch', action='store_true',
+                        help='daemon mode: watch the directories given as LOG_PATHS and analyze new or changed logs '
+                             'in -j N worker processes, until interrupted')
+    parser.add_argument('-o', '--output', metavar='DIR',
+                        help='output directory of the watch mode')
+    parser.add_argument('--poll', type=float, default=2., metavar='SECONDS',
+                        help='poll interval of the watch mode')
+    parser.add_argument('--float32', action='store_true',
+                        help='load and analyze logs in single precision, which needs about half the memory')
+    parser.add_argument('--check-precision', action='store_true',
+                        help='analyze the step responses of the logs in float32 and float64 and report their max '
+                             'deviation, without figures')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write the wall and CPU time of each stage of the run to PATH, as Chrome trace events '
+                             '(see chrome://tracing or ui.perfetto.dev)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace the peak memory of each stage, which slows down the run')
 
     cli_args = parser.parse_args()
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Startup time of the command line and the modules loaded by its code paths.
+
+Each case is run in fresh interpreters. A case fails if it imports a heavy dependency it doesn't need, or if its
+median time exceeds --max-seconds. Exits with 1 if any case failed, so it can guard startup in scripts:
+
+    python benchmarks/startup.py [--runs N] [--max-seconds S]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('matplotlib', 'pandas', 'scipy')
+
+# name, code run by the interpreter, heavy modules the case may import
+CASES = [
+    ('cli --help', "import runpy, sys; sys.argv = ['PID-Analyzer.py', '--help']\n"
+                   "try:\n    runpy.run_path('PID-Analyzer.py', run_name='__main__')\n"
+                   "except SystemExit:\n    pass", ()),
+    ('recognize logs', "from pidanalyzer import cache, loaders", ()),
+    ('batch/watch parent', "from pidanalyzer import batch, watch", ()),
+    ('headless analysis', "from pidanalyzer import analysis", ()),
+    ('figures', "from pidanalyzer import plotting", ('matplotlib',)),
+]
+
+
+def run_case(code: str) -> tuple:
+    """
+    :return: wall time in s and heavy modules imported by code
+    """
+    report = "\nimport json, sys\nprint(json.dumps(sorted({m.split('.')[0] for m in sys.modules} & set(%r))))" \
+             % (HEAVY,)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code + report], cwd=ROOT, check=True, stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    return time.perf_counter() - start, json.loads(out.splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='runs of each case')
+    parser.add_argument('--max-seconds', type=float, default=0.5,
+                        help='max median time of the cases that import no heavy module')
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_case('pass')[0] for _ in range(args.runs))
+    print('%-20s %8s  %s' % ('case', 'median', 'heavy imports'))
+    print('%-20s %7.3fs' % ('interpreter', baseline))
+    failed = 0
+    for name, code, allowed in CASES:
+        times, imported = [], []
+        for _ in range(args.runs):
+            seconds, imported = run_case(code)
+            times.append(seconds)
+        median = statistics.median(times)
+        unexpected = sorted(set(imported) - set(allowed))
+        errors = ['imports ' + ', '.join(unexpected)] if unexpected else []
+        if not allowed and median > args.max_seconds:
+            errors.append('slower than %.2f s' % args.max_seconds)
+        failed += bool(errors)
+        print('%-20s %7.3fs  %-24s %s' % (name, median, ','.join(imported) or '-', '; '.join(errors) or 'ok'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Time and memory of the stages of the analysis, on synthetic logs of pidanalyzer.synthetic.
+
+Logs are generated once per configuration, in each supported input format, into --work-dir. Each stage is run
+--repeat times and its fastest run is reported, peak memory is measured in one more run under tracemalloc. Results
+are appended to --history and compared to the median of the last runs of the same configuration on the same
+machine. Exits with 1 if a stage got slower or needs more memory than --tolerance allows:
+
+    python benchmarks/suite.py [--rate 4000] [--duration 30] [--repeat 3] [--tolerance 0.2] [--precision float32]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import defaultdict
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from pidanalyzer import common, loaders, synthetic
+from pidanalyzer.analysis import create_traces, session_precision_error
+from pidanalyzer.common import DEFAULT_NOISE_BOUNDS, get_blackbox_decode_path, log
+from pidanalyzer.errors import InvalidDataError
+from pidanalyzer.loaders.bbl_loader import LOG_MIN_BYTES
+from pidanalyzer.trace import Trace, equalize_channels, noise_analysis, plotted_noise_sources
+
+STAGES = ('load', 'equalize', 'stack', 'deconvolve', 'histogram', 'noise', 'render')
+# log formats by extension, bbl is decoded natively and by blackbox_decode too if it is found
+FORMATS = ('csv', 'bbl')
+# methods of Trace run by calc_response, by their stage. Times are exclusive, stack_response leaves out the
+# deconvolution and calc_response is what remains: the masks and the histograms.
+RESPONSE_STAGES = {'winstacker': 'stack', 'stack_response': 'stack', 'wiener_deconvolution': 'deconvolve',
+                   'calc_response': 'histogram'}
+# changes below this many s aren't reported, timer resolution and noise dominate them
+MIN_SECONDS = 0.005
+
+
+class Stages:
+    """Exclusive wall time and peak memory of nested stages.
+
+    Peak memory is the max of the memory allocated during a stage, including nested stages, above the memory
+    allocated when it started. It is only measured while tracemalloc is tracing.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.peak = defaultdict(int)
+        # name, start time, time of nested stages, memory at start, peak memory of nested stages
+        self._open = []
+
+    @contextmanager
+    def __call__(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        current = 0
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                self._open[-1][4] = max(self._open[-1][4], peak)
+            tracemalloc.reset_peak()
+        frame = [name, time.perf_counter(), 0., current, 0]
+        self._open.append(frame)
+        try:
+            yield
+        finally:
+            self._open.pop()
+            elapsed = time.perf_counter() - frame[1]
+            self.seconds[name] += elapsed - frame[2]
+            if self._open:
+                self._open[-1][2] += elapsed
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], frame[4])
+                self.peak[name] = max(self.peak[name], peak - frame[3])
+                if self._open:
+                    self._open[-1][4] = max(self._open[-1][4], peak)
+
+
+@contextmanager
+def instrumented(stages: Stages):
+    # runs the methods of RESPONSE_STAGES as stages
+    originals = {name: getattr(Trace, name) for name in RESPONSE_STAGES}
+
+    def timed(method, stage):
+        def run(*args, **kwargs):
+            with stages(stage):
+                return method(*args, **kwargs)
+        return run
+
+    for name, stage in RESPONSE_STAGES.items():
+        setattr(Trace, name, timed(originals[name], stage))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(Trace, name, method)
+
+
+def generate_logs(work_dir: str, config: dict, formats) -> dict:
+    """
+    :return: paths of the logs of config by format, generated if missing
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:10]
+    paths = {fmt: os.path.join(work_dir, 'synthetic_%s.%s' % (digest, fmt)) for fmt in formats}
+    fields = None
+    for path in paths.values():
+        if not os.path.isfile(path):
+            if fields is None:
+                log.info('Generating synthetic logs of %r' % config)
+                fields = synthetic.generate(**config)
+            # written under another name first, so that interrupted runs don't leave partial logs
+            synthetic.write(path + '.tmp' + os.path.splitext(path)[1], *fields)
+            os.replace(path + '.tmp' + os.path.splitext(path)[1], path)
+    return paths
+
+
+def run(paths: dict, stages: Stages, decoder: str = None) -> float:
+    """Runs all stages once.
+
+    :param paths: paths of the logs by format
+    :param decoder: path of blackbox_decode, to load the BBL log with it too
+    :return: max deviation of the step responses from the one of the transfer function
+    """
+    loads = [(fmt, path, None) for fmt, path in paths.items()]
+    if decoder and 'bbl' in paths:
+        loads.append(('bbl blackbox_decode', paths['bbl'], decoder))
+    for fmt, path, blackbox_decode in loads:
+        common.BLACKBOX_DECODE_PATH = blackbox_decode
+        common.NATIVE_DECODER = blackbox_decode is None
+        os.makedirs(os.path.join(os.path.dirname(path), 'tmp'), exist_ok=True)
+        with stages('load ' + fmt):
+            loader = loaders.resolve(path, 'tmp')
+            if not loader.headers:
+                # BBL sessions below LOG_MIN_BYTES are ignored
+                raise InvalidDataError(path, message='no session of more than %d bytes, raise --duration or --rate'
+                                                     % LOG_MIN_BYTES)
+            header, data = loader.headers[0], loader.read_session(0)
+        loader.clean_up()
+    common.BLACKBOX_DECODE_PATH = None
+    common.NATIVE_DECODER = False
+
+    channels = {key: value for key, value in data.items() if key != 'time_us'}
+    with stages('equalize'):
+        equalize_channels(data['time_us'], channels, Trace.equalize_tol)
+    # equalized again here, untimed
+    traces_header, traces = create_traces(header, data, analyses=())
+    with instrumented(stages):
+        for trace in traces:
+            trace.compute('calc_response')
+    with stages('noise'):
+        noise_analysis(traces, [plotted_noise_sources(trace.name) for trace in traces])
+    with stages('render'):
+        # matplotlib isn't imported before, see benchmarks/startup.py
+        from pidanalyzer.figures import noise_figure, response_figure, small_response_figure
+        from pidanalyzer.figures.writer import writer
+        path = header['tempFile']
+        small_response_figure.create(path, 'bench', traces_header, traces, show=False)
+        response_figure.create(path, 'bench', traces_header, traces, show=False)
+        noise_figure.create(path, 'bench', traces_header, traces, DEFAULT_NOISE_BOUNDS, show=False)
+        writer.wait()
+
+    dt = traces[0].time[1] - traces[0].time[0]
+    truth = synthetic.step_response(1. / dt, Trace.resplen)
+    return max(float(np.max(np.abs(trace.resp_low[0][:len(truth)] - truth[:len(trace.resp_low[0])])))
+               for trace in traces)
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def read_history(path: str) -> list:
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(result: dict, history: list, runs: int) -> dict:
+    """
+    :return: baseline seconds and peak MB by stage, medians of the last runs of the same configuration and machine
+    """
+    same = [record for record in history
+            if record['config'] == result['config'] and record['machine'] == result['machine']][-runs:]
+    baseline = {}
+    for stage in result['stages']:
+        previous = [record['stages'][stage] for record in same if stage in record['stages']]
+        if previous:
+            baseline[stage] = {key: statistics.median(p[key] for p in previous) for key in ('seconds', 'peak_mb')}
+    return baseline
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0],
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rate', type=float, default=4000., help='loop rate of the logs in Hz')
+    parser.add_argument('--duration', type=float, default=30., help='length of the logs in s')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the logs')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each stage')
+    parser.add_argument('--work-dir', default=os.path.join(ROOT, 'benchmarks', 'work'),
+                        help='directory of the generated logs')
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'history.jsonl'),
+                        help='file the results are appended to')
+    parser.add_argument('--no-record', action='store_true', help="don't append the results to the history")
+    parser.add_argument('--baseline-runs', type=int, default=5, help='last runs the results are compared to')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative increase of time or memory of a stage reported as regression')
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help='dtype of the analysis, see common.DTYPE')
+    args = parser.parse_args()
+    # shorter logs have no response window, see Trace.winstacker
+    min_duration = Trace.framelen * (1. + 1. / Trace.superpos)
+    if args.duration <= min_duration:
+        parser.error('--duration must be longer than %g s, one response window and its shift' % min_duration)
+    # the stages log their progress and warn about the logs, only the results are of interest here
+    log.setLevel(logging.ERROR)
+    warnings.simplefilter('ignore')
+
+    config = {'rate': args.rate, 'duration': args.duration, 'seed': args.seed}
+    paths = generate_logs(args.work_dir, config, FORMATS)
+    config['precision'] = args.precision
+    common.DTYPE = args.precision
+    decoder = get_blackbox_decode_path()
+    decoder = decoder if os.path.isfile(decoder) else None
+
+    best = {}
+    for _ in range(args.repeat):
+        stages = Stages()
+        try:
+            error = run(paths, stages, decoder)
+        except InvalidDataError as e:
+            parser.error(str(e))
+        for stage, seconds in stages.seconds.items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+    memory = Stages()
+    tracemalloc.start()
+    try:
+        run(paths, memory, decoder)
+    finally:
+        tracemalloc.stop()
+
+    stage_names = [stage for stage in best if stage.startswith('load ')] + list(STAGES[1:])
+    result = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': revision(),
+              'machine': '%s %s %s' % (platform.node(), platform.machine(), platform.processor()),
+              'python': platform.python_version(), 'numpy': np.__version__, 'config': config,
+              'response_error': error, 'precision_error': None,
+              'stages': {stage: {'seconds': round(best[stage], 4), 'peak_mb': round(memory.peak[stage] / 1e6, 1)}
+                         for stage in stage_names}}
+    if args.precision != 'float64':
+        loader = loaders.resolve(paths['csv'], 'tmp')
+        result['precision_error'] = max(session_precision_error(loader, 0).values())
+        loader.clean_up()
+    baseline = compare(result, read_history(args.history), args.baseline_runs)
+
+    print('%-24s %9s %9s %11s %9s' % ('stage', 'seconds', 'peak MB', 'baseline s', 'change'))
+    regressions = []
+    for stage, values in result['stages'].items():
+        base = baseline.get(stage)
+        change = ''
+        if base:
+            change = '%+.0f%%' % ((values['seconds'] / base['seconds'] - 1.) * 100.) if base['seconds'] else ''
+            if values['seconds'] > base['seconds'] * (1. + args.tolerance) + MIN_SECONDS:
+                regressions.append('%s time %.3f s > %.3f s' % (stage, values['seconds'], base['seconds']))
+            if values['peak_mb'] > base['peak_mb'] * (1. + args.tolerance) + 1.:
+                regressions.append('%s memory %.1f MB > %.1f MB' % (stage, values['peak_mb'], base['peak_mb']))
+        print('%-24s %9.3f %9.1f %11s %9s' % (stage, values['seconds'], values['peak_mb'],
+                                               '%.3f' % base['seconds'] if base else '-', change))
+    print('step response deviation from the transfer function: %.3f' % error)
+    if result['precision_error'] is not None:
+        print('step response deviation of %s from float64: %.2g' % (args.precision, result['precision_error']))
+
+    if not args.no_record:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    for regression in regressions:
+        log.error('Regression: ' + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import json
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import cache, common
+from .common import *
+from .errors import NonMonotonicTimeError
+from .loaders import Loader
+from .parallel import analyze as parallel_analyze
+from .profiling import span, traced
+from .streaming import chunk_length, stream_traces
+from .trace import NOISE_ATTRS, Trace, equalize_channels, noise_analysis, plotted_noise_sources
+
+# version of the layout of exported results
+RESULT_FORMAT = 1
+
+
+class AnalysisResult:
+    """Numbers of the analysis of one session, without figures.
+
+    arrays holds the step responses, the response by throttle, the noise spectrograms and the filter transmission
+    of each axis by '<axis>/<name>', summary a few scalars of each axis and the header of the log. Both are
+    written by save, the arrays as npz and the summary as JSON.
+    """
+
+    def __init__(self, summary: dict, arrays: Dict[str, np.ndarray]):
+        self.summary = summary
+        self.arrays = arrays
+
+    @classmethod
+    def from_traces(cls, path: str, header: dict, traces: List[Trace],
+                    analyses: Sequence[str] = ANALYSES) -> 'AnalysisResult':
+        """
+        :param path: path of the log
+        :param header: header of the session
+        :param traces: analyzed traces of the session
+        """
+        arrays = {'throt_hist': traces[0].throt_hist, 'throt_scale': traces[0].throt_scale}
+        axes = {}
+        for trace in traces:
+            values, scalars = {}, {}
+            if 'response' in analyses:
+                values['time_resp'] = trace.time_resp
+                for resp in ('resp_low', 'resp_high'):
+                    if resp in trace.__dict__:
+                        values[resp + '_mean'], values[resp + '_std'] = getattr(trace, resp)[:2]
+                values['thr_response'] = trace.thr_response['hist2d_norm']
+                values['thr_response_throttle'] = trace.thr_response['throt_scale']
+                resp = trace.resp_low[0]
+                late = trace.time_resp >= 0.2
+                scalars.update({'response_windows': int(np.sum(trace.toolow_mask)),
+                                'high_windows': int(np.sum(trace.high_mask * trace.toolow_mask)),
+                                'peak': float(np.max(resp)), 'peak_time': float(trace.time_resp[np.argmax(resp)]),
+                                'steady_state': float(np.mean(resp[late])) if late.any() else None})
+            if 'noise' in analyses:
+                for attr in NOISE_ATTRS.values():
+                    if attr not in trace.__dict__:
+                        continue
+                    noise = getattr(trace, attr)
+                    values[attr] = noise['hist2d_sm']
+                    values[attr + '_raw'] = noise['hist2d']
+                    values[attr + '_throttle'] = noise['throt_axis']
+                    values[attr + '_freq'] = noise['freq_axis']
+                    scalars[attr + '_max'] = float(noise['max'])
+                if 'filter_trans' in trace.__dict__:
+                    values['filter_trans'] = trace.filter_trans
+                    scalars['filter_trans_mean'] = float(np.mean(trace.filter_trans))
+            arrays.update({trace.name + '/' + key: np.asarray(value) for key, value in values.items()})
+            axes[trace.name] = scalars
+
+        summary = {'format': RESULT_FORMAT, 'log': path, 'logNum': header['logNum'],
+                   'header': {key: value for key, value in header.items() if key != 'tempFile'},
+                   'sample_rate': 1. / abs(float(traces[0].dt)), 'dtype': str(traces[0].input.dtype),
+                   'duration': float(traces[0].time[-1] - traces[0].time[0]),
+                   'analyses': list(analyses), 'axes': axes}
+        return cls(summary, arrays)
+
+    def save(self, path_root: str) -> Tuple[str, str]:
+        """Writes the arrays to path_root.npz and the summary to path_root.json.
+
+        :return: paths of both files
+        """
+        arrays_path, summary_path = path_root + '.npz', path_root + '.json'
+        np.savez_compressed(arrays_path, **self.arrays)
+        with open(summary_path, 'w') as f:
+            json.dump(dict(_finite(self.summary), arrays=os.path.basename(arrays_path)), f, indent=1)
+        return arrays_path, summary_path
+
+    @classmethod
+    def load(cls, path_root: str) -> 'AnalysisResult':
+        """Reads a result written by save.
+        """
+        with open(path_root + '.json') as f:
+            summary = json.load(f)
+        with np.load(path_root + '.npz') as arrays:
+            return cls(summary, dict(arrays))
+
+
+def _finite(value):
+    # NaN and inf aren't valid JSON
+    if isinstance(value, dict):
+        return {key: _finite(v) for key, v in value.items()}
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def result_path(header: dict, name: str) -> str:
+    """
+    :return: path of the results of a session without extension, next to its figures
+    """
+    return header['tempFile'][:-13] + name + '_' + str(header['logNum']) + '_results'
+
+
+def analyze(path: str, axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES, parallel: bool = False,
+            stream: Optional[int] = None, tmp_subdir: str = 'tmp') -> List[AnalysisResult]:
+    """Analyzes all sessions of a log, without drawing any figures.
+
+    :param path: path of the log
+    :param axes: axes to analyze, see AXES
+    :param analyses: analyses to run, see ANALYSES
+    :param parallel: analyze each axis in a separate process
+    :param stream: memory budget in MB of streaming analysis, see create_stream_traces. None to analyze sessions
+        in memory.
+    :param tmp_subdir: subdirectory of temporary files, next to the log
+    :return: result of each session
+    """
+    os.makedirs(os.path.join(os.path.dirname(path), tmp_subdir), exist_ok=True)
+    loader = cache.resolve(path, tmp_subdir, store=not stream)
+    try:
+        return [analyze_session(loader, i, axes, analyses, parallel, stream) for i in range(len(loader.headers))]
+    finally:
+        loader.clean_up()
+
+
+def analyze_session(loader: Loader, index: int, axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES,
+                    parallel: bool = False, stream: Optional[int] = None) -> AnalysisResult:
+    """Analyzes one session of a log, see analyze.
+
+    :param index: index of the session, as in loader.headers
+    """
+    header = loader.headers[index]
+    log.info('Analyzing %r (log %s)' % (loader.path, header['logNum']))
+    with span('session', log=loader.path, session=index):
+        if stream:
+            _, traces = create_stream_traces(header, loader, index, stream * 1024 ** 2, axes, analyses)
+        else:
+            _, traces = create_traces(header, loader.read_session(index), axes, analyses, parallel)
+        if 'response' in analyses:
+            for trace in traces:
+                trace.compute('calc_response')
+        return AnalysisResult.from_traces(loader.path, header, traces, analyses)
+
+
+def export_session(loader: Loader, index: int, name: str, axes: Sequence[str] = AXES,
+                   analyses: Sequence[str] = ANALYSES, parallel: bool = False,
+                   stream: Optional[int] = None) -> Tuple[str, str]:
+    """Analyzes one session of a log and saves its results next to where its figures would be, see result_path.
+
+    :param name: plot name
+    :return: paths of the arrays and the summary
+    """
+    paths = analyze_session(loader, index, axes, analyses, parallel, stream).save(
+        result_path(loader.headers[index], name))
+    log.info('Saved %r' % paths[1])
+    return paths
+
+
+def precision_error(path: str, axes: Sequence[str] = AXES, tmp_subdir: str = 'tmp') -> List[Dict[str, float]]:
+    """Analyzes the step responses of all sessions of a log in single and in double precision, see common.DTYPE.
+
+    :param path: path of the log
+    :param axes: axes to analyze, see AXES
+    :param tmp_subdir: subdirectory of temporary files, next to the log
+    :return: max absolute deviation of the mean step responses in float32 from those in float64 by axis, for each
+        session
+    """
+    os.makedirs(os.path.join(os.path.dirname(path), tmp_subdir), exist_ok=True)
+    loader = cache.resolve(path, tmp_subdir)
+    try:
+        return [session_precision_error(loader, i, axes) for i in range(len(loader.headers))]
+    finally:
+        loader.clean_up()
+
+
+def session_precision_error(loader: Loader, index: int, axes: Sequence[str] = AXES) -> Dict[str, float]:
+    """Compares the step responses of one session in single and in double precision, see precision_error.
+
+    Both are calculated from the same decoded frames, which are exact in float32 as logged values are integers.
+
+    :param index: index of the session, as in loader.headers
+    """
+    header, data = loader.headers[index], loader.read_session(index)
+    responses = {}
+    dtype = common.DTYPE
+    try:
+        for precision in ('float64', 'float32'):
+            common.DTYPE = precision
+            _, traces = create_traces(header, data, axes, analyses=())
+            for trace in traces:
+                trace.compute('calc_response')
+            responses[precision] = {trace.name: [getattr(trace, resp)[0] for resp in ('resp_low', 'resp_high')
+                                                 if resp in trace.__dict__] for trace in traces}
+    finally:
+        common.DTYPE = dtype
+    # resp_high is only calculated if there are enough windows of high input, which might differ
+    return {axis: max(float(np.max(np.abs(single - double)))
+                      for single, double in zip(responses['float32'][axis], responses['float64'][axis]))
+            for axis in responses['float64']}
+
+
+@traced
+def create_traces(header: dict, data: dict, axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES,
+                  parallel: bool = False) -> Tuple[dict, List[Trace]]:
+    """Creates a Trace for each of the selected axes. Analysis results are computed on first access,
+    except for the noise analysis, which is done for all axes at once. With parallel, the selected
+    analyses of each axis are computed in a separate process.
+    """
+    # equalize all channels once on a shared time base, the traces then skip resampling
+    channels = {key: value for key, value in data.items() if key != 'time_us'}
+    time, data = equalize_channels(data['time_us'], channels, Trace.equalize_tol)
+    throttle = ((data['throttle'] - 1000.) / (float(header['maxThrottle']) - 1000.)) * 100.
+    tracesdata = [{'name': axis} for axis in AXES if axis in axes]
+    traces_header = figure_header(header)
+    traces = []
+
+    for axisdata in tracesdata:
+        axisdata.update({'time': time})
+        si = str(AXES.index(axisdata['name']))
+        axisdata.update({'p_err': data['PID loop in' + si]})
+        axisdata.update({'rcinput': data['rcCommand' + si]})
+        axisdata.update({'gyro': data['gyroData' + si]})
+        axisdata.update({'PIDsum': data['PID sum' + si]})
+        axisdata.update({'d_err': data['d_err' + si]})
+        axisdata.update({'debug': data['debug' + si]})
+        axisdata.update({'P': p_gain(header, axisdata['name'])})
+        axisdata.update({'throttle': throttle})
+        log.info(axisdata['name'] + '...   ')
+        traces.append(Trace(axisdata))
+    if parallel:
+        parallel_analyze(traces, analyses)
+    elif 'noise' in analyses:
+        # noise of all axes is calculated in one batch
+        noise_analysis(traces, [plotted_noise_sources(trace.name) for trace in traces])
+
+    return traces_header, traces
+
+
+@traced
+def create_stream_traces(header: dict, loader: Loader, index: int, budget: int, axes: Sequence[str] = AXES,
+                         analyses: Sequence[str] = ANALYSES) -> Tuple[dict, List[Trace]]:
+    """Like create_traces, but reads the session chunk by chunk and analyzes it within a memory budget.
+    Falls back to create_traces if the time of the session isn't monotonic.
+
+    :param loader: loader of the log
+    :param index: index of the session, as in loader.headers
+    :param budget: memory budget in bytes
+    """
+    path = header["tempFile"]
+    gains = {axis: p_gain(header, axis) for axis in AXES if axis in axes}
+    try:
+        traces = stream_traces(loader.iter_session(index, chunk_length(budget)), gains,
+                               float(header['maxThrottle']), os.path.dirname(path), budget, analyses)
+    except NonMonotonicTimeError:
+        traces = None
+    if traces is None:
+        log.warning('Time of %r is not monotonic, analyzing it in memory.' % path)
+        return create_traces(header, loader.read_session(index), axes, analyses)
+    return figure_header(header), traces
+
+
+def figure_header(header: dict) -> dict:
+    # header of the figures, with the TPA breakpoint in percent
+    traces_header = dict(header)
+    if 'KISS' in header['fwType'] or 'Raceflight' in header['fwType']:
+        traces_header.update({'tpa_percent': 0.})
+    else:
+        traces_header.update({'tpa_percent': (float(header['tpa_breakpoint']) - 1000.) / 10.})
+    return traces_header
+
+
+def p_gain(header: dict, axis: str) -> float:
+    # P gain of an axis, as used by pid_in
+    if 'KISS' in header['fwType'] or 'Raceflight' in header['fwType']:
+        return 1.
+    return float((header[axis + 'PID']).split(',')[0])
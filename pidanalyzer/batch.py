@@ -0,0 +1,145 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Sequence, Tuple
+
+from . import cache, common, profiling
+from .common import *
+from .analysis import export_session
+from .errors import PidAnalyzerException
+from .loaders import Loader
+from .profiling import span
+
+
+def run(paths: Sequence[str], name: str, noise_bounds: list, axes: Sequence[str] = AXES,
+        analyses: Sequence[str] = ANALYSES, jobs: int = 1, stream: Optional[int] = None,
+        figures: bool = True) -> int:
+    """Analyzes logs headless in a pool of worker processes.
+
+    Every log is decoded in its own job, then every session of it is analyzed and plotted in its own job.
+    Failing jobs are logged and don't affect the others. Output file names only depend on log path and
+    session number, not on the order in which jobs finish. Logs with the same output names as a log before them,
+    e.g. LOG.bbl and LOG.csv, are failed without being analyzed, see output_root.
+
+    :param paths: paths of the logs to analyze
+    :param name: plot name
+    :param noise_bounds: bounds of the noise plots
+    :param axes: axes to analyze, see AXES
+    :param analyses: analyses to run, see ANALYSES
+    :param jobs: number of worker processes
+    :param stream: memory budget in MB of streaming analysis, see plotting.show_stream_plots. None to analyze
+        sessions in memory.
+    :param figures: save figures, else only the results of the analysis, see analysis.export_session
+    :return: 0 if all sessions of all logs were analyzed, else 1
+    """
+    failures = []  # (path, session or None, error)
+    done = []  # (path, session)
+    loaded = []
+    roots = {}
+    for path in paths:
+        first = roots.setdefault(output_root(path, name), path)
+        if first != path:
+            failures.append((path, None, 'same output files as %r, rename one of them' % first))
+    paths = list(dict.fromkeys(roots.values()))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(common.BLACKBOX_DECODE_PATH, common.NATIVE_DECODER, common.CACHE_DIR,
+                                       common.DTYPE)) as pool:
+        loading = {pool.submit(profiling.collecting(_load), path, name, not stream): path for path in paths}
+        analyzing = {}
+        for future in as_completed(loading):
+            path = loading[future]
+            loader, error = _result(future)
+            if error is not None:
+                failures.append((path, None, error))
+                continue
+            loaded.append(loader)
+            if not loader.headers:
+                failures.append((path, None, 'no session to analyze'))
+            for i in range(len(loader.headers)):
+                future = pool.submit(profiling.collecting(_analyze), loader, i, name, noise_bounds, axes, analyses,
+                                     stream, figures)
+                analyzing[future] = (path, i)
+        for future in as_completed(analyzing):
+            path, i = analyzing[future]
+            error = _result(future)[1]
+            if error is None:
+                done.append((path, i))
+            else:
+                failures.append((path, i, error))
+    for loader in loaded:
+        loader.clean_up()
+
+    log.info('Batch complete: %d session(s) analyzed, %d failure(s).' % (len(done), len(failures)))
+    for path, i in sorted(done):
+        log.info('OK      %s (log %d)' % (path, i))
+    for path, i, error in sorted(failures, key=lambda f: (f[0], -1 if f[1] is None else f[1])):
+        log.error('FAILED  %s%s: %s' % (path, '' if i is None else ' (log %d)' % i, error))
+    return 1 if failures else 0
+
+
+def output_root(path: str, tmp_subdir: str) -> str:
+    """
+    :param tmp_subdir: subdirectory of temporary files and figures, next to the log or absolute
+    :return: common part of the paths of the temporary files, figures and results of a log. Logs of the same
+        root overwrite each other's files.
+    """
+    root = os.path.splitext(os.path.basename(path))[0]
+    return os.path.normcase(os.path.abspath(os.path.join(os.path.dirname(path), tmp_subdir, root)))
+
+
+def _result(future) -> Tuple[Optional[object], Optional[str]]:
+    try:
+        # spans recorded by the worker are added to the profile of this process
+        return profiling.merge(future.result())
+    except (Exception, PidAnalyzerException) as e:
+        # e.g. a worker process died
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+def _init_worker(blackbox_decode_path: str, native_decoder: bool, cache_dir: str, dtype: str):
+    # workers are headless, the settings may not be inherited from the parent process. matplotlib isn't imported yet.
+    os.environ['MPLBACKEND'] = 'Agg'
+    common.BLACKBOX_DECODE_PATH = blackbox_decode_path
+    common.NATIVE_DECODER = native_decoder
+    common.CACHE_DIR = cache_dir
+    common.DTYPE = dtype
+
+
+def _load(path: str, name: str, store: bool = True) -> Tuple[Optional[Loader], Optional[str]]:
+    try:
+        tmp_path = os.path.join(os.path.dirname(path), name)
+        os.makedirs(tmp_path, exist_ok=True)
+        return cache.resolve(path, name, store), None
+    except (Exception, PidAnalyzerException) as e:
+        log.error('Loading %r failed' % path, exc_info=True)
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+def _analyze(loader: Loader, index: int, name: str, noise_bounds: list, axes: List[str],
+             analyses: List[str], stream: Optional[int] = None, figures: bool = True) -> Tuple[None, Optional[str]]:
+    try:
+        if figures:
+            _plot_session(loader, index, name, noise_bounds, axes, analyses, stream)
+        else:
+            export_session(loader, index, name, axes, analyses, stream=stream)
+        return None, None
+    except (Exception, PidAnalyzerException) as e:
+        log.error('Analysis of %r (log %d) failed' % (loader.path, index), exc_info=True)
+        return None, '%s: %s' % (type(e).__name__, e)
+
+
+def _plot_session(loader: Loader, index: int, name: str, noise_bounds: list, axes: Sequence[str],
+                  analyses: Sequence[str], stream: Optional[int] = None):
+    # saves the figures of a session. matplotlib is only imported by workers drawing figures.
+    from matplotlib import pyplot as plt
+    from .figures.writer import writer
+    from .plotting import show_plots, show_stream_plots
+    try:
+        with span('session', log=loader.path, session=index):
+            if stream:
+                show_stream_plots(name, loader.headers[index], loader, index, noise_bounds, stream * 1024 ** 2,
+                                  axes, analyses, show=False)
+            else:
+                show_plots(name, loader.headers[index], loader.read_session(index), noise_bounds, axes, analyses,
+                           show=False)
+            writer.wait()
+    finally:
+        plt.close('all')
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import mmap
+import shutil
+from typing import Optional, Tuple, Type
+
+import numpy as np
+
+from . import common, loaders
+from .common import *
+from .loaders import Loader
+from .profiling import span
+
+# bump when the layout of cache entries changes
+CACHE_FORMAT = 1
+INDEX_FILE = "index.json"
+
+
+class CachedLoader(Loader):
+    """Loads the headers and memory-mapped frames of a log from a cache entry.
+    """
+
+    def __init__(self, path: str, tmp_subdir: str, entry: str):
+        """
+        :param entry: path of the cache entry
+        """
+        self._entry = entry
+        super().__init__(path, tmp_subdir)
+
+    @staticmethod
+    def is_applicable(path: str) -> bool:
+        # only created by LogCache
+        return False
+
+    def _read_headers(self, path: str) -> Tuple[dict]:
+        with open(os.path.join(self._entry, INDEX_FILE)) as f:
+            index = json.load(f)
+        self._sessions = index['sessions']
+        # temp file names depend on the path of the log, not on its content
+        root = os.path.splitext(os.path.basename(path))[0]
+        headers = []
+        for header in index['headers']:
+            temp_file = header['tempFile'].replace(index['root'], root, 1)
+            headers.append(dict(header, tempFile=os.path.join(self.tmp_path, temp_file)))
+        return tuple(headers)
+
+    def _read_data(self, path: str) -> Tuple[dict]:
+        return tuple(self.read_session(i) for i in range(len(self.headers)))
+
+    def read_session(self, index: int) -> dict:
+        return {name: np.load(os.path.join(self._entry, '%d_%d.npy' % (index, j)), mmap_mode='r')
+                for j, name in enumerate(self._sessions[index])}
+
+
+class LogCache:
+    """Cache of decoded logs, keyed by the content of the log and the version of its loader.
+
+    Entries hold the headers as JSON and each trace as .npy file, which are memory-mapped when loaded.
+    Least recently used entries are evicted when the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def resolve(self, path: str, tmp_subdir: str, store: bool = True) -> Loader:
+        """Like loaders.resolve, but loads the log from the cache if possible and caches it otherwise.
+
+        :param store: cache the log if it isn't cached yet, which reads all of its frames
+        """
+        loader_type = loaders.find(path)
+        entry = os.path.join(self.directory, self.key(path, loader_type))
+        if os.path.isdir(entry):
+            try:
+                loader = CachedLoader(path, tmp_subdir, entry)
+                # mark as recently used
+                os.utime(entry)
+                log.info('Loaded %r from cache' % path)
+                return loader
+            except (OSError, ValueError, KeyError):
+                log.warning('Dropping broken cache entry %r' % entry, exc_info=True)
+                shutil.rmtree(entry, ignore_errors=True)
+
+        loader = loader_type(path, tmp_subdir)
+        if not store:
+            return loader
+        try:
+            with span('cache_store'):
+                self._store(entry, loader)
+        except OSError:
+            log.warning('Could not cache %r' % path, exc_info=True)
+            return loader
+        loader.clean_up()
+        self.evict(keep=entry)
+        return CachedLoader(path, tmp_subdir, entry)
+
+    @staticmethod
+    def key(path: str, loader_type: Type[Loader]) -> str:
+        """
+        :return: name of the cache entry of a log
+        """
+        digest = content_hash(path)
+        digest.update(('%s:%s:%d:%d' % (loader_type.__name__, np.dtype(common.DTYPE), loader_type.VERSION,
+                                        CACHE_FORMAT)).encode())
+        return digest.hexdigest()
+
+    def _store(self, entry: str, loader: Loader):
+        if os.path.isdir(entry):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # written next to the entry and renamed, so that concurrent readers never see partial entries
+        tmp_entry = '%s.%d.tmp' % (entry, os.getpid())
+        os.makedirs(tmp_entry, exist_ok=True)
+        try:
+            sessions = []
+            for i, data in enumerate(loader.data):
+                for j, values in enumerate(data.values()):
+                    np.save(os.path.join(tmp_entry, '%d_%d.npy' % (i, j)), np.asarray(values))
+                sessions.append(list(data.keys()))
+            headers = [dict(header, tempFile=os.path.relpath(header['tempFile'], loader.tmp_path))
+                       for header in loader.headers]
+            root = os.path.splitext(os.path.basename(loader.path))[0]
+            with open(os.path.join(tmp_entry, INDEX_FILE), 'w') as f:
+                json.dump({'headers': headers, 'root': root, 'sessions': sessions}, f)
+            try:
+                os.rename(tmp_entry, entry)
+            except OSError:
+                # stored by another process meanwhile
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def evict(self, keep: Optional[str] = None):
+        """Removes the least recently used entries until the cache fits into max_bytes.
+
+        :param keep: path of an entry to keep in any case
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.endswith('.tmp') or not os.path.isdir(entry):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            entries.append((os.stat(entry).st_mtime, size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+def content_hash(path: str):
+    """
+    :return: sha256 hash object of the content of a file
+    """
+    digest = hashlib.sha256()
+    if os.path.getsize(path):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            digest.update(content)
+    return digest
+
+
+def resolve(path: str, tmp_subdir: str, store: bool = True) -> Loader:
+    """Resolves the Loader of a log, through the cache in CACHE_DIR unless it is None.
+
+    :param store: see LogCache.resolve
+    """
+    with span('load', log=path):
+        if common.CACHE_DIR is None:
+            return loaders.resolve(path, tmp_subdir)
+        return LogCache(common.CACHE_DIR).resolve(path, tmp_subdir, store)
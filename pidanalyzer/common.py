@@ -5,14 +5,28 @@ import platform
 
 CONFIG_FILE = "config.ini"
 BLACKBOX_DECODE_PATH = None
+# decode BBL logs with the built-in decoder instead of blackbox_decode, which is slower
+NATIVE_DECODER = False
+# decoded logs are cached here, unless None
+CACHE_DIR = None
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'PID-Analyzer')
+# least recently used logs are evicted beyond this size
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+# dtype of the traces and the analysis results, 'float32' halves their memory. Time is always float64.
+DTYPE = 'float64'
+# default memory budget of streaming analysis, in MB
+DEFAULT_STREAM_BUDGET = 256
 DEFAULT_NOISE_BOUNDS = [[1., 10.1], [1., 100.], [1., 100.], [0., 4.]]
+# axes and analyses which can be selected, all of them by default
+AXES = ('roll', 'pitch', 'yaw')
+ANALYSES = ('response', 'noise')
 # different versions of fw have different names for the same thing.
 FIELDS_MAP = {'dynThrPID': 'dynThrottle',
               'Craft name': 'craftName',
               'Firmware type': 'fwType',
               'Firmware revision': 'version',
               'Firmware date': 'fwDate',
-              'rcRate': 'rcRate', 'rc_rate': 'rcRate',
+              'rcRate': 'rcRate', 'rc_rate': 'rcRate', 'rc_rates': 'rcRate',
               'rcExpo': 'rcExpo', 'rc_expo': 'rcExpo',
               'rcYawExpo': 'rcYawExpo', 'rc_expo_yaw': 'rcYawExpo',
               'rcYawRate': 'rcYawRate', 'rc_rate_yaw': 'rcYawRate',
@@ -39,6 +53,8 @@ FIELDS_MAP = {'dynThrPID': 'dynThrottle',
               'dterm_notch_cutoff': 'dterm_notch_cutoff',
               'debug_mode': 'debug_mode',
               }
+# FIELDS_MAP by exact header field name
+HEADER_FIELDS = {key.strip(): value for key, value in FIELDS_MAP.items()}
 # string fragment for identifying the main fields header row in CSV file
 CSV_HEADER_ROW_FRAGMENT = "loopIteration"
 
@@ -69,6 +85,14 @@ def get_blackbox_decode_path() -> str:
     return config['paths']['blackbox_decode']
 
 
+def translate_fields(fields: dict) -> dict:
+    """
+    :param fields: header field values by name, as in the log
+    :return: the known fields by their useful names
+    """
+    return {HEADER_FIELDS[name]: value for name, value in fields.items() if name in HEADER_FIELDS}
+
+
 def headerdict(log_file: str, log_number: int = 0) -> dict:
     # in case info is not provided by log, empty str is printed in plot
     return {'tempFile': log_file, 'dynThrottle': '', 'craftName': '', 'fwType': '', 'version': '', 'date': '',
@@ -7,7 +7,7 @@ class LoaderNotFoundError(PidAnalyzerException):
     """
 
     def __init__(self, path: str, *args: object, **kwargs: object):
-        super().__init__(*args, **kwargs)
+        super().__init__(*args)
         self._path = path
 
     def __str__(self):
@@ -19,7 +19,8 @@ class InvalidDataError(PidAnalyzerException):
     """
 
     def __init__(self, path: str, *args: object, **kwargs: object):
-        super().__init__(*args, **kwargs)
+        # BaseException takes no keyword arguments
+        super().__init__(*args)
         self._path = path
         self._message = kwargs.get("message")
 
@@ -28,3 +29,8 @@ class InvalidDataError(PidAnalyzerException):
         if self._message is not None:
             s += " (%s)" % str(self._message)
         return s
+
+
+class NonMonotonicTimeError(PidAnalyzerException):
+    """Raised when the time of a log isn't monotonic, which streaming analysis can't reorder.
+    """
@@ -1 +1,80 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Tuple
+
+from matplotlib import pyplot as plt, rc_context
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
 TEXTSIZE = 7
+# rcParams of the figures, LaTeX-esque output. Only applied while figures are built, see styled.
+STYLE = {
+    "font.size": 9,
+    # the font itself, generic families like serif are looked up in the rcParams when drawn
+    "font.family": "cmr10",
+    "mathtext.fontset": "cm",
+    "axes.unicode_minus": False,
+    "axes.linewidth": 0.5,
+    "grid.linewidth": 0.3,
+    "lines.linewidth": 0.7,
+    # "text.usetex": True,
+}
+# rcParams are global, figures built in other threads must not restore them while one is built
+_style_lock = threading.RLock()
+
+
+@contextmanager
+def style():
+    """Applies STYLE to the rcParams, which are restored afterwards.
+    """
+    with _style_lock, rc_context(STYLE):
+        yield
+
+
+def styled(fn: Callable) -> Callable:
+    """Decorates a function building a figure to create its artists in style, see style.
+    """
+    @wraps(fn)
+    def run(*args, **kwargs):
+        with style():
+            return fn(*args, **kwargs)
+
+    return run
+
+
+class StyledFigure(Figure):
+    """Figure built in style, see styled. It is drawn without the style, so the artists created when it is
+    drawn are set up by freeze beforehand.
+    """
+
+    def freeze(self):
+        """Creates the first tick of each axis, which the ticks created when drawn copy the font and lines of, and
+        keeps the tick locators and labels from looking up font.size and axes.unicode_minus. To be called in style
+        once the figure is built.
+        """
+        for ax in self.axes:
+            for axis in (ax.xaxis, ax.yaxis):
+                axis.minorTicks[0]
+                # the number of ticks depends on their label size
+                axis.set_tick_params(labelsize=axis.majorTicks[0].label1.get_size())
+                for formatter in (axis.get_major_formatter(), axis.get_minor_formatter()):
+                    formatter.fix_minus = _fix_minus
+
+
+def _fix_minus(s: str) -> str:
+    # Formatter.fix_minus with axes.unicode_minus of STYLE
+    return s.replace('-', '\N{MINUS SIGN}') if STYLE["axes.unicode_minus"] else s
+
+
+def new_figure(title: str, figsize: Tuple[float, float], show: bool = True) -> Figure:
+    """
+    :param title: window title
+    :param show: create the figure through pyplot, so that it is shown by plt.show(). Else the figure is unknown
+        to pyplot, has an Agg canvas and can be drawn in any thread.
+    """
+    if show:
+        return plt.figure(title, figsize=figsize, FigureClass=StyledFigure)
+    fig = StyledFigure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
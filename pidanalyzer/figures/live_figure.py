@@ -0,0 +1,50 @@
+from typing import List, Sequence
+
+from matplotlib.figure import Figure
+
+from . import new_figure, styled
+from ..common import ANALYSES
+from ..trace import Trace
+
+
+@styled
+def create(path: str, header: dict) -> Figure:
+    return new_figure('Live plot: ' + path, (12, 8))
+
+
+@styled
+def update(fig: Figure, traces: List[Trace], analyses: Sequence[str] = ANALYSES):
+    # redraws the running results, step response on the left and mean noise over throttle on the right
+    fig.clf()
+    for i, trace in enumerate(traces):
+        ax0 = fig.add_subplot(len(traces), 2, 2 * i + 1)
+        if 'resp_low' in trace.__dict__:
+            ax0.plot(trace.time_resp, trace.resp_low[0],
+                     label=trace.name + ' step response (<' + str(int(Trace.threshold)) + ')')
+            if trace.high_mask.sum() > 0:
+                ax0.plot(trace.time_resp, trace.resp_high[0],
+                         label=trace.name + ' step response (>' + str(int(Trace.threshold)) + ')')
+            ax0.legend(loc=1)
+        ax0.set_xlim([-0.001, 0.501])
+        ax0.set_ylim([0., 2])
+        ax0.set_ylabel('strength')
+        ax0.grid()
+        if i == len(traces) - 1:
+            ax0.set_xlabel('response time in s')
+
+        if 'noise' not in analyses:
+            continue
+        ax1 = fig.add_subplot(len(traces), 2, 2 * i + 2)
+        if 'noise_gyro' in trace.__dict__:
+            freq = trace.noise_gyro['freq_axis'][:-1]
+            ax1.plot(freq, trace.noise_gyro['hist2d_sm'].mean(axis=1), label=trace.name + ' gyro')
+            ax1.plot(freq, trace.noise_debug['hist2d_sm'].mean(axis=1), label=trace.name + ' debug')
+            ax1.set_yscale('log')
+            ax1.set_xlim([freq[0], freq[-1]])
+            ax1.legend(loc=1)
+        ax1.set_ylabel('noise a.u.')
+        ax1.grid()
+        if i == len(traces) - 1:
+            ax1.set_xlabel('frequency in hz')
+    fig.freeze()
+    fig.canvas.draw_idle()
@@ -1,11 +1,13 @@
 from typing import List
 
 import numpy as np
-from matplotlib import colors as colors, pyplot as plt, rcParams
+from matplotlib import colors as colors
 from matplotlib.figure import Figure
 from matplotlib.gridspec import GridSpec
 
-from . import TEXTSIZE
+from . import TEXTSIZE, new_figure, styled
+from .render import decimate, heatmap, pixel_width
+from .writer import writer
 from .. import BANNER
 from ..common import log
 from ..trace import Trace, to_mask
@@ -23,23 +25,20 @@ def _check_lims_list(lims: list) -> bool:
     return False
 
 
-def create(path: str, name: str, header: dict, traces: List[Trace], lims: list) -> Figure:
-    rcParams.update({'font.size': 9})
+@styled
+def create(path: str, name: str, header: dict, traces: List[Trace], lims: list, show: bool = True) -> Figure:
     log.info('Making noise plot...')
     title = 'Noise plot: Log number: {}{}{}'.format(header['logNum'], (10 * ' '), path)
-    fig = plt.figure(title, figsize=(16, 8))
+    fig = new_figure(title, (16, 8), show)
     # gridspec devides window into 25 horizontal, 31 vertical fields
-    gs1 = GridSpec(25, 3 * 10 + 2, wspace=0.6, hspace=0.7, left=0.04, right=1., bottom=0.05, top=0.97)
+    gs1 = GridSpec(25, 3 * 10 + 2, figure=fig, wspace=0.6, hspace=0.7, left=0.04, right=1., bottom=0.05, top=0.97)
 
-    max_noise_gyro = np.max(
-        [traces[0].noise_gyro['max'], traces[1].noise_gyro['max'], traces[2].noise_gyro['max']]) + 1.
-    max_noise_debug = np.max(
-        [traces[0].noise_debug['max'], traces[1].noise_debug['max'], traces[2].noise_debug['max']]) + 1.
-    max_noise_d = np.max([traces[0].noise_d['max'], traces[1].noise_d['max'], traces[2].noise_d['max']]) + 1.
+    max_noise_gyro = np.max([tr.noise_gyro['max'] for tr in traces]) + 1.
+    max_noise_debug = np.max([tr.noise_debug['max'] for tr in traces]) + 1.
+    # D-term of yaw is not plotted
+    max_noise_d = np.max([tr.noise_d['max'] for tr in traces if tr.name != 'yaw'] + [0.]) + 1.
 
-    meanspec = np.array([traces[0].noise_gyro['hist2d_sm'].mean(axis=1).flatten(),
-                         traces[1].noise_gyro['hist2d_sm'].mean(axis=1).flatten(),
-                         traces[2].noise_gyro['hist2d_sm'].mean(axis=1).flatten()], dtype=np.float64)
+    meanspec = np.array([tr.noise_gyro['hist2d_sm'].mean(axis=1).flatten() for tr in traces], dtype=np.float64)
     thresh = 100.
     mask = to_mask(traces[0].noise_gyro['freq_axis'].clip(thresh - 1e-9, thresh))
     meanspec_max = np.max(meanspec * mask[:-1])
@@ -55,9 +54,9 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
     else:
         lims = np.array(lims)
 
-    cax_gyro = plt.subplot(gs1[0, 0:7])
-    cax_debug = plt.subplot(gs1[0, 8:15])
-    cax_d = plt.subplot(gs1[0, 16:23])
+    cax_gyro = fig.add_subplot(gs1[0, 0:7])
+    cax_debug = fig.add_subplot(gs1[0, 8:15])
+    cax_d = fig.add_subplot(gs1[0, 16:23])
     cmap = 'viridis'
 
     axes_gyro = []
@@ -71,19 +70,18 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
         else:
             pltlim = [tr.noise_gyro['freq_axis'][-0], tr.noise_gyro['freq_axis'][-1]]
         # gyro plots
-        ax0 = plt.subplot(gs1[1 + i * 8:1 + i * 8 + 8, 0:7])
+        ax0 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 8, 0:7])
         if len(axes_gyro):
             ax0.sharex(axes_gyro[0])
         axes_gyro.append(ax0)
         ax0.set_title('gyro ' + tr.name, y=0.88, color='w')
-        pc0 = plt.pcolormesh(tr.noise_gyro['throt_axis'], tr.noise_gyro['freq_axis'],
-                             tr.noise_gyro['hist2d_sm'] + 1., norm=colors.LogNorm(vmin=lims[0, 0], vmax=lims[0, 1]),
-                             cmap=cmap)
+        pc0 = heatmap(ax0, tr.noise_gyro['throt_axis'], tr.noise_gyro['freq_axis'], tr.noise_gyro['hist2d_sm'] + 1.,
+                      norm=colors.LogNorm(vmin=lims[0, 0], vmax=lims[0, 1]), cmap=cmap)
         ax0.set_ylabel('frequency in Hz')
         ax0.grid()
         ax0.set_ylim(pltlim)
-        if i < 2:
-            plt.setp(ax0.get_xticklabels(), visible=False)
+        if i < len(traces) - 1:
+            ax0.tick_params(labelbottom=False)
         else:
             ax0.set_xlabel('throttle in %')
 
@@ -97,19 +95,19 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
                      transform=ax0.transAxes, fontdict={'color': 'white'})
 
         # debug plots
-        ax1 = plt.subplot(gs1[1 + i * 8:1 + i * 8 + 8, 8:15])
+        ax1 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 8, 8:15])
         if len(axes_debug):
             ax1.sharex(axes_debug[0])
         axes_debug.append(ax1)
         ax1.set_title('debug ' + tr.name, y=0.88, color='w')
-        pc1 = plt.pcolormesh(tr.noise_debug['throt_axis'], tr.noise_debug['freq_axis'],
-                             tr.noise_debug['hist2d_sm'] + 1.,
-                             norm=colors.LogNorm(vmin=lims[1, 0], vmax=lims[1, 1]), cmap=cmap)
+        pc1 = heatmap(ax1, tr.noise_debug['throt_axis'], tr.noise_debug['freq_axis'],
+                      tr.noise_debug['hist2d_sm'] + 1., norm=colors.LogNorm(vmin=lims[1, 0], vmax=lims[1, 1]),
+                      cmap=cmap)
         ax1.set_ylabel('frequency in Hz')
         ax1.grid()
         ax1.set_ylim(pltlim)
-        if i < 2:
-            plt.setp(ax1.get_xticklabels(), visible=False)
+        if i < len(traces) - 1:
+            ax1.tick_params(labelbottom=False)
         else:
             ax1.set_xlabel('throttle in %')
 
@@ -125,19 +123,19 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
                      horizontalalignment='center', verticalalignment='center',
                      transform=ax1.transAxes, fontdict={'color': 'white'})
 
-        if i < 2:
+        if tr.name != 'yaw':
             # dterm plots
-            ax2 = plt.subplot(gs1[1 + i * 8:1 + i * 8 + 8, 16:23])
+            ax2 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 8, 16:23])
             if len(axes_d):
                 ax2.sharex(axes_d[0])
             axes_d.append(ax2)
             ax2.set_title('D-term ' + tr.name, y=0.88, color='w')
-            pc2 = plt.pcolormesh(tr.noise_d['throt_axis'], tr.noise_d['freq_axis'], tr.noise_d['hist2d_sm'] + 1.,
-                                 norm=colors.LogNorm(vmin=lims[2, 0], vmax=lims[2, 1]), cmap=cmap)
+            pc2 = heatmap(ax2, tr.noise_d['throt_axis'], tr.noise_d['freq_axis'], tr.noise_d['hist2d_sm'] + 1.,
+                          norm=colors.LogNorm(vmin=lims[2, 0], vmax=lims[2, 1]), cmap=cmap)
             ax2.set_ylabel('frequency in Hz')
             ax2.grid()
             ax2.set_ylim(pltlim)
-            plt.setp(ax2.get_xticklabels(), visible=False)
+            ax2.tick_params(labelbottom=False)
 
             fig.colorbar(pc2, cax_d, orientation='horizontal')
             cax_d.xaxis.set_ticks_position('top')
@@ -149,11 +147,12 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
                          transform=ax2.transAxes, fontdict={'color': 'white'})
         else:
             # throttle plots
-            ax21 = plt.subplot(gs1[1 + i * 8:1 + i * 8 + 4, 16:23])
-            ax22 = plt.subplot(gs1[1 + i * 8 + 5:1 + i * 8 + 8, 16:23])
+            ax21 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 4, 16:23])
+            ax22 = fig.add_subplot(gs1[1 + i * 8 + 5:1 + i * 8 + 8, 16:23])
             ax21.bar(tr.throt_scale[:-1], tr.throt_hist * 100., width=1., align='edge', color='black', alpha=0.2,
                      label='throttle distribution')
-            ax21.sharex(axes_d[0])
+            if len(axes_d):
+                ax21.sharex(axes_d[0])
             ax21.vlines(header['tpa_percent'], 0., 100., label='tpa', colors='red', alpha=0.5)
             ax21.grid()
             ax21.set_ylim([0., np.max(tr.throt_hist) * 100. * 1.1])
@@ -162,7 +161,8 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
             ax21.set_xlim([0., 100.])
             handles, labels = ax21.get_legend_handles_labels()
             ax21.legend(handles[::-1], labels[::-1])
-            ax22.fill_between(tr.time, 0., tr.throttle, label='throttle input', facecolors='black', alpha=0.2)
+            ax22.fill_between(*decimate(tr.time, tr.throttle, pixel_width(ax22)), 0., label='throttle input',
+                              facecolors='black', alpha=0.2)
             ax22.hlines(header['tpa_percent'], tr.time[0], tr.time[-1], label='tpa', colors='red', alpha=0.5)
 
             ax22.set_ylabel('throttle in %')
@@ -173,7 +173,7 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
             ax22.set_xlabel('time in s')
 
         # transmission plots
-        ax3 = plt.subplot(gs1[1 + i * 8:1 + i * 8 + 8, 24:30])
+        ax3 = fig.add_subplot(gs1[1 + i * 8:1 + i * 8 + 8, 24:30])
         if len(axes_trans):
             ax3.sharex(axes_trans[0])
         axes_trans.append(ax3)
@@ -181,7 +181,7 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
         ax3.set_ylim(lims[3])
         ax3.set_ylabel(tr.name + ' gyro noise a.u.')
         ax3.grid()
-        ax3r = plt.twinx(ax3)
+        ax3r = ax3.twinx()
         ax3r.plot(tr.noise_gyro['freq_axis'][:-1], tr.filter_trans * 100., label=tr.name + ' filter transmission')
         ax3r.set_ylabel('transmission in %')
         ax3r.set_ylim([0., 100.])
@@ -189,13 +189,13 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
         lines, labels = ax3.get_legend_handles_labels()
         lines2, labels2 = ax3r.get_legend_handles_labels()
         ax3r.legend(lines + lines2, labels + labels2, loc=1)
-        if i < 2:
-            plt.setp(ax3.get_xticklabels(), visible=False)
+        if i < len(traces) - 1:
+            ax3.tick_params(labelbottom=False)
         else:
             ax3.set_xlabel('frequency in hz')
 
     meanfreq = 1. / (traces[0].time[1] - traces[0].time[0])
-    ax4 = plt.subplot(gs1[12, -1])
+    ax4 = fig.add_subplot(gs1[12, -1])
     t = BANNER + "| Betaflight: Version " + header['version'] + ' | Craftname: ' + header['craftName'] + \
         ' | meanFreq: ' + str(int(meanfreq)) + ' | rcRate/Expo: ' + header['rcRate'] + '/' + header['rcExpo'] + '\n' + \
         'rcYawRate/Expo: ' + header['rcYawRate'] + '/' + \
@@ -207,8 +207,8 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
     ax4.text(0, 0, t, ha='left', va='center', rotation=90, color='grey', alpha=0.5, fontsize=TEXTSIZE)
     ax4.axis('off')
 
-    ax5l = plt.subplot(gs1[:1, 24:27])
-    ax5r = plt.subplot(gs1[:1, 27:30])
+    ax5l = fig.add_subplot(gs1[:1, 24:27])
+    ax5r = fig.add_subplot(gs1[:1, 27:30])
     ax5l.axis('off')
     ax5r.axis('off')
     filt_settings_l = 'G lpf type: ' + header['gyro_lpf'] + ' at ' + header['gyro_lowpass_hz'] + '\n' + \
@@ -221,6 +221,7 @@ def create(path: str, name: str, header: dict, traces: List[Trace], lims: list)
     ax5l.text(0, 0, filt_settings_l, ha='left', fontsize=TEXTSIZE)
     ax5r.text(0, 0, filt_settings_r, ha='left', fontsize=TEXTSIZE)
 
+    fig.freeze()
     log.info('Saving as image...')
-    plt.savefig(path[:-13] + name + '_' + str(header['logNum']) + '_noise.png')
+    writer.save(fig, path[:-13] + name + '_' + str(header['logNum']) + '_noise.png', release=not show)
     return fig
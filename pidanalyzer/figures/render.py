@@ -0,0 +1,88 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.axes import Axes
+from matplotlib.colors import Colormap
+
+
+def fading_cmap(name: str, alpha: float) -> Colormap:
+    """
+    :return: copy of a registered colormap with alpha rising from 0 to alpha
+    """
+    cmap = colormaps[name]
+    cmap._init()
+    cmap._lut[:-3, -1] = np.abs(np.linspace(0., alpha, cmap.N, dtype=np.float64))
+    return cmap
+
+
+def pixel_width(ax: Axes) -> int:
+    """
+    :return: width of ax in pixels
+    """
+    fig = ax.get_figure()
+    return max(1, int(np.ceil(ax.get_position().width * fig.get_figwidth() * fig.dpi)))
+
+
+def thin_grid(ax: Axes, x: np.ndarray, y: np.ndarray, z: np.ndarray, xlim: Sequence[float],
+              ylim: Sequence[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Keeps every n-th column and row of a smooth, uniform grid, about one per pixel of ax within xlim and ylim.
+    Contours of the thinned grid look the same, but take much less time.
+
+    :param z: values of shape (len(y), len(x))
+    :return: x, y and z of the kept columns and rows
+    """
+    fig = ax.get_figure()
+    position = ax.get_position()
+    steps = []
+    for axis, lim, inches in ((x, xlim, position.width * fig.get_figwidth()),
+                              (y, ylim, position.height * fig.get_figheight())):
+        # samples per pixel
+        density = abs(lim[1] - lim[0]) / abs(axis[1] - axis[0]) / (inches * fig.dpi)
+        steps.append(max(1, int(density)))
+    return x[::steps[0]], y[::steps[1]], z[::steps[1], ::steps[0]]
+
+
+def decimate(x: np.ndarray, y: np.ndarray, pixels: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduces a line of uniformly spaced x to the first, last, min and max sample of each of pixels columns,
+    in their order. Drawn over pixels columns, this looks like the full line.
+
+    :param pixels: number of columns, see pixel_width
+    :return: x and y of the kept samples
+    """
+    length = len(y)
+    size = length // pixels
+    if size < 4:
+        return x, y
+    blocks = np.asarray(y[:size * pixels]).reshape(pixels, size)
+    starts = np.arange(pixels) * size
+    index = np.concatenate([starts, starts + size - 1, starts + blocks.argmin(axis=1), starts + blocks.argmax(axis=1),
+                            np.arange(size * pixels, length)])
+    index = np.unique(index)
+    return np.asarray(x[index]), np.asarray(y[index])
+
+
+def _uniform(edges: np.ndarray) -> bool:
+    steps = np.diff(edges)
+    return len(steps) > 0 and np.allclose(steps, steps[0], rtol=1e-6, atol=0.)
+
+
+def _extent(axis: np.ndarray, cells: int) -> Tuple[float, float]:
+    # edges are given for flat shading, centers for nearest shading
+    if len(axis) == cells + 1:
+        return axis[0], axis[-1]
+    half = (axis[1] - axis[0]) / 2.
+    return axis[0] - half, axis[-1] + half
+
+
+def heatmap(ax: Axes, x: np.ndarray, y: np.ndarray, c: np.ndarray, **kwargs):
+    """Like ax.pcolormesh(x, y, c, **kwargs), but draws an image if the grid is uniform, which renders much faster.
+
+    :return: the image or mesh
+    """
+    c = np.asarray(c)
+    if not (len(x) in (c.shape[1], c.shape[1] + 1) and len(y) in (c.shape[0], c.shape[0] + 1)
+            and min(len(x), len(y)) > 1 and _uniform(x) and _uniform(y)):
+        return ax.pcolormesh(x, y, c, **kwargs)
+    return ax.imshow(c, extent=_extent(x, c.shape[1]) + _extent(y, c.shape[0]), origin='lower', aspect='auto',
+                     interpolation='nearest', **kwargs)
@@ -1,57 +1,52 @@
 from typing import List
 
 import numpy as np
-from matplotlib import pyplot as plt, rcParams
 from matplotlib.figure import Figure
-from matplotlib.gridspec import GridSpec
 
-from . import TEXTSIZE
-from .. import BANNER
+from . import new_figure, styled
+from .render import fading_cmap, thin_grid
+from .writer import writer
 from ..common import log
 from ..trace import Trace
 
 
-def create(path: str, name: str, header: dict, traces: List[Trace]) -> Figure:
+@styled
+def create(path: str, name: str, header: dict, traces: List[Trace], show: bool = True) -> Figure:
     log.info('Making small PID plot...')
 
-    fig = plt.figure('Small response plot: Log number: ' + header['logNum'] + '          ' + path,
-                     figsize=(7, 12))
-    
+    fig = new_figure('Small response plot: Log number: ' + header['logNum'] + '          ' + path, (7, 12), show)
+
     colors = ['tab:red', 'tab:green', 'tab:blue']
     contourcolors = ['Reds', 'Greens', 'Blues']
 
+    # limits of the plots
+    xlim, ylim = [-0.001, 0.501], [0., 2]
     for i, trace in enumerate(traces):
-        cmap = plt.cm.get_cmap(contourcolors[i])
-        cmap._init()
-        alphas = np.abs(np.linspace(0., 0.2, cmap.N, dtype=np.float64))
-        cmap._lut[:-3, -1] = alphas
-        ax3 = plt.subplot(3, 1, i + 1)
-        plt.contourf(*trace.resp_low[2], cmap=cmap, linestyles=None, antialiased=True,
-                     levels=np.linspace(0, 1, 20, dtype=np.float64))
-        plt.plot(trace.time_resp, trace.resp_low[0],
+        ax3 = fig.add_subplot(3, 1, i + 1)
+        ax3.contourf(*thin_grid(ax3, *trace.resp_low[2], xlim, ylim), cmap=fading_cmap(contourcolors[i], 0.2),
+                     linestyles=None, antialiased=True, levels=np.linspace(0, 1, 20, dtype=np.float64))
+        ax3.plot(trace.time_resp, trace.resp_low[0],
                  label=trace.name + ' step response ' + '($<' + str(int(Trace.threshold)) + '$) '
                        + ' PIDFF ' + header[trace.name + 'PID'], color = colors[i])
 
         if trace.high_mask.sum() > 0:
-            cmap = plt.cm.get_cmap('Oranges')
-            cmap._init()
-            alphas = np.abs(np.linspace(0., 0.5, cmap.N, dtype=np.float64))
-            cmap._lut[:-3, -1] = alphas
-            plt.contourf(*trace.resp_high[2], cmap=cmap, linestyles=None, antialiased=True,
-                         levels=np.linspace(0, 1, 20, dtype=np.float64))
-            plt.plot(trace.time_resp, trace.resp_high[0],
+            ax3.contourf(*thin_grid(ax3, *trace.resp_high[2], xlim, ylim), cmap=fading_cmap('Oranges', 0.5),
+                         linestyles=None, antialiased=True, levels=np.linspace(0, 1, 20, dtype=np.float64))
+            ax3.plot(trace.time_resp, trace.resp_high[0],
                      label=trace.name + ' step response ' + '($>' + str(int(Trace.threshold)) + '$) '
                            + ' PIDFF ' + header[trace.name + 'PID'])
-        plt.xlim([-0.001, 0.501])
+        ax3.set_xlim(xlim)
 
-        plt.legend(loc=1)
-        plt.ylim([0., 2])
-        plt.ylabel('strength')
+        ax3.legend(loc=1)
+        ax3.set_ylim(ylim)
+        ax3.set_ylabel('strength')
         ax3.get_yaxis().set_label_coords(-0.1, 0.5)
-        plt.xlabel('response time in s')
+        ax3.set_xlabel('response time in s')
+
+        ax3.grid()
 
-        plt.grid()
-        
+    fig.freeze()
     log.info('Saving as image...')
-    plt.savefig(path[:-13] + name + '_' + str(header['logNum']) + '_response.pdf', bbox_inches="tight")
+    writer.save(fig, path[:-13] + name + '_' + str(header['logNum']) + '_response.pdf', release=not show,
+                bbox_inches="tight")
     return fig
@@ -0,0 +1,70 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from matplotlib.figure import Figure
+
+from ..common import log
+from ..profiling import span
+
+# number of figures rendered and encoded at the same time
+WRITER_THREADS = 2
+
+
+class FigureWriter:
+    """Saves figures in background threads, while the next log is analyzed and drawn.
+
+    A figure must not be changed after it was handed to save. Figures which aren't shown are cleared after
+    saving, which releases their data without waiting for the garbage collector.
+    """
+
+    def __init__(self, threads: int = WRITER_THREADS):
+        self.threads = threads
+        self._pool = None  # type: Optional[ThreadPoolExecutor]
+        self._pid = None
+        self._pending = []  # type: List[Future]
+        self._lock = threading.Lock()
+
+    def save(self, fig: Figure, path: str, release: bool = True, **kwargs) -> Future:
+        """Saves fig to path, see Figure.savefig.
+
+        :param release: clear fig when saved, for figures which aren't shown
+        :return: future of the saved path
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads of a parent process don't exist in forked workers
+                self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix='FigureWriter')
+                self._pid = os.getpid()
+                self._pending = []
+            future = self._pool.submit(_save, fig, path, release, kwargs)
+            self._pending.append(future)
+        return future
+
+    def wait(self):
+        """Waits until all figures are saved.
+
+        :raise: the first error of saving a figure
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        errors = [future.exception() for future in pending]
+        for error in errors:
+            if error is not None:
+                raise error
+
+
+def _save(fig: Figure, path: str, release: bool, kwargs: dict) -> str:
+    try:
+        with span('savefig', file=path):
+            fig.savefig(path, **kwargs)
+        log.info('Saved %r' % path)
+        return path
+    finally:
+        if release:
+            fig.clear()
+
+
+# writer of the figures of this process
+writer = FigureWriter()
@@ -0,0 +1,419 @@
+import io
+import stat
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from matplotlib import pyplot as plt
+from pandas import read_csv
+
+from .analysis import figure_header, p_gain
+from .common import *
+from .figures import live_figure, noise_figure, small_response_figure
+from .figures.writer import writer
+from .loaders.blackbox_log_viewer_csv_loader import BlackboxLogViewerCsvLoader, header_fields, session_data
+from .trace import (MIN_WINDOWS, NOISE_ATTRS, NoiseHist, Trace, filter_transmission, input_masks, masked_throttle,
+                    mode_avrs, mode_hist, pid_in, plotted_noise_sources, response_deviation, response_quality,
+                    response_weights, stepcalc, thr_response_counts, thr_response_hist, window_view)
+
+# frames used to estimate the sample interval of a live source
+LIVE_RATE_FRAMES = 256
+# max bytes read from a live source per refresh
+LIVE_READ_BYTES = 8 * 1024 ** 2
+
+
+class LineSource:
+    """Complete lines of a growing file, a named pipe or stdin ('-'), read without blocking.
+
+    Files are followed until interrupted, pipes are closed when the writer closes them.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the source, '-' for stdin
+        """
+        # opening a named pipe blocks until there is a writer
+        self._fd = sys.stdin.fileno() if path == '-' else os.open(path, os.O_RDONLY)
+        self._pipe = not stat.S_ISREG(os.fstat(self._fd).st_mode)
+        if self._pipe:
+            os.set_blocking(self._fd, False)
+        self._partial = b''
+        self.closed = False
+
+    def read(self) -> List[str]:
+        """
+        :return: the lines completed since the last call, without line breaks
+        """
+        chunks = []
+        size = 0
+        while size < LIVE_READ_BYTES:
+            try:
+                data = os.read(self._fd, LIVE_READ_BYTES - size)
+            except BlockingIOError:
+                break
+            if not data:
+                # end of a file only means no new data yet
+                self.closed = self._pipe
+                break
+            chunks.append(data)
+            size += len(data)
+        lines = (self._partial + b''.join(chunks)).split(b'\n')
+        self._partial = b'' if self.closed else lines.pop()
+        return [line.decode('latin-1').rstrip('\r') for line in lines if line.strip()]
+
+
+class FrameReader:
+    """Parses the lines of a CSV log as written by Blackbox Log Viewer or blackbox_decode.
+    """
+
+    def __init__(self, temp_path: str):
+        """
+        :param temp_path: tempFile of the header, the plots are named after it
+        """
+        self.header = headerdict(temp_path)
+        self._usecols = None
+        self._time_field = None
+        self._frames = 0
+
+    def parse(self, lines: Sequence[str]) -> Optional[dict]:
+        """
+        :param lines: consecutive lines of the log
+        :return: frames of the data rows in lines, None if there are none
+        """
+        rows = []
+        for line in lines:
+            if self._usecols is not None:
+                rows.append(line)
+            elif CSV_HEADER_ROW_FRAGMENT in line:
+                self._read_fields(line)
+            else:
+                self.header.update(header_fields(line))
+        if not rows:
+            return None
+        data = read_csv(io.StringIO('\n'.join(rows)), header=None, usecols=list(self._usecols), dtype=np.float64,
+                        engine='c')
+        columns = {name: data[i].to_numpy() for i, name in self._usecols.items()}
+        # missing fields are reported for the first frames only
+        frames = session_data(columns, self._time_field, warn=self._frames == 0)
+        self._frames += len(data)
+        return frames
+
+    def _read_fields(self, line: str):
+        names = [strip_quotes(name) for name in line.split(',')]
+        self._time_field = 'time (us)' if 'time (us)' in names else 'time'
+        fields = [self._time_field] + BlackboxLogViewerCsvLoader.CSV_FIELDS[1:]
+        self._usecols = {i: name for i, name in enumerate(names) if name in fields}
+
+
+class LiveTrace(Trace):
+    """Trace of one axis of a live source, see LiveAnalysis.
+
+    Each completed window is deconvolved once, its response is added to running histograms and the results
+    are derived from them. resp_quality of a window is rated against the running response at the time it's
+    added, so thr_response may differ slightly from the one of the complete log.
+    """
+
+    def __init__(self, name: str, dt: float):
+        """
+        :param name: name of the axis
+        :param dt: sample interval of the uniform time base
+        """
+        self.name = name
+        self.dt = -dt
+        self.time = np.array([0., dt])
+        self.flen = stepcalc(self.time, Trace.framelen)
+        self.rlen = stepcalc(self.time, Trace.resplen)
+        self.time_resp = np.arange(self.rlen, dtype=np.float64) * dt
+        self.window = np.hanning(self.flen)
+        self._vertrange, self._vertbins = [-1.5, 3.5], 1000
+        # running histograms of the toolow, low and high masked responses
+        self._hist = np.zeros((3, self._vertbins, self.rlen), dtype=np.float64)
+        self._high = []
+        self._toolow = []
+        self._thr = []
+        self._thr_counts = 0.
+        self._computed = set(Trace._lazy_attrs.values())
+
+    def add_windows(self, stacks: Dict[str, np.ndarray]):
+        """Adds the step responses of newly completed windows.
+
+        :param stacks: time, input, gyro and throttle windows
+        """
+        spec_sm, _, _, max_in, max_thr = self.stack_response(stacks, self.window)
+        # short high or valid inputs are ignored by update, once the windows of all batches are counted
+        low, high, toolow = input_masks(max_in, self.threshold, 0)
+        self._hist += mode_hist(spec_sm, response_weights(low, high, toolow, always_high=True), self.time_resp,
+                                self._vertrange, self._vertbins)
+        self._high.append(high)
+        self._toolow.append(toolow)
+        self.update()
+
+        # same as resp_quality of the complete log, if it has windows of good and bad quality
+        quality = response_quality(response_deviation(spec_sm, self.resp_sm[0]), fixed=True)
+        thr = masked_throttle(max_thr, toolow, quality)
+        self._thr.append(thr)
+        self._thr_counts = self._thr_counts + thr_response_counts(thr, self.time_resp, spec_sm, toolow)
+
+    def update(self):
+        # derives the responses from the running histograms
+        high = np.concatenate(self._high)
+        # short high or valid inputs are ignored, as in low_high_mask
+        valid = [np.count_nonzero(np.concatenate(self._toolow)) >= MIN_WINDOWS, np.count_nonzero(high) >= MIN_WINDOWS]
+        hist = self._hist * np.array([valid[0], valid[0], valid[0] and valid[1]], dtype=np.float64)[:, None, None]
+        resps = mode_avrs(hist, self.time_resp, self._vertrange, self._vertbins)
+        self.resp_sm, self.resp_low = resps[0], resps[1]
+        self.high_mask = high * float(valid[1])
+        if self.high_mask.sum() > 0:
+            self.resp_high = resps[2]
+        elif 'resp_high' in self.__dict__:
+            del self.resp_high
+        if self._thr:
+            self.thr_response = thr_response_hist(np.concatenate(self._thr), self._thr_counts, self.time_resp)
+
+
+class LiveAnalysis:
+    """Incremental analysis of the frames of a live source.
+
+    Frames are resampled to a uniform time base, whose interval is estimated from the first frames. Each
+    newly completed response or noise window is analyzed once and added to the running results of the
+    traces. Samples are dropped as soon as no window needs them anymore.
+    """
+
+    def __init__(self, header: dict, axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES):
+        """
+        :param header: header of the log, with PIDs and maxThrottle
+        :param axes: axes to analyze, see AXES
+        :param analyses: analyses to run, see ANALYSES
+        """
+        self.header = header
+        self.axes = [axis for axis in AXES if axis in axes]
+        self.analyses = analyses
+        self.gains = {axis: p_gain(header, axis) for axis in self.axes}
+        self.traces = []
+        self.dt = None
+        self._pending = []
+        self._t0 = None
+        self._last = None
+        self._next = 0
+        self._buffer = {}
+        self._base = 0
+        self._noise = None
+        self._throt_scale = np.linspace(0, 100, 101, dtype=np.float64)
+        self._throt_counts = np.zeros(100)
+        # resampled throttle of the whole log, for the noise plot
+        self._throttle = []
+        # number of windows analyzed so far
+        self.response_windows = 0
+        self.noise_windows = 0
+
+    def add(self, frames: dict):
+        """Adds new frames and analyzes the windows they complete.
+
+        :param frames: consecutive frames, as returned by FrameReader.parse
+        """
+        time = np.asarray(frames['time_us'], dtype=np.float64)
+        throttle = ((frames['throttle'] - 1000.) / (float(self.header['maxThrottle']) - 1000.)) * 100.
+        channels = {'throttle': throttle}
+        for axis, gain in self.gains.items():
+            si = str(AXES.index(axis))
+            channels.update({axis + ' input': pid_in(frames['PID loop in' + si], frames['gyroData' + si], gain),
+                             axis + ' gyro': frames['gyroData' + si], axis + ' d_err': frames['d_err' + si],
+                             axis + ' debug': frames['debug' + si]})
+        if self.dt is None:
+            self._pending.append((time, channels))
+            if sum(len(t) for t, _ in self._pending) < LIVE_RATE_FRAMES:
+                return
+            time = np.concatenate([t for t, _ in self._pending])
+            channels = {key: np.concatenate([c[key] for _, c in self._pending]) for key in channels}
+            self._pending = []
+            # same interval as the uniform time base of equalize_channels
+            self._start((time[-1] - time[0]) / (len(time) - 1))
+        self._resample(time, channels)
+        if 'response' in self.analyses:
+            self._add_response_windows()
+        if 'noise' in self.analyses:
+            self._add_noise_windows()
+        self._drop()
+
+    def _start(self, dt: float):
+        self.dt = dt
+        self.traces = [LiveTrace(axis, dt) for axis in self.axes]
+        if 'noise' in self.analyses and self.traces:
+            self._noise_len = stepcalc(np.array([0., dt]), Trace.noise_framelen)
+            self._noise_sources = [plotted_noise_sources(axis) for axis in self.axes]
+            self._noise = NoiseHist(dt, np.hanning(self._noise_len), sum(map(len, self._noise_sources)))
+
+    def _resample(self, time: np.ndarray, channels: Dict[str, np.ndarray]):
+        # interpolates the frames on the uniform time base, same scheme as equalize_channels.
+        # the last frame is kept to interpolate up to the next frames.
+        if self._last is not None:
+            time = np.concatenate([[self._last[0]], time])
+            channels = {key: np.concatenate([[self._last[1][key]], value]) for key, value in channels.items()}
+        else:
+            self._t0 = time[0]
+        # frames going back in time are dropped
+        keep = np.concatenate([[True], time[1:] > np.maximum.accumulate(time)[:-1]])
+        time = time[keep]
+        channels = {key: value[keep] for key, value in channels.items()}
+        self._last = time[-1], {key: value[-1] for key, value in channels.items()}
+        if len(time) < 2:
+            return
+
+        stop = int((time[-1] - self._t0) / self.dt) + 1
+        newtime = self._t0 + np.arange(self._next, stop, dtype=np.float64) * self.dt
+        hi = np.searchsorted(time, newtime).clip(1, len(time) - 1)
+        lo = hi - 1
+        dt_new = newtime - time[lo]
+        dt_old = time[hi] - time[lo]
+        # frames within equalize_tol samples of the time base are taken as they are, as in equalize_channels
+        tol = Trace.equalize_tol * self.dt
+        take = np.where(np.abs(dt_new) <= tol, lo, np.where(np.abs(dt_old - dt_new) <= tol, hi, -1))
+        resampled = {'time': newtime}
+        for key, value in channels.items():
+            y_lo = value[lo]
+            resampled[key] = np.where(take < 0, (value[hi] - y_lo) / dt_old * dt_new + y_lo, value[take])
+        for key, values in resampled.items():
+            self._buffer[key] = np.concatenate([self._buffer.get(key, np.zeros(0)), values])
+        self._throt_counts += np.histogram(resampled['throttle'], self._throt_scale)[0]
+        self._throttle.append(resampled['throttle'])
+        self._next = max(self._next, stop)
+
+    def _completed(self, done: int, length: int, superpos: int, lag: int = 0) -> Tuple[int, slice]:
+        # number of windows completed since done windows, counted as in Trace.winstacker but lag windows behind,
+        # and the slice of the buffer holding them
+        shift = int(length / superpos)
+        count = max(0, int(self._next / shift) - superpos - lag - done)
+        start = done * shift - self._base
+        return count, slice(start, start + (count - 1) * shift + length)
+
+    def _add_response_windows(self):
+        if not self.traces:
+            return
+        flen = self.traces[0].flen
+        count, part = self._completed(self.response_windows, flen, Trace.superpos)
+        if not count:
+            return
+        shift = int(flen / Trace.superpos)
+        shared = {key: window_view(self._buffer[key][part], flen, shift, count) for key in ('time', 'throttle')}
+        for trace in self.traces:
+            stacks = {key: window_view(self._buffer[trace.name + ' ' + key][part], flen, shift, count)
+                      for key in ('input', 'gyro')}
+            trace.add_windows(dict(shared, **stacks))
+        self.response_windows += count
+
+    def _add_noise_windows(self):
+        if self._noise is None:
+            return
+        # the last 2s are held back, as the landing is sliced off in stackspectra
+        cut = int(Trace.noise_superpos * 2. / Trace.noise_framelen)
+        count, part = self._completed(self.noise_windows, self._noise_len, Trace.noise_superpos, cut)
+        if not count:
+            return
+        shift = int(self._noise_len / Trace.noise_superpos)
+        throttle = window_view(self._buffer['throttle'][part], self._noise_len, shift, count)
+        stacks = [window_view(self._buffer[axis + ' ' + key][part], self._noise_len, shift, count)
+                  for axis, keys in zip(self.axes, self._noise_sources) for key in keys]
+        # batches of windows are bounded by Trace.noise_batch, as in stackspectra
+        batch = max(1, Trace.noise_batch // (len(stacks) * self._noise.nfft))
+        for start in range(0, count, batch):
+            self._noise.add(throttle[start:start + batch], [stack[start:start + batch] for stack in stacks])
+        self.noise_windows += count
+
+    def _drop(self):
+        # drops the samples before the next windows
+        starts = [self._next]
+        if 'response' in self.analyses and self.traces:
+            starts.append(self.response_windows * int(self.traces[0].flen / Trace.superpos))
+        if self._noise is not None:
+            starts.append(self.noise_windows * int(self._noise_len / Trace.noise_superpos))
+        drop = min(starts) - self._base
+        if drop > 0:
+            self._buffer = {key: value[drop:] for key, value in self._buffer.items()}
+            self._base += drop
+
+    def results(self) -> List[LiveTrace]:
+        """
+        :return: the traces, with the noise spectrograms of the windows added so far
+        """
+        # same as np.histogram with density
+        throt_hist = self._throt_counts / np.diff(self._throt_scale) / max(self._throt_counts.sum(), 1.)
+        self._throttle = [np.concatenate(self._throttle)]
+        time = self._t0 + np.arange(len(self._throttle[0]), dtype=np.float64) * self.dt
+        for trace in self.traces:
+            trace.throt_hist, trace.throt_scale = throt_hist, self._throt_scale
+            trace.time, trace.throttle = time, self._throttle[0]
+        if self._noise is not None:
+            spectra = iter(self._noise.result())
+            for trace, keys in zip(self.traces, self._noise_sources):
+                for key in keys:
+                    setattr(trace, NOISE_ATTRS[key], next(spectra))
+                trace.filter_trans = filter_transmission(trace.noise_gyro, trace.noise_debug)
+        return self.traces
+
+    @property
+    def ready(self) -> bool:
+        # True when there are results of the response or the noise analysis
+        return bool(self.response_windows or self.noise_windows)
+
+
+def run(source: str, name: str, axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES,
+        noise_bounds: list = DEFAULT_NOISE_BOUNDS, refresh: float = 1., hide: bool = False) -> int:
+    """Analyzes a live source of CSV frames and shows the running results, refreshed every refresh seconds.
+
+    When the source is closed or the live plot window is closed, the plots of the final results are saved.
+
+    :param source: path of a growing CSV log or of a named pipe, '-' for stdin
+    :param name: plot name
+    :param refresh: refresh interval in s
+    :param hide: don't show the live plot window
+    :return: 0 if any windows were analyzed, else 1
+    """
+    directory = os.getcwd() if source == '-' else os.path.dirname(source)
+    root = 'live' if source == '-' else os.path.splitext(os.path.basename(source))[0]
+    tmp_path = os.path.join(directory, name)
+    os.makedirs(tmp_path, exist_ok=True)
+    reader = FrameReader(os.path.join(tmp_path, '%s_temp0.01.csv' % root))
+    log.info('Reading live frames from %s' % ('stdin' if source == '-' else repr(source)))
+    lines = LineSource(source)
+    analysis = None
+    fig = None
+    due = time.monotonic()
+    try:
+        while not lines.closed:
+            frames = reader.parse(lines.read())
+            if frames is not None:
+                if analysis is None:
+                    analysis = LiveAnalysis(reader.header, axes, analyses)
+                analysis.add(frames)
+            if analysis is not None and analysis.ready:
+                traces = analysis.results()
+                log.info('%d response window(s), %d noise window(s)'
+                         % (analysis.response_windows, analysis.noise_windows))
+                if not hide:
+                    if fig is None:
+                        fig = live_figure.create(reader.header['tempFile'], figure_header(reader.header))
+                    elif not plt.fignum_exists(fig.number):
+                        break
+                    live_figure.update(fig, traces, analyses)
+            due += refresh
+            if fig is not None:
+                plt.pause(max(due - time.monotonic(), 1e-3))
+            else:
+                time.sleep(max(due - time.monotonic(), 0.))
+    except KeyboardInterrupt:
+        log.info('Live analysis interrupted.')
+
+    if analysis is None or not analysis.ready:
+        log.error('No complete window in live source %r' % source)
+        return 1
+    path = reader.header['tempFile']
+    header = figure_header(reader.header)
+    traces = analysis.results()
+    if analysis.response_windows:
+        small_response_figure.create(path, name, header, traces, show=False)
+    if analysis.noise_windows:
+        noise_figure.create(path, name, header, traces, noise_bounds, show=False)
+    writer.wait()
+    log.info('Live analysis complete.')
+    return 0
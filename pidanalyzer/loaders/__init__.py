@@ -1,4 +1,5 @@
 from .bbl_loader import BblLoader
 from .blackbox_decode_csv_loader import BlackboxDecodeCsvLoader
 from .blackbox_log_viewer_csv_loader import BlackboxLogViewerCsvLoader
-from .loader import Loader, resolve
+from .loader import Loader, find, resolve
+from .native_bbl_loader import NativeBblLoader
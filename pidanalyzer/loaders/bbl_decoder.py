@@ -0,0 +1,589 @@
+"""Decoder for the binary Betaflight blackbox log format.
+
+Frames are parsed sequentially in Python, storing the raw field values of the requested fields only, which is
+slower than blackbox_decode. The predictors are applied afterwards per field. Values are 32 bit integers as in the
+firmware and blackbox_decode, signed or unsigned as flagged in the header, and the time is extended past its rollover.
+"""
+import mmap
+import re
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ..common import log
+
+# field encodings
+SIGNED_VB = 0
+UNSIGNED_VB = 1
+NEG_14BIT = 3
+TAG8_8SVB = 6
+TAG2_3S32 = 7
+TAG8_4S16 = 8
+NULL = 9
+TAG2_3SVARIABLE = 10
+
+# field predictors
+PREDICT_ZERO = 0
+PREDICT_PREVIOUS = 1
+PREDICT_STRAIGHT_LINE = 2
+PREDICT_AVERAGE_2 = 3
+PREDICT_MINTHROTTLE = 4
+PREDICT_MOTOR_0 = 5
+PREDICT_INC = 6
+PREDICT_1500 = 8
+PREDICT_VBATREF = 9
+PREDICT_MINMOTOR = 11
+
+# events
+EVENT_SYNC_BEEP = 0
+EVENT_AUTOTUNE_CYCLE_START = 10
+EVENT_AUTOTUNE_CYCLE_RESULT = 11
+EVENT_AUTOTUNE_TARGETS = 12
+EVENT_INFLIGHT_ADJUSTMENT = 13
+EVENT_LOGGING_RESUME = 14
+EVENT_DISARM = 15
+EVENT_GTUNE_CYCLE_RESULT = 20
+EVENT_FLIGHT_MODE = 30
+EVENT_IMU_FAILURE = 40
+EVENT_LOG_END = 255
+END_OF_LOG_MESSAGE = b'End of log\0'
+
+FRAME_TYPES = b'IPEGHS'
+_FRAME_START = re.compile(b'[' + FRAME_TYPES + b']')
+_I, _P, _E = FRAME_TYPES[:3]
+
+# a time jump below this is a rollover of the 32 bit time if the time went backwards, in us
+MAX_TIME_JUMP = 10 * 1000000
+
+
+class CorruptFrame(Exception):
+    pass
+
+
+def read_headers(content: bytes, start: int = 0) -> Tuple[Dict[str, str], int]:
+    """Reads the 'H name:value' header lines of a log session.
+
+    :param content: log data
+    :param start: offset of the session in content
+    :return: the headers, offset of the first frame
+    """
+    headers = {}
+    pos = start
+    while content[pos:pos + 2] == b'H ':
+        end = content.find(b'\n', pos)
+        if end < 0:
+            end = len(content)
+        name, _, value = content[pos + 2:end].decode('latin-1').partition(':')
+        headers[name] = value
+        pos = end + 1
+    return headers, pos
+
+
+def session_bounds(content: bytes, path: str) -> Tuple[bytes, List[Tuple[int, int]]]:
+    """Finds the recorded sessions in a BBL file.
+
+    :param content: log data
+    :param path: path of the log, for error messages
+    :return: the first line of the log, (start, end) offsets of each session behind its first line
+    """
+    # The first line of the overall BBL file re-appears at the beginning
+    # of each recorded session.
+    first_newline_index = content.find(b'\n')
+    if first_newline_index < 0:
+        raise ValueError('No newline in %dB of log data from %r.'
+                         % (len(content), path))
+    firstline = content[:first_newline_index + 1]
+
+    # session boundaries, same as content.split(firstline)
+    bounds = []
+    start = 0
+    while True:
+        end = content.find(firstline, start)
+        if end < 0:
+            bounds.append((start, len(content)))
+            break
+        bounds.append((start, end))
+        start = end + len(firstline)
+    return firstline, bounds
+
+
+def read_file_headers(path: str) -> List[Dict[str, str]]:
+    """Reads the headers of all sessions of a log file, without decoding any frames.
+
+    :param path: path of the log
+    :return: the headers of each session
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        firstline, bounds = session_bounds(content, path)
+        # the first split is the empty part before the first line
+        return [read_headers(content, start - len(firstline))[0] for start, _ in bounds[1:]]
+
+
+def field_defs(headers: Dict[str, str]) -> Dict[str, dict]:
+    """
+    :return: per frame type, the names, signedness, predictors and encodings of its fields
+    """
+    defs = {}
+    for ftype in FRAME_TYPES.decode():
+        # P frames share names and signedness with I frames
+        names_type = 'I' if ftype == 'P' else ftype
+        names = headers.get('Field %s name' % names_type)
+        if names is None:
+            continue
+        names = names.split(',')
+        defs[ftype] = {'name': names}
+        for key in ('signed', 'predictor', 'encoding'):
+            values = headers.get('Field %s %s' % (ftype, key)) or headers.get('Field %s %s' % (names_type, key))
+            defs[ftype][key] = [int(v) for v in values.split(',')] if values else [0] * len(names)
+    return defs
+
+
+def decode(content: bytes, start: int = 0, end: Optional[int] = None,
+           fields: Optional[Iterable[str]] = None) -> Tuple[Dict[str, str], Dict[str, np.ndarray]]:
+    """Decodes the main (I and P) frames of a log session.
+
+    :param content: log data
+    :param start: offset of the session in content
+    :param end: end of the session in content, defaults to its end
+    :param fields: names of the fields to decode, defaults to all main fields
+    :return: the headers, decoded values per field name
+    """
+    # work on a copy of the session, indexing bytes is faster than indexing a mmap
+    buf = content[start:end]
+    headers, pos = read_headers(buf)
+    defs = field_defs(headers)
+    if 'I' not in defs:
+        raise ValueError('No main frame definition in log header')
+    names = defs['I']['name']
+    wanted = set(names if fields is None else fields)
+    # motor[0] is needed to predict the other motors
+    for ftype in 'IP':
+        for name, predictor in zip(names, defs.get(ftype, defs['I'])['predictor']):
+            if name in wanted and predictor == PREDICT_MOTOR_0:
+                wanted.add('motor[0]')
+    columns = [i for i, name in enumerate(names) if name in wanted]
+
+    kinds, raw = _parse_frames(buf, pos, defs, headers, columns)
+    raw = np.array(raw, dtype=np.int64).reshape(len(kinds), len(columns))
+    is_i = np.array(kinds, dtype=bool)
+    values = _apply_predictors(raw, is_i, [names[i] for i in columns], defs, headers)
+    return headers, values
+
+
+def _frame_ops(encodings: List[int]) -> tuple:
+    """Groups the encodings of a frame type into (encoding, first field, field count) decoding ops.
+    """
+    ops = []
+    i = 0
+    count = len(encodings)
+    while i < count:
+        encoding = encodings[i]
+        if encoding == TAG8_8SVB:
+            n = 1
+            while n < 8 and i + n < count and encodings[i + n] == TAG8_8SVB:
+                n += 1
+        elif encoding in (TAG2_3S32, TAG2_3SVARIABLE):
+            n = min(3, count - i)
+        elif encoding == TAG8_4S16:
+            n = min(4, count - i)
+        elif encoding in (SIGNED_VB, UNSIGNED_VB, NEG_14BIT, NULL):
+            n = 1
+        else:
+            raise ValueError('Unsupported field encoding %d' % encoding)
+        ops.append((encoding, i, n))
+        i += n
+    return tuple(ops)
+
+
+def _uvb(buf: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    for shift in range(0, 35, 7):
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+    raise CorruptFrame()
+
+
+def _svb(buf: bytes, pos: int) -> Tuple[int, int]:
+    value, pos = _uvb(buf, pos)
+    value &= 0xFFFFFFFF
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _sign_extend(value: int, bits: int) -> int:
+    return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+
+def _read_bytes(buf: bytes, pos: int, lead: int, values: list, i: int):
+    """Reads 3 little endian values with byte widths selected by 2 bits each of lead.
+    """
+    for j in range(3):
+        width = (lead & 3) + 1
+        values[i + j] = int.from_bytes(buf[pos:pos + width], 'little', signed=True)
+        pos += width
+        lead >>= 2
+    return pos
+
+
+def _tag2_3s32(buf: bytes, pos: int, values: list, i: int) -> int:
+    lead = buf[pos]
+    pos += 1
+    selector = lead >> 6
+    if selector == 0:
+        values[i] = _sign_extend((lead >> 4) & 3, 2)
+        values[i + 1] = _sign_extend((lead >> 2) & 3, 2)
+        values[i + 2] = _sign_extend(lead & 3, 2)
+    elif selector == 1:
+        values[i] = _sign_extend(lead & 0x0F, 4)
+        b = buf[pos]
+        values[i + 1] = _sign_extend(b >> 4, 4)
+        values[i + 2] = _sign_extend(b & 0x0F, 4)
+        pos += 1
+    elif selector == 2:
+        values[i] = _sign_extend(lead & 0x3F, 6)
+        values[i + 1] = _sign_extend(buf[pos] & 0x3F, 6)
+        values[i + 2] = _sign_extend(buf[pos + 1] & 0x3F, 6)
+        pos += 2
+    else:
+        pos = _read_bytes(buf, pos, lead, values, i)
+    return pos
+
+
+def _tag2_3svariable(buf: bytes, pos: int, values: list, i: int) -> int:
+    lead = buf[pos]
+    pos += 1
+    selector = lead >> 6
+    if selector == 0:
+        values[i] = _sign_extend((lead >> 4) & 3, 2)
+        values[i + 1] = _sign_extend((lead >> 2) & 3, 2)
+        values[i + 2] = _sign_extend(lead & 3, 2)
+    elif selector == 1:
+        # 5, 5 and 4 bits
+        b = buf[pos]
+        values[i] = _sign_extend((lead & 0x3E) >> 1, 5)
+        values[i + 1] = _sign_extend(((lead & 1) << 4) | (b >> 4), 5)
+        values[i + 2] = _sign_extend(b & 0x0F, 4)
+        pos += 1
+    elif selector == 2:
+        # 8, 7 and 7 bits
+        b1, b2 = buf[pos], buf[pos + 1]
+        values[i] = _sign_extend(((lead & 0x3F) << 2) | (b1 >> 6), 8)
+        values[i + 1] = _sign_extend(((b1 & 0x3F) << 1) | (b2 >> 7), 7)
+        values[i + 2] = _sign_extend(b2 & 0x7F, 7)
+        pos += 2
+    else:
+        pos = _read_bytes(buf, pos, lead, values, i)
+    return pos
+
+
+def _tag8_4s16_v1(buf: bytes, pos: int, values: list, i: int) -> int:
+    selector = buf[pos]
+    pos += 1
+    j = 0
+    while j < 4:
+        field = selector & 3
+        if field == 0:
+            values[i + j] = 0
+        elif field == 1:
+            # two 4 bit fields in one byte
+            b = buf[pos]
+            pos += 1
+            values[i + j] = _sign_extend(b & 0x0F, 4)
+            j += 1
+            selector >>= 2
+            if j < 4:
+                values[i + j] = _sign_extend(b >> 4, 4)
+        elif field == 2:
+            values[i + j] = _sign_extend(buf[pos], 8)
+            pos += 1
+        else:
+            values[i + j] = int.from_bytes(buf[pos:pos + 2], 'little', signed=True)
+            pos += 2
+        j += 1
+        selector >>= 2
+    return pos
+
+
+def _tag8_4s16_v2(buf: bytes, pos: int, values: list, i: int) -> int:
+    # fields are packed in nibbles, big endian
+    selector = buf[pos]
+    pos += 1
+    nibble = False
+    b = 0
+    for j in range(4):
+        field = selector & 3
+        if field == 0:
+            values[i + j] = 0
+        elif field == 1:
+            if nibble:
+                values[i + j] = _sign_extend(b & 0x0F, 4)
+            else:
+                b = buf[pos]
+                pos += 1
+                values[i + j] = _sign_extend(b >> 4, 4)
+            nibble = not nibble
+        elif field == 2:
+            if nibble:
+                v = (b & 0x0F) << 4
+                b = buf[pos]
+                pos += 1
+                values[i + j] = _sign_extend(v | (b >> 4), 8)
+            else:
+                values[i + j] = _sign_extend(buf[pos], 8)
+                pos += 1
+        else:
+            b1, b2 = buf[pos], buf[pos + 1]
+            pos += 2
+            if nibble:
+                values[i + j] = _sign_extend(((b & 0x0F) << 12) | (b1 << 4) | (b2 >> 4), 16)
+                b = b2
+            else:
+                values[i + j] = _sign_extend((b1 << 8) | b2, 16)
+        selector >>= 2
+    return pos
+
+
+def _read_fields(buf: bytes, pos: int, ops: tuple, values: list, tag8_4s16) -> int:
+    """Decodes the raw values of a frame into values.
+
+    :return: offset behind the frame
+    """
+    for encoding, i, n in ops:
+        if encoding == SIGNED_VB:
+            b = buf[pos]
+            if b < 0x80:
+                pos += 1
+                values[i] = (b >> 1) ^ -(b & 1)
+            else:
+                values[i], pos = _svb(buf, pos)
+        elif encoding == TAG8_8SVB:
+            if n == 1:
+                values[i], pos = _svb(buf, pos)
+            else:
+                header = buf[pos]
+                pos += 1
+                for j in range(n):
+                    if header & (1 << j):
+                        values[i + j], pos = _svb(buf, pos)
+                    else:
+                        values[i + j] = 0
+        elif encoding == UNSIGNED_VB:
+            values[i], pos = _uvb(buf, pos)
+        elif encoding == TAG2_3S32:
+            pos = _tag2_3s32(buf, pos, values, i)
+        elif encoding == TAG8_4S16:
+            pos = tag8_4s16(buf, pos, values, i)
+        elif encoding == TAG2_3SVARIABLE:
+            pos = _tag2_3svariable(buf, pos, values, i)
+        elif encoding == NEG_14BIT:
+            value, pos = _uvb(buf, pos)
+            values[i] = -_sign_extend(value & 0x3FFF, 14)
+        else:
+            values[i] = 0
+    return pos
+
+
+def _read_event(buf: bytes, pos: int) -> Tuple[int, int]:
+    """Skips the payload of an event.
+
+    :return: event type, offset behind the event
+    """
+    event = buf[pos]
+    pos += 1
+    if event in (EVENT_SYNC_BEEP, EVENT_DISARM, EVENT_IMU_FAILURE):
+        pos = _uvb(buf, pos)[1]
+    elif event in (EVENT_LOGGING_RESUME, EVENT_FLIGHT_MODE):
+        pos = _uvb(buf, _uvb(buf, pos)[1])[1]
+    elif event == EVENT_INFLIGHT_ADJUSTMENT:
+        pos = pos + 5 if buf[pos] & 0x80 else _svb(buf, pos + 1)[1]
+    elif event == EVENT_AUTOTUNE_CYCLE_START:
+        pos += 5
+    elif event == EVENT_AUTOTUNE_CYCLE_RESULT:
+        pos += 4
+    elif event == EVENT_AUTOTUNE_TARGETS:
+        pos += 8
+    elif event == EVENT_GTUNE_CYCLE_RESULT:
+        pos = _svb(buf, pos + 1)[1] + 2
+    elif event == EVENT_LOG_END:
+        if buf[pos:pos + len(END_OF_LOG_MESSAGE)] != END_OF_LOG_MESSAGE:
+            raise CorruptFrame()
+        pos += len(END_OF_LOG_MESSAGE)
+    else:
+        raise CorruptFrame()
+    return event, pos
+
+
+def _parse_frames(buf: bytes, pos: int, defs: Dict[str, dict], headers: Dict[str, str],
+                  columns: List[int]) -> Tuple[list, list]:
+    """Parses all frames of a session, keeping the raw values of the given main field columns.
+
+    A frame is only accepted if it is followed by the start of another frame. Corrupt frames are
+    skipped up to the next frame start, P frames are dropped until the next I frame then.
+
+    :return: per main frame True if I frame else False, flat list of the raw values
+    """
+    tag8_4s16 = _tag8_4s16_v1 if int(headers.get('Data version', 2) or 2) < 2 else _tag8_4s16_v2
+    ops = {ftype: _frame_ops(d['encoding']) for ftype, d in defs.items()}
+    # grouped encodings may decode a few values beyond the last field
+    values = {ftype: [0] * (len(d['name']) + 8) for ftype, d in defs.items()}
+    i_ops, i_values = ops['I'], values['I']
+    p_ops, p_values = ops.get('P', ()), values.get('P', [])
+    if len(columns) == 1:
+        getter = lambda v: (v[columns[0]],)
+    else:
+        getter = itemgetter(*columns) if columns else lambda v: ()
+    end = len(buf)
+    kinds = []
+    raw = []
+    valid = False
+    corrupt = 0
+    while pos < end:
+        start = pos
+        marker = buf[pos]
+        pos += 1
+        kind = None
+        try:
+            if marker == _I:
+                pos = _read_fields(buf, pos, i_ops, i_values, tag8_4s16)
+                kind, frame = True, i_values
+            elif marker == _P and p_ops:
+                pos = _read_fields(buf, pos, p_ops, p_values, tag8_4s16)
+                kind, frame = False, p_values
+            elif marker == _E:
+                event, pos = _read_event(buf, pos)
+                if event == EVENT_LOG_END:
+                    break
+                if event == EVENT_LOGGING_RESUME:
+                    valid = False
+            elif chr(marker) in ops:
+                ftype = chr(marker)
+                pos = _read_fields(buf, pos, ops[ftype], values[ftype], tag8_4s16)
+            else:
+                raise CorruptFrame()
+            if pos > end or pos < end and buf[pos] not in FRAME_TYPES:
+                raise CorruptFrame()
+        except (CorruptFrame, IndexError):
+            corrupt += 1
+            valid = False
+            match = _FRAME_START.search(buf, start + 1)
+            pos = match.start() if match else end
+            continue
+        if kind is True:
+            valid = True
+        if kind is not None and valid:
+            kinds.append(kind)
+            raw.extend(getter(frame))
+    if corrupt:
+        log.warning('Skipped %d corrupt frame(s) in blackbox log.' % corrupt)
+    return kinds, raw
+
+
+def _segment_cumsum(x: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Cumulative sum restarting at every index in starts, starts[0] must be 0.
+    """
+    total = np.cumsum(x)
+    before = total[starts[1:] - 1]
+    return total - np.repeat(np.concatenate(([0], before)), np.diff(np.append(starts, len(x))))
+
+
+def _wrap(values: np.ndarray, signed: bool) -> np.ndarray:
+    return values.astype(np.int32 if signed else np.uint32).astype(np.int64)
+
+
+def _unroll_time(values: np.ndarray) -> np.ndarray:
+    """Extends the unsigned 32 bit time past its rollovers.
+    """
+    step = np.diff(values)
+    rollover = (step < 0) & (step % (1 << 32) < MAX_TIME_JUMP)
+    return values + np.concatenate(([0], np.cumsum(rollover) << 32))
+
+
+def _average_2(deltas: np.ndarray, is_i: np.ndarray, signed: bool) -> np.ndarray:
+    # the truncated average can't be accumulated, so this one is sequential, it wraps like the 32 bit values
+    bias = 1 << 31 if signed else 0
+    result = []
+    prev = prev2 = 0
+    for delta, first in zip(deltas.tolist(), is_i.tolist()):
+        if first:
+            prev = prev2 = ((delta + bias) & 0xFFFFFFFF) - bias
+        else:
+            total = ((prev + prev2 + bias) & 0xFFFFFFFF) - bias
+            prev2 = prev
+            prev = (((total // 2 if total >= 0 else -(-total // 2)) + delta + bias) & 0xFFFFFFFF) - bias
+        result.append(prev)
+    return np.array(result, dtype=np.int64)
+
+
+def _increment(deltas: np.ndarray, is_i: np.ndarray, headers: Dict[str, str]) -> np.ndarray:
+    """Predicts the loop iteration of P frames from the I and P frame intervals.
+    """
+    i_interval = max(int(headers.get('I interval', 1) or 1), 1)
+    p_interval = headers.get('P interval', '1')
+    if '/' in p_interval:
+        p_num, p_denom = (int(v) for v in p_interval.split('/'))
+    else:
+        p_num, p_denom = 1, max(int(p_interval or 1), 1)
+
+    def logged(iteration):
+        return (iteration % i_interval + p_num - 1) % p_denom < p_num
+
+    result = []
+    prev = 0
+    for delta, first in zip(deltas.tolist(), is_i.tolist()):
+        if first:
+            prev = delta
+        else:
+            iteration = prev + 1
+            while not logged(iteration):
+                iteration += 1
+            prev = iteration + delta
+        result.append(prev)
+    return np.array(result, dtype=np.int64)
+
+
+def _apply_predictors(raw: np.ndarray, is_i: np.ndarray, names: List[str], defs: Dict[str, dict],
+                      headers: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """Reconstructs the field values from the raw frame values. The predictors add modulo 2**32, so the values are
+    only wrapped to 32 bits at the end, except for the truncated average.
+    """
+    all_names = defs['I']['name']
+    starts = np.flatnonzero(is_i)
+    is_p = ~is_i
+    motor_output = headers.get('motorOutput', '0').split(',')
+    constants = {PREDICT_ZERO: 0,
+                 PREDICT_MINTHROTTLE: int(headers.get('minthrottle', 0) or 0),
+                 PREDICT_1500: 1500,
+                 PREDICT_VBATREF: int(headers.get('vbatref', 0) or 0),
+                 PREDICT_MINMOTOR: int(motor_output[0] or 0)}
+    result = {}
+    for j, name in enumerate(names):
+        field = all_names.index(name)
+        signed = bool(defs['I']['signed'][field])
+        deltas = raw[:, j]
+        values = deltas.copy()
+        for ftype, rows in (('I', is_i), ('P', is_p)):
+            predictor = defs.get(ftype, defs['I'])['predictor'][field]
+            if predictor in constants:
+                values[rows] += constants[predictor]
+            elif predictor == PREDICT_MOTOR_0:
+                values[rows] += result['motor[0]'][rows]
+            elif ftype == 'I':
+                raise ValueError('Unsupported I frame predictor %d of %s' % (predictor, name))
+            elif predictor == PREDICT_PREVIOUS:
+                values = _segment_cumsum(np.where(is_i, values, deltas), starts)
+            elif predictor == PREDICT_STRAIGHT_LINE:
+                # the slope accumulates the deltas, the value accumulates the slope
+                slope = _segment_cumsum(np.where(is_i, 0, deltas), starts)
+                values = _segment_cumsum(np.where(is_i, values, slope), starts)
+            elif predictor == PREDICT_AVERAGE_2:
+                values = _average_2(np.where(is_i, values, deltas), is_i, signed)
+            elif predictor == PREDICT_INC:
+                values = _increment(np.where(is_i, values, deltas), is_i, headers)
+            else:
+                raise ValueError('Unsupported P frame predictor %d of %s' % (predictor, name))
+        # blackbox_decode reads the time as unsigned whatever its flag
+        result[name] = _unroll_time(_wrap(values, False)) if name == 'time' else _wrap(values, signed)
+    return result
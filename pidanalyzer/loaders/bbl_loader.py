@@ -1,14 +1,22 @@
+import mmap
 import subprocess
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Iterator, Tuple
 
+from .bbl_decoder import read_headers, session_bounds
 from .blackbox_decode_csv_loader import BlackboxDecodeCsvLoader
 from .loader import Loader
+from .. import common
 from ..common import *
+from ..profiling import span
 
 # minimum size of a log to parse in bytes
 LOG_MIN_BYTES = 500000
 # blackbox logs can have multiple extensions
 LOG_EXTENSIONS = [".bbl", ".bfl", ".txt"]
+# maximum number of concurrent blackbox_decode processes
+DECODE_WORKERS = os.cpu_count() or 1
 
 
 class BblLoader(Loader):
@@ -21,8 +29,8 @@ class BblLoader(Loader):
 
     @staticmethod
     def is_applicable(path: str) -> bool:
-        # simply check file extension
-        return os.path.splitext(path)[1].lower() in LOG_EXTENSIONS
+        # simply check file extension, logs are decoded by blackbox_decode unless the native decoder is selected
+        return not common.NATIVE_DECODER and os.path.splitext(path)[1].lower() in LOG_EXTENSIONS
 
     def _read_headers(self, path: str) -> Tuple[dict]:
         result = []
@@ -30,66 +38,60 @@ class BblLoader(Loader):
         for i, csvpath in enumerate(csvfiles):
             _, ext = os.path.splitext(csvpath)
             headers = headerdict(csvpath.replace(ext, ".01.csv"), i)
-            with open(csvpath, 'rb') as f:
-                lines = f.readlines()
-            # check for known keys and translate to useful ones.
-            for raw_line in lines:
-                line = raw_line.decode('latin-1')
-                for key in FIELDS_MAP.keys():
-                    if key in line:
-                        val = line.split(':')[-1]
-                        headers.update({FIELDS_MAP[key]: val[:-1]})
+            # only the header section at the start of the session is read
+            with open(csvpath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                headers.update(translate_fields(read_headers(content)[0]))
             result.append(headers)
         return tuple(result)
 
     def _read_data(self, path: str) -> Tuple[dict]:
+        return tuple(self.read_session(i) for i in range(len(self.headers)))
+
+    def read_session(self, index: int) -> dict:
         # load decoded CSV using the dedicated loader
-        result = []
-        for headers in self.headers:
-            result.append(BlackboxDecodeCsvLoader(headers["tempFile"], self.tmp_subdir).data[0])
-        return tuple(result)
+        return BlackboxDecodeCsvLoader(self.headers[index]["tempFile"], self.tmp_subdir).data[0]
+
+    def iter_session(self, index: int, chunk_len: int) -> Iterator[dict]:
+        # the decoded CSV is read chunk by chunk by the dedicated loader
+        return BlackboxDecodeCsvLoader(self.headers[index]["tempFile"], self.tmp_subdir).iter_session(0, chunk_len)
 
     def _bbl_to_csv(self) -> list:
         """Splits out one BBL per recorded session and converts each to CSV.
 
         :return: a list containing paths of the resulting CSV files
         """
-        with open(self.path, 'rb') as binary_log_view:
-            content = binary_log_view.read()
-
-        # The first line of the overall BBL file re-appears at the beginning
-        # of each recorded session.
-        try:
-            first_newline_index = content.index(str('\n').encode('utf8'))
-        except ValueError as e:
-            raise ValueError('No newline in %dB of log data from %r.'
-                             % (len(content), self.path), e)
-        firstline = content[:first_newline_index + 1]
-
-        split = content.split(firstline)
+        if os.path.getsize(self.path) == 0:
+            raise ValueError('No newline in 0B of log data from %r.' % self.path)
         bbl_sessions = []
-        for i in range(len(split)):
+        with open(self.path, 'rb') as binary_log, \
+                mmap.mmap(binary_log.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            firstline, bounds = session_bounds(content, self.path)
+
             path_root, path_ext = os.path.splitext(os.path.basename(self.path))
-            temp_path = os.path.join(self.tmp_path, '%s_temp%d%s' % (path_root, i, path_ext))
-            with open(temp_path, 'wb') as newfile:
-                newfile.write(firstline + split[i])
-            bbl_sessions.append(temp_path)
+            for i, (start, end) in enumerate(bounds):
+                temp_path = os.path.join(self.tmp_path, '%s_temp%d%s' % (path_root, i, path_ext))
+                size_bytes = len(firstline) + end - start
+                if size_bytes > LOG_MIN_BYTES:
+                    with open(temp_path, 'wb') as newfile, memoryview(content) as view:
+                        newfile.write(firstline)
+                        newfile.write(view[start:end])
+                    bbl_sessions.append(temp_path)
+                else:
+                    # There is often a small bogus session at the start of the file.
+                    log.warning('Ignoring BBL session %r, %dB < %dB.'
+                                % (temp_path, size_bytes, LOG_MIN_BYTES))
+
+        blackbox_decode_path = common.BLACKBOX_DECODE_PATH or get_blackbox_decode_path()
+        with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+            decoded = list(pool.map(partial(_decode, blackbox_decode_path), bbl_sessions))
+        return [bbl_session for bbl_session, ok in zip(bbl_sessions, decoded) if ok]
 
-        from ..common import BLACKBOX_DECODE_PATH
-        loglist = []
-        for bbl_session in bbl_sessions:
-            size_bytes = os.path.getsize(os.path.join(self.tmp_path, bbl_session))
-            if size_bytes > LOG_MIN_BYTES:
-                try:
-                    subprocess.check_call([BLACKBOX_DECODE_PATH, bbl_session])
-                    output_path = os.path.join(self.tmp_path, bbl_session)
-                    loglist.append(output_path)
-                except subprocess.CalledProcessError:
-                    log.error('Error in blackbox_decode of %r' % bbl_session, exc_info=True)
-            else:
-                # There is often a small bogus session at the start of the file.
-                log.warning('Ignoring BBL session %r, %dB < %dB.'
-                            % (bbl_session, size_bytes, LOG_MIN_BYTES))
-                os.remove(bbl_session)
 
-        return loglist
+def _decode(blackbox_decode_path: str, bbl_session: str) -> bool:
+    try:
+        with span('blackbox_decode', file=bbl_session):
+            subprocess.check_call([blackbox_decode_path, bbl_session])
+        return True
+    except subprocess.CalledProcessError:
+        log.error('Error in blackbox_decode of %r' % bbl_session, exc_info=True)
+        return False
@@ -1,12 +1,14 @@
 import csv
-from typing import Tuple
+from importlib.util import find_spec
+from typing import Dict, Iterator, Tuple
 
 import numpy as np
-from pandas import read_csv
 
 from .loader import Loader
+from .. import common
 from ..common import *
 from ..errors import InvalidDataError
+from ..profiling import span
 
 
 class BlackboxLogViewerCsvLoader(Loader):
@@ -27,6 +29,11 @@ class BlackboxLogViewerCsvLoader(Loader):
 
     TIME_FIELD = "time"
 
+    # pyarrow parses in multiple threads, if installed
+    CSV_ENGINE = 'pyarrow' if find_spec('pyarrow') else 'c'
+    # byte offset of the row naming the main fields
+    _data_offset = 0
+
     @staticmethod
     def is_applicable(path: str) -> bool:
         if ".csv" != os.path.splitext(path)[1].lower():
@@ -40,68 +47,130 @@ class BlackboxLogViewerCsvLoader(Loader):
         return False
 
     def _read_headers(self, path: str) -> Tuple[dict]:
-        _, ext = os.path.splitext(path)
-        tmp_csv_name = os.path.basename(path).replace(ext, ".main.csv")
+        path_root, _ = os.path.splitext(os.path.basename(path))
+        # nothing is written, the name is kept for the names of the plots, which strip the suffix
+        tmp_csv_name = '%s_temp0.01.csv' % path_root
         tmp_csv_path = os.path.join(self.tmp_path, tmp_csv_name)
         headers = headerdict(tmp_csv_path)
-        main_fields_start_row = None
-        with open(path) as f:
-            lines = f.readlines()
-            for line_num, line in enumerate(lines):
+        # only the header block is read, the data is parsed from its offset later on
+        with open(path, 'rb') as f:
+            while True:
+                offset = f.tell()
+                line = f.readline().decode('latin-1')
+                if not line:
+                    raise InvalidDataError(path, message="Data frames not found")
                 if CSV_HEADER_ROW_FRAGMENT in line:
-                    main_fields_start_row = line_num
+                    self._data_offset = offset
                     break
-            if main_fields_start_row is None:
-                raise InvalidDataError(path, message="Data frames not found")
-            with open(tmp_csv_path, 'w') as tmpf:
-                tmpf.writelines(lines[main_fields_start_row:])
-        # check for known keys and translate to useful ones.
-        for line in lines[:main_fields_start_row]:
-            for key in FIELDS_MAP.keys():
-                if key in line:
-                    val = strip_quotes(line.split(',', 1)[1])
-                    headers.update({FIELDS_MAP[key]: val})
-        return tuple(headers)
+                headers.update(header_fields(line))
+        return (headers,)
 
     def _read_data(self, path: str) -> Tuple[dict]:
-        data = read_csv(path, header=0, skipinitialspace=1, usecols=lambda k: k in self.CSV_FIELDS, dtype=np.float64)
-
-        result = {}
-        result.update({'throttle': data['rcCommand[3]'].values, 'time_us': data[self.TIME_FIELD].values * 1e-6})
-        for i in ['0', '1', '2']:
-            result.update({'rcCommand' + i: data['rcCommand[' + i + ']'].values})
-            try:
-                result.update({'debug' + i: data['debug[' + i + ']'].values})
-            except KeyError:
-                log.warning('No debug[' + i + '] trace found!')
-                result.update({'debug' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            try:
-                result.update({'PID loop in' + i: data['axisP[' + i + ']'].values})
-            except KeyError:
-                log.warning('No P[' + i + '] trace found!')
-                result.update({'PID loop in' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            try:
-                result.update({'d_err' + i: data['axisD[' + i + ']'].values})
-            except KeyError:
-                log.warning('No D[' + i + '] trace found!')
-                result.update({'d_err' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            try:
-                result.update({'I_term' + i: data['axisI[' + i + ']'].values})
-            except KeyError:
-                if i < 2:
-                    log.warning('No I[' + i + '] trace found!')
-                result.update({'I_term' + i: np.zeros_like(data['rcCommand[' + i + ']'].values)})
-
-            result.update({'PID sum' + i: result['PID loop in' + i] + result['I_term' + i] + result['d_err' + i]})
-            if 'gyroADC[0]' in data.keys():
-                result.update({'gyroData' + i: data['gyroADC[' + i + ']'].values})
-            elif 'gyroData[0]' in data.keys():
-                result.update({'gyroData' + i: data['gyroData[' + i + ']'].values})
-            elif 'ugyroADC[0]' in data.keys():
-                result.update({'gyroData' + i: data['ugyroADC[' + i + ']'].values})
-            else:
-                log.warning('No gyro trace found!')
-        return tuple((result,))
+        # pandas is only imported to parse a CSV, not to recognize or cache it
+        from pandas import read_csv
+        with open(path, 'rb') as f, span('read_csv', file=path):
+            fields = self._columns(f)
+            data = read_csv(f, header=None, usecols=list(fields), dtype=np.float64, engine=self.CSV_ENGINE)
+        return tuple((session_data(self._frames(data, fields), self.TIME_FIELD),))
+
+    def iter_session(self, index: int, chunk_len: int) -> Iterator[dict]:
+        # the pyarrow engine doesn't read in chunks
+        from pandas import read_csv
+        with open(self.path, 'rb') as f:
+            fields = self._columns(f)
+            chunks = read_csv(f, header=None, usecols=list(fields), dtype=np.float64, engine='c',
+                              chunksize=chunk_len)
+            for i, data in enumerate(chunks):
+                # missing fields are reported for the first chunk only
+                yield session_data(self._frames(data, fields), self.TIME_FIELD, warn=i == 0)
+
+    def _columns(self, f) -> Dict[int, str]:
+        # resolve the indices of the needed columns from the header row. f is left at the first frame.
+        f.seek(self._data_offset)
+        names = next(csv.reader([f.readline().decode('latin-1')]))
+        return {i: name.strip() for i, name in enumerate(names) if name.strip() in self.CSV_FIELDS}
+
+    def _frames(self, data: 'pandas.DataFrame', fields: Dict[int, str]) -> Dict[str, np.ndarray]:
+        # columns of the parsed frames by name. The engines label the columns differently, but keep their order.
+        columns = {name: data.iloc[:, j].to_numpy() for j, name in enumerate(fields.values())}
+        time = columns.pop(self.TIME_FIELD, None)
+        # the remaining columns are copied once into one block, so these are views into a single buffer
+        columns = column_block(columns, common.DTYPE)
+        if time is not None:
+            columns[self.TIME_FIELD] = time
+        return columns
+
+
+def header_fields(line: str) -> dict:
+    """
+    :param line: row of the header block of a CSV log
+    :return: the known fields of the row, translated to useful names
+    """
+    fields = {}
+    # check for known keys and translate to useful ones.
+    for key in FIELDS_MAP.keys():
+        if key in line:
+            fields[FIELDS_MAP[key]] = strip_quotes(line.split(',', 1)[1])
+    return fields
+
+
+def column_block(columns: Dict[str, np.ndarray], dtype: type = np.float64) -> Dict[str, np.ndarray]:
+    """Copies equally long columns into one contiguous 2-D buffer.
+
+    :return: views of the columns in the buffer, by name
+    """
+    length = len(next(iter(columns.values()))) if columns else 0
+    block = np.empty((length, len(columns)), dtype=dtype, order='F')
+    for j, values in enumerate(columns.values()):
+        block[:, j] = values
+    return {name: block[:, j] for j, name in enumerate(columns)}
+
+
+def session_data(data: Dict[str, np.ndarray], time_field: str, warn: bool = True) -> dict:
+    """Translates logged fields to the traces used by the analysis.
+
+    :param data: float values per logged field name
+    :param time_field: name of the time field in us
+    :param warn: log missing fields
+    :return: frames of the session
+    """
+    log_warning = log.warning if warn else lambda msg: None
+    result = {}
+    result.update({'throttle': data['rcCommand[3]'], 'time_us': data[time_field] * 1e-6})
+    for i in ['0', '1', '2']:
+        result.update({'rcCommand' + i: data['rcCommand[' + i + ']']})
+        try:
+            result.update({'debug' + i: data['debug[' + i + ']']})
+        except KeyError:
+            log_warning('No debug[' + i + '] trace found!')
+            result.update({'debug' + i: np.zeros_like(data['rcCommand[' + i + ']'])})
+
+        try:
+            result.update({'PID loop in' + i: data['axisP[' + i + ']']})
+        except KeyError:
+            log_warning('No P[' + i + '] trace found!')
+            result.update({'PID loop in' + i: np.zeros_like(data['rcCommand[' + i + ']'])})
+
+        try:
+            result.update({'d_err' + i: data['axisD[' + i + ']']})
+        except KeyError:
+            log_warning('No D[' + i + '] trace found!')
+            result.update({'d_err' + i: np.zeros_like(data['rcCommand[' + i + ']'])})
+
+        try:
+            result.update({'I_term' + i: data['axisI[' + i + ']']})
+        except KeyError:
+            if int(i) < 2:
+                log_warning('No I[' + i + '] trace found!')
+            result.update({'I_term' + i: np.zeros_like(data['rcCommand[' + i + ']'])})
+
+        result.update({'PID sum' + i: result['PID loop in' + i] + result['I_term' + i] + result['d_err' + i]})
+        if 'gyroADC[0]' in data.keys():
+            result.update({'gyroData' + i: data['gyroADC[' + i + ']']})
+        elif 'gyroData[0]' in data.keys():
+            result.update({'gyroData' + i: data['gyroData[' + i + ']']})
+        elif 'ugyroADC[0]' in data.keys():
+            result.update({'gyroData' + i: data['ugyroADC[' + i + ']']})
+        else:
+            log_warning('No gyro trace found!')
+    return result
@@ -10,6 +10,9 @@ class Loader(metaclass=ABCMeta):
     """Base class for data source loaders.
     """
 
+    # bump when the output of a loader changes, this invalidates cached logs
+    VERSION = 3
+
     def __init__(self, path: str, tmp_subdir: str = "tmp"):
         """
         :param path: path to log data file
@@ -18,7 +21,7 @@ class Loader(metaclass=ABCMeta):
         self._path = path
         self._tmp_path = os.path.join(os.path.dirname(path), tmp_subdir)
         self._headers = self._read_headers(path)
-        self._data = self._read_data(path)
+        self._data = None
 
     @staticmethod
     @abstractmethod
@@ -43,6 +46,25 @@ class Loader(metaclass=ABCMeta):
         """
         pass
 
+    def read_session(self, index: int) -> dict:
+        """Can be overriden by child classes to load a single session without loading the others.
+
+        :param index: index of the session, as in headers
+        :return: frames of the session
+        """
+        return self.data[index]
+
+    def iter_session(self, index: int, chunk_len: int) -> Iterator[dict]:
+        """Can be overriden by child classes to read a single session chunk by chunk instead of at once.
+
+        :param index: index of the session, as in headers
+        :param chunk_len: max number of frames in a chunk
+        :return: iterator of consecutive frames of the session
+        """
+        data = self.read_session(index)
+        for start in range(0, len(data['time_us']), chunk_len):
+            yield {key: value[start:start + chunk_len] for key, value in data.items()}
+
     def clean_up(self):
         """Can be overriden by child classes to clean up temporary files.
         """
@@ -62,6 +84,9 @@ class Loader(metaclass=ABCMeta):
 
     @property
     def data(self) -> Tuple[dict]:
+        # frames are read on first access
+        if self._data is None:
+            self._data = self._read_data(self._path)
         return tuple(self._data)
 
 
@@ -74,15 +99,25 @@ def _find_loaders() -> Iterator[Type[Loader]]:
             yield value
 
 
-def resolve(path: str, tmp_subdir: str) -> Loader:
+def find(path: str) -> Type[Loader]:
     """Tries to find the appropriate Loader class for a file.
 
     :param path: path to the file to inspect
-    :param tmp_subdir: name of temp directory for generated files
-    :return: the resolved Loader
+    :return: the Loader class
     :raise LoaderNotFoundError: raised when an appropriate Loader wasn't found
     """
     for loader in _find_loaders():
         if loader.is_applicable(path):
-            return loader(path, tmp_subdir)
+            return loader
     raise LoaderNotFoundError(path)
+
+
+def resolve(path: str, tmp_subdir: str) -> Loader:
+    """Tries to find the appropriate Loader class for a file.
+
+    :param path: path to the file to inspect
+    :param tmp_subdir: name of temp directory for generated files
+    :return: the resolved Loader
+    :raise LoaderNotFoundError: raised when an appropriate Loader wasn't found
+    """
+    return find(path)(path, tmp_subdir)
@@ -0,0 +1,71 @@
+import mmap
+from typing import Tuple
+
+import numpy as np
+
+from . import bbl_decoder
+from .bbl_decoder import session_bounds
+from .bbl_loader import LOG_EXTENSIONS, LOG_MIN_BYTES
+from .blackbox_log_viewer_csv_loader import BlackboxLogViewerCsvLoader, column_block, session_data
+from .loader import Loader
+from .. import common
+from ..common import *
+from ..profiling import span
+
+
+class NativeBblLoader(Loader):
+    """Loads Betaflight blackbox log files by decoding them directly, without blackbox_decode.
+    Only the fields used by the analysis are decoded. Frames are parsed in Python, which is slower than
+    blackbox_decode, so this loader is only used if common.NATIVE_DECODER is set.
+    """
+
+    FIELDS = BlackboxLogViewerCsvLoader.CSV_FIELDS
+
+    TIME_FIELD = "time"
+
+    @staticmethod
+    def is_applicable(path: str) -> bool:
+        # simply check file extension, blackbox_decode is used instead unless the native decoder is selected
+        return common.NATIVE_DECODER and os.path.splitext(path)[1].lower() in LOG_EXTENSIONS
+
+    def _read_headers(self, path: str) -> Tuple[dict]:
+        result = []
+        self._sessions = []
+        if os.path.getsize(path) == 0:
+            raise ValueError('No newline in 0B of log data from %r.' % path)
+        path_root, _ = os.path.splitext(os.path.basename(path))
+        with open(path, 'rb') as binary_log, \
+                mmap.mmap(binary_log.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            firstline, bounds = session_bounds(content, path)
+            for i, (start, end) in enumerate(bounds):
+                # nothing is written, the name is kept for the names of the plots
+                temp_path = os.path.join(self.tmp_path, '%s_temp%d.01.csv' % (path_root, i))
+                start = max(start - len(firstline), 0)
+                if end - start <= LOG_MIN_BYTES:
+                    # There is often a small bogus session at the start of the file.
+                    log.warning('Ignoring BBL session %d of %r, %dB < %dB.'
+                                % (i, path, end - start, LOG_MIN_BYTES))
+                    continue
+                fields = bbl_decoder.read_headers(content, start)[0]
+                if 'Field I name' not in fields:
+                    log.error('No main frame definition in BBL session %d of %r' % (i, path))
+                    continue
+                headers = headerdict(temp_path, len(result))
+                headers.update(translate_fields(fields))
+                result.append(headers)
+                self._sessions.append((start, end))
+        return tuple(result)
+
+    def _read_data(self, path: str) -> Tuple[dict]:
+        return tuple(self.read_session(i) for i in range(len(self.headers)))
+
+    def read_session(self, index: int) -> dict:
+        start, end = self._sessions[index]
+        with open(self.path, 'rb') as binary_log, \
+                mmap.mmap(binary_log.fileno(), 0, access=mmap.ACCESS_READ) as content, \
+                span('bbl_decode', session=index):
+            _, fields = bbl_decoder.decode(content, start, end, self.FIELDS)
+        time = fields.pop(self.TIME_FIELD).astype(np.float64)
+        columns = column_block(fields, common.DTYPE)
+        columns[self.TIME_FIELD] = time
+        return session_data(columns, self.TIME_FIELD)
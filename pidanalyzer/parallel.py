@@ -0,0 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Sequence
+
+import numpy as np
+
+from . import common, profiling
+from .common import ANALYSES
+from .trace import Trace, noise_analysis, plotted_noise_sources
+
+
+def analyze(traces: List[Trace], analyses: Sequence[str] = ANALYSES) -> List[Trace]:
+    """Computes the selected analyses of each trace in its own process and stores the results in the traces.
+
+    The data of the traces is handed to the processes through one shared memory block, only the analysis
+    results used by the figures and the export are sent back, see Trace.result_attrs.
+
+    :param traces: traces of one log, sharing the same time base
+    :param analyses: analyses to compute, see ANALYSES
+    :return: the traces
+    """
+    n = len(traces[0].time)
+    arrays = {}
+    for trace in traces:
+        for value in trace.data.values():
+            if isinstance(value, np.ndarray) and value.shape == (n,):
+                arrays.setdefault(id(value), value)
+    # byte offset and dtype of each array in the block, time is float64 and the other channels common.DTYPE
+    places = {}
+    size = 0
+    for key, value in arrays.items():
+        size += -size % 8
+        places[key] = (size, value.dtype.str)
+        size += value.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    try:
+        for key, value in arrays.items():
+            np.ndarray((n,), dtype=value.dtype, buffer=shm.buf, offset=places[key][0])[:] = value
+        jobs = []
+        for trace in traces:
+            layout = {key: places[id(value)] for key, value in trace.data.items() if id(value) in places}
+            scalars = {key: value for key, value in trace.data.items() if id(value) not in places}
+            jobs.append((shm.name, n, layout, scalars, tuple(analyses), common.DTYPE))
+        with ProcessPoolExecutor(max_workers=len(traces)) as pool:
+            for trace, results in zip(traces, pool.map(profiling.collecting(_analyze), jobs)):
+                trace.restore(profiling.merge(results))
+    finally:
+        shm.close()
+        shm.unlink()
+    return traces
+
+
+def _analyze(job: tuple) -> dict:
+    shm = shared_memory.SharedMemory(name=job[0])
+    try:
+        return _analyze_shared(shm, *job[1:])
+    finally:
+        try:
+            shm.close()
+        except BufferError:
+            # views of a failed analysis are still referenced, they are released with the process
+            pass
+
+
+def _analyze_shared(shm: shared_memory.SharedMemory, n: int, layout: dict, scalars: dict,
+                    analyses: Sequence[str], dtype: str) -> dict:
+    # spawned workers don't inherit the settings of the parent process
+    common.DTYPE = dtype
+    trace = Trace(dict(scalars, **{key: np.ndarray((n,), dtype=array_dtype, buffer=shm.buf, offset=offset)
+                                   for key, (offset, array_dtype) in layout.items()}))
+    if 'response' in analyses:
+        trace.compute('calc_response')
+    if 'noise' in analyses:
+        noise_analysis([trace], [plotted_noise_sources(trace.name)])
+    return trace.results(Trace.result_attrs)
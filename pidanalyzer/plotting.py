@@ -1,47 +1,49 @@
-from typing import List, Tuple
+from typing import List, Sequence
 
-from .common import log
+from .analysis import create_stream_traces, create_traces
+from .common import ANALYSES, AXES, log
 from .figures import noise_figure, response_figure, small_response_figure
+from .loaders import Loader
+from .profiling import span
 from .trace import Trace
 
 
-def show_plots(name: str, header: dict, data: dict, noise_bounds: list):
+def show_plots(name: str, header: dict, data: dict, noise_bounds: list, axes: Sequence[str] = AXES,
+               analyses: Sequence[str] = ANALYSES, parallel: bool = False, show: bool = True):
+    """Analyzes a session and saves its figures in the background, see figures.writer.
+
+    :param show: create the figures through pyplot, to be shown by plt.show()
+    """
     path = header["tempFile"]
     log.info("CSV file: " + path)
     log.info('Processing:')
-    traces_header, traces = _create_traces(header, data)
-    small_response_figure.create(path, name, traces_header, traces)
-    response_figure.create(path, name, traces_header, traces)
-    noise_figure.create(path, name, traces_header, traces, noise_bounds)
-
-
-def _create_traces(header: dict, data: dict) -> Tuple[dict, List[Trace]]:
-    time = data['time_us']
-    throttle = ((data['throttle'] - 1000.) / (float(header['maxThrottle']) - 1000.)) * 100.
-    tracesdata = [{'name': 'roll'}, {'name': 'pitch'}, {'name': 'yaw'}]
-    traces_header = dict(header)
-    traces = []
-
-    for i, axisdata in enumerate(tracesdata):
-        axisdata.update({'time': time})
-        si = str(i)
-        axisdata.update({'p_err': data['PID loop in' + si]})
-        axisdata.update({'rcinput': data['rcCommand' + si]})
-        axisdata.update({'gyro': data['gyroData' + si]})
-        axisdata.update({'PIDsum': data['PID sum' + si]})
-        axisdata.update({'d_err': data['d_err' + si]})
-        axisdata.update({'debug': data['debug' + si]})
-        if 'KISS' in header['fwType']:
-            axisdata.update({'P': 1.})
-            traces_header.update({'tpa_percent': 0.})
-        elif 'Raceflight' in header['fwType']:
-            axisdata.update({'P': 1.})
-            traces_header.update({'tpa_percent': 0.})
-        else:
-            axisdata.update({'P': float((header[axisdata['name'] + 'PID']).split(',')[0])})
-            traces_header.update({'tpa_percent': (float(header['tpa_breakpoint']) - 1000.) / 10.})
-        axisdata.update({'throttle': throttle})
-        log.info(axisdata['name'] + '...   ')
-        traces.append(Trace(axisdata))
-
-    return traces_header, traces
+    traces_header, traces = create_traces(header, data, axes, analyses, parallel)
+    _create_figures(path, name, traces_header, traces, noise_bounds, analyses, show)
+
+
+def show_stream_plots(name: str, header: dict, loader: Loader, index: int, noise_bounds: list, budget: int,
+                      axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES, show: bool = True):
+    """Like show_plots, but reads the session chunk by chunk and analyzes it within a memory budget.
+    Falls back to show_plots if the time of the session isn't monotonic.
+
+    :param loader: loader of the log
+    :param index: index of the session, as in loader.headers
+    :param budget: memory budget in bytes
+    """
+    path = header["tempFile"]
+    log.info("CSV file: " + path)
+    log.info('Processing (streaming):')
+    traces_header, traces = create_stream_traces(header, loader, index, budget, axes, analyses)
+    _create_figures(path, name, traces_header, traces, noise_bounds, analyses, show)
+
+
+def _create_figures(path: str, name: str, traces_header: dict, traces: List[Trace], noise_bounds: list,
+                    analyses: Sequence[str] = ANALYSES, show: bool = True):
+    if 'response' in analyses:
+        with span('draw', figure='small_response'):
+            small_response_figure.create(path, name, traces_header, traces, show)
+        with span('draw', figure='response'):
+            response_figure.create(path, name, traces_header, traces, show=show)
+    if 'noise' in analyses:
+        with span('draw', figure='noise'):
+            noise_figure.create(path, name, traces_header, traces, noise_bounds, show)
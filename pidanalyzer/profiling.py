@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import partial, wraps
+from typing import Callable, List, Optional
+
+from .common import log
+
+# spans of all stages are recorded while profiling is enabled, see enable. Disabled, span returns this shared
+# context, which costs about as much as the call itself.
+_NO_SPAN = nullcontext()
+_profile = None  # type: Optional[Profile]
+
+
+class Profile:
+    """Spans recorded since profiling was enabled.
+
+    Each span holds its wall time, the CPU time of the thread running it and, with memory, the peak memory
+    allocated while it was open above the memory allocated when it was opened. Memory is traced by tracemalloc,
+    which slows down Python code, and only measured for spans of the main thread.
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.spans = []  # type: List[dict]
+        self._open = threading.local()
+        self._started_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def stack(self) -> list:
+        # open spans of the current thread
+        stack = getattr(self._open, 'stack', None)
+        if stack is None:
+            stack = self._open.stack = []
+        return stack
+
+
+class _Span:
+    # a span while it is open, nested spans inherit its args
+
+    def __init__(self, profile: Profile, name: str, args: dict):
+        self.profile = profile
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = self.profile.stack()
+        if stack:
+            self.args = dict(stack[-1].args, **self.args)
+        self.memory = self.profile.memory and threading.current_thread() is threading.main_thread()
+        self.current, self.peak = 0, 0
+        if self.memory:
+            self.current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        stack = self.profile.stack()
+        stack.pop()
+        peak = None
+        if self.memory:
+            self.peak = max(tracemalloc.get_traced_memory()[1], self.peak)
+            peak = self.peak - self.current
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        thread = threading.current_thread()
+        self.profile.spans.append({'name': self.name, 'args': self.args, 'pid': os.getpid(), 'tid': thread.ident,
+                                   'thread': thread.name, 'start': self.start, 'wall': wall, 'cpu': cpu,
+                                   'peak': peak})
+        return False
+
+
+def span(name: str, **args):
+    """Context of a named span around a stage of the analysis, recorded while profiling is enabled.
+
+    :param args: e.g. the log and axis of the stage, nested spans of the same thread inherit them
+    """
+    if _profile is None:
+        return _NO_SPAN
+    return _Span(_profile, name, args)
+
+
+def traced(fn: Callable) -> Callable:
+    """Decorates fn to run in a span named like it, see span.
+    """
+    @wraps(fn)
+    def run(*args, **kwargs):
+        if _profile is None:
+            return fn(*args, **kwargs)
+        with _Span(_profile, fn.__name__, {}):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def enabled() -> bool:
+    return _profile is not None
+
+
+def enable(memory: bool = False):
+    """Starts recording spans, discarding the spans recorded before.
+
+    :param memory: measure the peak memory of the spans with tracemalloc
+    """
+    global _profile
+    if _profile is not None:
+        _profile.stop()
+    _profile = Profile(memory)
+
+
+def disable() -> List[dict]:
+    """Stops recording spans.
+
+    :return: the recorded spans
+    """
+    global _profile
+    profile, _profile = _profile, None
+    if profile is None:
+        return []
+    profile.stop()
+    return profile.spans
+
+
+def collecting(fn: Callable) -> Callable:
+    """Wraps fn to be run in a worker process, with profiling enabled there if it is enabled here.
+
+    The wrapper returns the result of fn and the spans it recorded, to be passed to merge.
+    """
+    return partial(_run_collecting, None if _profile is None else _profile.memory, fn)
+
+
+def _run_collecting(memory: Optional[bool], fn: Callable, *args, **kwargs) -> tuple:
+    if memory is None:
+        return fn(*args, **kwargs), []
+    # forked workers inherit the spans of the parent, these are dropped
+    enable(memory)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        spans = disable()
+    return result, spans
+
+
+def merge(result: tuple):
+    """Adds the spans of a result of collecting to the spans of this process.
+
+    :return: the result of the wrapped function
+    """
+    value, spans = result
+    if _profile is not None:
+        _profile.spans.extend(spans)
+    return value
+
+
+def summary(spans: List[dict]) -> 'OrderedDict[str, dict]':
+    """
+    :return: count, total wall and CPU time in s and max peak memory in MB of the spans by name, in order of
+        their first start. Times are inclusive, they contain the times of nested spans.
+    """
+    stages = OrderedDict()
+    for s in sorted(spans, key=lambda s: s['start']):
+        stage = stages.setdefault(s['name'], {'count': 0, 'wall_s': 0., 'cpu_s': 0., 'peak_mb': None})
+        stage['count'] += 1
+        stage['wall_s'] += s['wall']
+        stage['cpu_s'] += s['cpu']
+        if s['peak'] is not None:
+            stage['peak_mb'] = max(stage['peak_mb'] or 0., s['peak'] / 1e6)
+    return stages
+
+
+def trace_events(spans: List[dict]) -> dict:
+    """
+    :return: the spans in Chrome's trace event format, as read by chrome://tracing and Perfetto
+    """
+    origin = min((s['start'] for s in spans), default=0.)
+    events = []
+    threads = {}
+    for s in spans:
+        args = dict(s['args'], cpu_ms=round(s['cpu'] * 1e3, 3))
+        if s['peak'] is not None:
+            args['peak_mb'] = round(s['peak'] / 1e6, 3)
+        events.append({'name': s['name'], 'cat': 'pidanalyzer', 'ph': 'X', 'pid': s['pid'], 'tid': s['tid'],
+                       'ts': round((s['start'] - origin) * 1e6, 1), 'dur': round(s['wall'] * 1e6, 1),
+                       'args': args})
+        threads[(s['pid'], s['tid'])] = s['thread']
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+               for (pid, tid), name in threads.items()]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def save(path: str):
+    """Writes the spans recorded so far as trace events, see trace_events, with their summary, and logs the
+    summary.
+    """
+    spans = list(_profile.spans) if _profile is not None else []
+    stages = summary(spans)
+    with open(path, 'w') as f:
+        json.dump(dict(trace_events(spans), summary=stages), f)
+    log.info('Profile of %d span(s) saved as %r' % (len(spans), path))
+    log.info('%-22s %6s %9s %9s %9s' % ('stage', 'count', 'wall s', 'cpu s', 'peak MB'))
+    for name, stage in stages.items():
+        log.info('%-22s %6d %9.3f %9.3f %9s' % (name, stage['count'], stage['wall_s'], stage['cpu_s'],
+                                                '-' if stage['peak_mb'] is None else '%.1f' % stage['peak_mb']))
+
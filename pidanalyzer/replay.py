@@ -0,0 +1,74 @@
+"""Replays a CSV log at real-time speed, as a stand-in for a live source of frames.
+
+    python -m pidanalyzer.replay LOG.csv | ./PID-Analyzer.py --live -
+    python -m pidanalyzer.replay LOG.csv growing.csv & ./PID-Analyzer.py --live growing.csv
+"""
+import argparse
+import sys
+import time
+from typing import BinaryIO
+
+from .common import *
+
+
+def replay(path: str, out: BinaryIO, speed: float = 1., interval: float = 0.01):
+    """Writes a CSV log to out, each frame at the time it was logged.
+
+    :param path: path of a CSV log of Blackbox Log Viewer or blackbox_decode
+    :param out: binary file to write to
+    :param speed: replay speed, 1 for real-time
+    :param interval: frames are written in batches of this time span in s
+    """
+    with open(path, 'rb') as f:
+        # header rows are written at once
+        for line in f:
+            out.write(line)
+            if CSV_HEADER_ROW_FRAGMENT.encode() in line:
+                names = [strip_quotes(name) for name in line.decode('latin-1').split(',')]
+                time_index = names.index('time (us)' if 'time (us)' in names else 'time')
+                break
+        else:
+            raise ValueError('No main fields in %r' % path)
+        out.flush()
+
+        start = None
+        batch = []
+        for line in f:
+            logged = float(line.split(b',', time_index + 1)[time_index]) * 1e-6
+            if start is None:
+                start = time.monotonic() - logged / speed
+            wait = start + logged / speed - time.monotonic()
+            if wait > interval:
+                out.write(b''.join(batch))
+                out.flush()
+                batch = []
+                time.sleep(wait)
+            batch.append(line)
+        out.write(b''.join(batch))
+        out.flush()
+
+
+def main(args) -> int:
+    try:
+        if args.output == '-':
+            replay(clean_path(args.log_path), sys.stdout.buffer, args.speed)
+        else:
+            with open(clean_path(args.output), 'wb') as out:
+                replay(clean_path(args.log_path), out, args.speed)
+    except BrokenPipeError:
+        # the live analysis quit, stdout can't be flushed at exit anymore
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replays a CSV log at real-time speed.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('log_path', metavar='LOG_PATH', help='CSV log to replay')
+    parser.add_argument('output', nargs='?', default='-', metavar='OUTPUT',
+                        help='file or named pipe to write to, - for stdout')
+    parser.add_argument('--speed', type=float, default=1., help='replay speed, 1 for real-time')
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,236 @@
+import tempfile
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from . import common
+from .common import ANALYSES, AXES, log
+from .errors import NonMonotonicTimeError
+from .profiling import traced
+from .trace import (Trace, batches, input_masks, masked_throttle, mode_avrs, mode_hist, noise_analysis, pid_in,
+                    plotted_noise_sources, response_deviation, response_quality, response_weights, stepcalc,
+                    thr_response_counts, thr_response_hist)
+
+# memory per frame of a chunk read from a loader, including all logged fields and temporaries
+CHUNK_BYTES = 1024
+# memory per sample of a batch of windows in the response analysis
+RESPONSE_BYTES = 128
+# memory per sample of a batch of windows in the noise analysis
+NOISE_BYTES = 32
+
+
+def chunk_length(budget: int) -> int:
+    """
+    :param budget: memory budget in bytes
+    :return: number of frames in a chunk read from a loader
+    """
+    return max(1024, budget // CHUNK_BYTES)
+
+
+def stream_traces(chunks: Iterable[dict], gains: Dict[str, float], max_throttle: float, directory: str,
+                  budget: int, analyses: Sequence[str] = ANALYSES) -> List['StreamTrace']:
+    """Creates a StreamTrace for each axis from the chunks of a session, within a memory budget.
+
+    The channels used by the analysis are spilled to temporary files and equalized on disk, so windows are
+    formed across chunk boundaries. Only analysis results and per window values are held in memory.
+
+    :param chunks: consecutive frames of the session, see Loader.iter_session
+    :param gains: P gain of each axis to analyze, see AXES
+    :param max_throttle: maxThrottle of the log
+    :param directory: directory of the temporary files
+    :param budget: memory budget in bytes
+    :param analyses: analyses to run, see ANALYSES. The noise of all axes is calculated in one batch.
+    :return: the traces
+    :raise NonMonotonicTimeError: raised when the time of the session isn't monotonic
+    """
+    keys = ['throttle']
+    for axis in gains:
+        si = str(AXES.index(axis))
+        keys += ['PID loop in' + si, 'gyroData' + si, 'd_err' + si, 'debug' + si]
+    time, data = spill(chunks, 'time_us', keys, directory)
+    chunk_len = chunk_length(budget)
+    time, data = equalize_channels(time, data, directory, chunk_len, Trace.equalize_tol)
+    throttle = apply(lambda thr: ((thr - 1000.) / (max_throttle - 1000.)) * 100., [data['throttle']],
+                     directory, chunk_len)
+
+    traces = []
+    for axis, gain in gains.items():
+        si = str(AXES.index(axis))
+        axisdata = {'name': axis, 'time': time, 'p_err': data['PID loop in' + si], 'gyro': data['gyroData' + si],
+                    'd_err': data['d_err' + si], 'debug': data['debug' + si], 'P': gain, 'throttle': throttle}
+        axisdata['input'] = apply(lambda p_err, gyro: pid_in(p_err, gyro, gain),
+                                  [axisdata['p_err'], axisdata['gyro']], directory, chunk_len)
+        log.info(axis + '...   ')
+        traces.append(StreamTrace(axisdata, directory, budget))
+    if 'noise' in analyses and traces:
+        noise_analysis(traces, [plotted_noise_sources(trace.name) for trace in traces], budget // NOISE_BYTES)
+    return traces
+
+
+def disk_array(directory: str, shape, dtype: type = np.float64) -> np.ndarray:
+    """
+    :return: array of shape in an anonymous temporary file in directory
+    """
+    return np.memmap(tempfile.TemporaryFile(dir=directory), dtype, 'w+', shape=shape).view(np.ndarray)
+
+
+@traced
+def spill(chunks: Iterable[dict], time_key: str, keys: Sequence[str],
+          directory: str) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Writes the time and keys of the chunks to temporary files in directory.
+
+    :return: time as float64 and the channels of keys as common.DTYPE arrays backed by the files
+    :raise NonMonotonicTimeError: raised when time isn't monotonic
+    """
+    files = {key: tempfile.TemporaryFile(dir=directory) for key in [time_key] + list(keys)}
+    length = 0
+    last = -np.inf
+    for chunk in chunks:
+        time = np.asarray(chunk[time_key], dtype=np.float64)
+        if not len(time):
+            continue
+        if time[0] < last or np.any(np.diff(time) < 0.):
+            raise NonMonotonicTimeError()
+        last = time[-1]
+        time.tofile(files[time_key])
+        for key in keys:
+            np.asarray(chunk[key], dtype=common.DTYPE).tofile(files[key])
+        length += len(time)
+    arrays = {}
+    for key, f in files.items():
+        f.flush()
+        dtype = np.float64 if key == time_key else common.DTYPE
+        arrays[key] = np.memmap(f, dtype, 'r', shape=(length,)).view(np.ndarray)
+    return arrays.pop(time_key), arrays
+
+
+def apply(function: Callable, arrays: Sequence[np.ndarray], directory: str, chunk_len: int) -> np.ndarray:
+    """Evaluates an elementwise function of equally long arrays chunk by chunk.
+
+    :return: the result, backed by a temporary file in directory
+    """
+    result = disk_array(directory, (len(arrays[0]),), np.result_type(*arrays))
+    for start in range(0, len(result), chunk_len):
+        result[start:start + chunk_len] = function(*(array[start:start + chunk_len] for array in arrays))
+    return result
+
+
+@traced
+def equalize_channels(time: np.ndarray, channels: Dict[str, np.ndarray], directory: str, chunk_len: int,
+                      tol: float = 0.) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Same as trace.equalize_channels for monotonic time, chunk by chunk into temporary files in directory.
+    """
+    length = len(time)
+    start, stop = time[0], time[-1]
+    step = (stop - start) / (length - 1)
+
+    def uniform(first, last):
+        # values of np.linspace(start, stop, length)[first:last]
+        values = np.arange(first, last, dtype=np.float64) * step + start
+        if last >= length:
+            values[-1] = stop
+        return values
+
+    newtime = disk_array(directory, (length,))
+    deviation = 0.
+    for first in range(0, length, chunk_len):
+        last = min(first + chunk_len, length)
+        newtime[first:last] = uniform(first, last)
+        deviation = max(deviation, np.max(np.abs(time[first:last] - newtime[first:last])))
+    if deviation <= tol * np.abs(newtime[1] - newtime[0]):
+        return newtime, channels
+
+    # interpolation indices and distances are shared by all channels, same scheme as interp1d
+    result = {key: disk_array(directory, (length,), value.dtype) for key, value in channels.items()}
+    for first in range(0, length, chunk_len):
+        chunk = newtime[first:first + chunk_len]
+        hi = np.searchsorted(time, chunk).clip(1, length - 1)
+        lo = hi - 1
+        dt_new = chunk - time[lo]
+        dt_old = time[hi] - time[lo]
+        for key, value in channels.items():
+            y_lo = value[lo]
+            result[key][first:first + chunk_len] = (value[hi] - y_lo) / dt_old * dt_new + y_lo
+    return newtime, result
+
+
+class StreamTrace(Trace):
+    """Trace of equalized data backed by temporary files, see stream_traces.
+
+    The windows of the response analysis are deconvolved in batches bounded by the memory budget, spec_sm
+    is written to a temporary file and the response histograms are accumulated batch by batch.
+    """
+
+    def __init__(self, data: dict, directory: str, budget: int):
+        """
+        :param data: equalized data of the axis, with input
+        :param directory: directory of temporary files
+        :param budget: memory budget in bytes
+        """
+        self.data = data
+        self.directory = directory
+        self.budget = budget
+
+        self.name = self.data['name']
+        self.time = self.data['time']
+        self.dt = self.time[0] - self.time[1]
+
+        self.input = self.data['input']
+        self.gyro = self.data['gyro']
+        self.throttle = self.data['throttle']
+        # np.histogram works in blocks, no copy of throttle is made
+        self.throt_hist, self.throt_scale = np.histogram(self.throttle, np.linspace(0, 100, 101, dtype=np.float64),
+                                                         density=True)
+
+        self._computed = set()
+
+    def calc_response(self):
+        # step response by deconvolution of input and gyro, in batches of windows
+        self.flen = stepcalc(self.time, Trace.framelen)
+        self.rlen = stepcalc(self.time, Trace.resplen)
+        self.time_resp = self.time[0:self.rlen] - self.time[0]
+
+        self.stacks = self.winstacker({'time': [], 'input': [], 'gyro': [], 'throttle': []}, self.flen,
+                                      Trace.superpos)
+        self.window = np.hanning(self.flen).astype(self.input.dtype, copy=False)
+        wins = len(self.stacks['time'])
+        parts = list(batches(wins, max(1, self.budget // (RESPONSE_BYTES * self.flen))))
+
+        self.spec_sm = disk_array(self.directory, (wins, self.rlen), self.input.dtype)
+        per_window = []
+        for part in parts:
+            stacks = {key: value[part] for key, value in self.stacks.items()}
+            spec_sm, *values = self.stack_response(stacks, self.window)
+            self.spec_sm[part] = spec_sm
+            per_window.append(values)
+        self.avr_t, self.avr_in, self.max_in, self.max_thr = \
+            [np.concatenate(values) for values in zip(*per_window)] if per_window else [np.zeros(0)] * 4
+
+        self.low_mask, self.high_mask, self.toolow_mask = input_masks(self.max_in, self.threshold)
+
+        masks = response_weights(self.low_mask, self.high_mask, self.toolow_mask)
+        vertrange, vertbins = [-1.5, 3.5], 1000
+        hist2d = np.zeros((len(masks), vertbins, len(self.time_resp)), dtype=self.input.dtype)
+        for part in parts:
+            hist2d += mode_hist(self.spec_sm[part], [mask[part] for mask in masks], self.time_resp, vertrange,
+                                vertbins)
+        resps = mode_avrs(hist2d, self.time_resp, vertrange, vertbins)
+        self.resp_sm = resps[0]
+        deviation = np.concatenate([response_deviation(self.spec_sm[part], self.resp_sm[0]) for part in parts]
+                                   or [np.zeros(0)])
+        self.resp_quality = response_quality(deviation)
+
+        thr = masked_throttle(self.max_thr, self.toolow_mask, self.resp_quality)
+        counts = sum(thr_response_counts(thr[part], self.time_resp, self.spec_sm[part], self.toolow_mask[part])
+                     for part in parts)
+        self.thr_response = thr_response_hist(thr, counts, self.time_resp)
+
+        self.resp_low = resps[1]
+        if self.high_mask.sum() > 0:
+            self.resp_high = resps[2]
+
+    def calc_noise(self):
+        noise_analysis([self], [('gyro', 'debug')], self.budget // NOISE_BYTES)
+
+    def calc_noise_d(self):
+        noise_analysis([self], [('d_err',)], self.budget // NOISE_BYTES)
@@ -0,0 +1,292 @@
+"""Synthetic blackbox logs with a known step response and noise spectrum, for benchmarks and checks of the analysis.
+
+    python -m pidanalyzer.synthetic LOG.bbl --rate 8000 --duration 60
+    python -m pidanalyzer.synthetic LOG.csv --natural-freq 30 --damping 0.4 --delay 0.006
+
+Setpoint steps pass a second order transfer function with a delay to give the gyro. The P-term is logged such that
+the PID loop input of the analysis is the setpoint, so the step response of the analysis is the step response of
+the transfer function, see step_response. Noise is white noise, a motor line following the throttle and a frame
+resonance. The gyro filter, a first order low pass, only acts on the noise. debug holds the unfiltered gyro.
+"""
+import argparse
+import sys
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import numpy as np
+
+from .common import *
+from .loaders import bbl_decoder as bbl
+
+# first line of every session of a BBL file
+BBL_PRODUCT = 'Product:Blackbox flight data recorder by Nicholas Sherlock'
+# scaling of the P-term by betaflight, see trace.pid_in
+P_SCALE = 0.032029
+# frames between two I frames of a BBL file
+I_INTERVAL = 32
+# logged fields, in the order of the BBL frames and CSV columns
+FIELDS = (['loopIteration', 'time'] + ['axisP[%d]' % i for i in range(3)] + ['axisI[%d]' % i for i in range(3)]
+          + ['axisD[%d]' % i for i in range(3)] + ['rcCommand[%d]' % i for i in range(4)]
+          + ['gyroADC[%d]' % i for i in range(3)] + ['debug[%d]' % i for i in range(4)])
+
+
+def transfer(freq: np.ndarray, natural_freq: float, damping: float, delay: float) -> np.ndarray:
+    """
+    :param freq: frequencies in Hz
+    :return: transfer function from setpoint to gyro
+    """
+    s = 2j * np.pi * freq
+    omega = 2. * np.pi * natural_freq
+    return omega ** 2 / (s ** 2 + 2. * damping * omega * s + omega ** 2) * np.exp(-s * delay)
+
+
+def impulse_response(rate: float, natural_freq: float, damping: float, delay: float,
+                     length: float = 1.) -> np.ndarray:
+    """
+    :param rate: sample rate in Hz
+    :param length: length of the response in s
+    :return: sampled impulse response of transfer, its sum is 1
+    """
+    n = int(length * rate)
+    # twice as long, so that little of the response wraps around
+    return np.fft.irfft(transfer(np.fft.rfftfreq(2 * n, 1. / rate), natural_freq, damping, delay), 2 * n)[:n]
+
+
+def step_response(rate: float, length: float, natural_freq: float = 25., damping: float = 0.6,
+                  delay: float = 0.004) -> np.ndarray:
+    """Step response of transfer, as found by the analysis of a log made by generate.
+
+    :param length: length of the response in s
+    :return: the response at the sample times from 0
+    """
+    return np.cumsum(impulse_response(rate, natural_freq, damping, delay, max(length, 1.)))[:int(length * rate)]
+
+
+def generate(rate: float = 4000., duration: float = 30., step_rate: float = 1.5, step_size: float = 600.,
+             natural_freq: float = 25., damping: float = 0.6, delay: float = 0.004, noise: float = 4.,
+             motor_noise: float = 30., motor_freq: Tuple[float, float] = (80., 350.),
+             resonance: Tuple[float, float] = (180., 10.), gyro_lowpass: float = 100., jitter: float = 2.,
+             seed: int = 0) -> Tuple[Dict[str, str], Dict[str, np.ndarray]]:
+    """Generates the frames of a log session.
+
+    :param rate: loop and logging rate in Hz
+    :param duration: length of the log in s
+    :param step_rate: mean number of setpoint steps per s and axis
+    :param step_size: max setpoint in deg/s, steps are uniformly distributed in +-step_size
+    :param natural_freq: natural frequency of the transfer function in Hz
+    :param damping: damping ratio of the transfer function
+    :param delay: delay of the transfer function in s
+    :param noise: rms of the white gyro noise in deg/s
+    :param motor_noise: amplitude of the motor noise at full throttle in deg/s
+    :param motor_freq: frequency of the motor noise at zero and full throttle in Hz
+    :param resonance: frequency in Hz and amplitude in deg/s of the frame resonance
+    :param gyro_lowpass: cutoff of the gyro filter in Hz
+    :param jitter: rms of the jitter of the logged time in us
+    :param seed: seed of the random numbers
+    :return: BBL header fields by name, integer values of FIELDS by name
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * rate)
+    t = np.arange(n) / rate
+    freq = np.fft.rfftfreq(n, 1. / rate)
+    # rounded values, same as a flight controller logs them
+    r = lambda values: np.round(values).astype(np.int64)
+    gains = [(45, 80, 30), (47, 84, 32), (45, 80, 0)]
+
+    throttle = 1450. + 250. * np.sin(2. * np.pi * t / 23.) + 150. * np.sin(2. * np.pi * t / 7.3 + 1.)
+    throttle = np.clip(throttle + np.cumsum(rng.normal(0., 2., n)) * 0.1, 1000., 2000.)
+    throttle_percent = (throttle - 1000.) / 10.
+    motor_hz = motor_freq[0] + (motor_freq[1] - motor_freq[0]) * throttle_percent / 100.
+    lowpass = 1. / (1. + 1j * freq / gyro_lowpass)
+    h = impulse_response(rate, natural_freq, damping, delay)
+    nfft = 1 << int(np.ceil(np.log2(n + len(h))))
+
+    fields = {'loopIteration': np.arange(n, dtype=np.int64),
+              'time': r(t * 1e6 + rng.normal(0., jitter, n)) + 1000000 if jitter else r(t * 1e6) + 1000000,
+              'rcCommand[3]': r(throttle), 'debug[3]': r(throttle_percent)}
+    for i in range(3):
+        steps = rng.random(n) < step_rate / rate
+        levels = np.concatenate(([0.], rng.uniform(-step_size, step_size, steps.sum())))
+        setpoint = levels[np.cumsum(steps)]
+        response = np.fft.irfft(np.fft.rfft(setpoint, nfft) * np.fft.rfft(h, nfft), nfft)[:n]
+        noise_i = (rng.normal(0., noise, n)
+                   + motor_noise * throttle_percent / 100. * np.sin(2. * np.pi * np.cumsum(motor_hz) / rate + i)
+                   + resonance[1] * np.sin(2. * np.pi * resonance[0] * t + 2. * i))
+        gyro = r(response + np.fft.irfft(np.fft.rfft(noise_i) * lowpass, n))
+        p_term = r((setpoint - gyro) * P_SCALE * gains[i][0])
+        fields['axisP[%d]' % i] = p_term
+        fields['axisI[%d]' % i] = r(np.cumsum(p_term) * gains[i][1] / gains[i][0] / rate * 0.1)
+        fields['axisD[%d]' % i] = r(-np.gradient(gyro.astype(np.float64)) * gains[i][2] * 0.1)
+        fields['rcCommand[%d]' % i] = r(setpoint / 2.)
+        fields['gyroADC[%d]' % i] = gyro
+        fields['debug[%d]' % i] = r(response + noise_i)
+
+    headers = {'Product': BBL_PRODUCT.split(':', 1)[1], 'Data version': '2', 'I interval': str(I_INTERVAL),
+               'P interval': '1/1', 'Firmware type': 'Cleanflight',
+               'Firmware revision': 'Betaflight 4.3.0 (synthetic)', 'Craft name': 'synthetic',
+               'looptime': str(int(1e6 / rate)), 'rollPID': '%d,%d,%d' % gains[0],
+               'pitchPID': '%d,%d,%d' % gains[1], 'yawPID': '%d,%d,%d' % gains[2], 'minthrottle': '1000',
+               'maxthrottle': '2000', 'tpa_breakpoint': '1500', 'gyro_lowpass_hz': '%d' % gyro_lowpass,
+               'debug_mode': '6'}
+    return headers, {name: fields[name] for name in FIELDS}
+
+
+def write(path: str, headers: Dict[str, str], fields: Dict[str, np.ndarray]):
+    """Writes a log generated by generate, as BBL for .bbl, .bfl and .txt or as CSV of Blackbox Log Viewer for .csv.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        write_csv(path, headers, fields)
+    elif ext in ('.bbl', '.bfl', '.txt'):
+        write_bbl(path, headers, fields)
+    else:
+        raise ValueError('Unknown log format %r' % ext)
+
+
+def write_csv(path: str, headers: Dict[str, str], fields: Dict[str, np.ndarray]):
+    with open(path, 'w') as f:
+        for name, value in headers.items():
+            f.write('"%s","%s"\n' % (name, value))
+        f.write(','.join('"%s"' % name for name in fields) + '\n')
+        np.savetxt(f, np.column_stack(list(fields.values())), fmt='%d', delimiter=',')
+
+
+def write_bbl(path: str, headers: Dict[str, str], fields: Dict[str, np.ndarray]):
+    # encodings and predictors as used by betaflight for these fields
+    names = list(fields)
+    i_encoding = [bbl.UNSIGNED_VB if name in ('loopIteration', 'time') else bbl.SIGNED_VB for name in names]
+    p_predictor, p_encoding = [], []
+    for name in names:
+        predictor, encoding = {'loopIteration': (bbl.PREDICT_INC, bbl.NULL),
+                               'time': (bbl.PREDICT_STRAIGHT_LINE, bbl.SIGNED_VB)}.get(
+            name, (bbl.PREDICT_PREVIOUS, bbl.SIGNED_VB))
+        if name.startswith('axisI'):
+            encoding = bbl.TAG2_3S32
+        elif name.startswith('rcCommand'):
+            encoding = bbl.TAG8_4S16
+        elif name.startswith('gyroADC'):
+            predictor = bbl.PREDICT_AVERAGE_2
+        p_predictor.append(predictor)
+        p_encoding.append(encoding)
+    join = lambda values: ','.join(map(str, values))
+    headers = dict(headers)
+    headers.update({'Field I name': ','.join(names), 'Field I signed': join([1] * len(names)),
+                    'Field I predictor': join([bbl.PREDICT_ZERO] * len(names)),
+                    'Field I encoding': join(i_encoding), 'Field P predictor': join(p_predictor),
+                    'Field P encoding': join(p_encoding)})
+    headers.pop('Product', None)
+
+    values = np.column_stack([fields[name] for name in names])
+    residuals = _p_residuals(values, p_predictor)
+    i_ops, p_ops = bbl._frame_ops(i_encoding), bbl._frame_ops(p_encoding)
+    with open(path, 'wb') as f:
+        f.write(('H %s\n' % BBL_PRODUCT).encode('latin-1'))
+        f.write(''.join('H %s:%s\n' % item for item in headers.items()).encode('latin-1'))
+        for k, (row, residual) in enumerate(zip(values.tolist(), residuals.tolist())):
+            if k % I_INTERVAL == 0:
+                f.write(b'I' + _encode(row, i_ops))
+            else:
+                f.write(b'P' + _encode(residual, p_ops))
+        f.write(bytes([bbl._E, bbl.EVENT_LOG_END]) + bbl.END_OF_LOG_MESSAGE)
+
+
+def _p_residuals(values: np.ndarray, predictors: list) -> np.ndarray:
+    # values minus their P frame prediction, the frame before a P frame is prev, the one before that prev2.
+    # after an I frame prev2 is the I frame.
+    prev = np.roll(values, 1, axis=0)
+    prev2 = np.roll(values, 2, axis=0)
+    after_i = np.arange(len(values)) % I_INTERVAL == 1
+    prev2[after_i] = prev[after_i]
+    residuals = values - prev
+    for j, predictor in enumerate(predictors):
+        if predictor == bbl.PREDICT_INC:
+            residuals[:, j] = 0
+        elif predictor == bbl.PREDICT_STRAIGHT_LINE:
+            residuals[:, j] = values[:, j] - (2 * prev[:, j] - prev2[:, j])
+        elif predictor == bbl.PREDICT_AVERAGE_2:
+            total = prev[:, j] + prev2[:, j]
+            residuals[:, j] = values[:, j] - np.where(total >= 0, total // 2, -(-total // 2))
+    return residuals
+
+
+def _encode(values: list, ops: tuple) -> bytes:
+    out = []
+    for encoding, i, n in ops:
+        if encoding == bbl.SIGNED_VB:
+            out.append(_uvb((values[i] << 1) ^ (values[i] >> 63)))
+        elif encoding == bbl.UNSIGNED_VB:
+            out.append(_uvb(values[i]))
+        elif encoding == bbl.TAG2_3S32:
+            out.append(_tag2_3s32(*values[i:i + 3]))
+        elif encoding == bbl.TAG8_4S16:
+            out.append(_tag8_4s16(*values[i:i + 4]))
+    return b''.join(out)
+
+
+@lru_cache(maxsize=65536)
+def _uvb(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _fits(value: int, bits: int) -> bool:
+    return -(1 << (bits - 1)) <= value < (1 << (bits - 1))
+
+
+@lru_cache(maxsize=65536)
+def _tag2_3s32(a: int, b: int, c: int) -> bytes:
+    if _fits(a, 2) and _fits(b, 2) and _fits(c, 2):
+        return bytes([((a & 3) << 4) | ((b & 3) << 2) | (c & 3)])
+    if _fits(a, 4) and _fits(b, 4) and _fits(c, 4):
+        return bytes([0x40 | (a & 0xF), ((b & 0xF) << 4) | (c & 0xF)])
+    if _fits(a, 6) and _fits(b, 6) and _fits(c, 6):
+        return bytes([0x80 | (a & 0x3F), b & 0x3F, c & 0x3F])
+    # byte widths of 2 bits each
+    lead, body = 0xC0, b''
+    for j, value in enumerate((a, b, c)):
+        width = next(w for w in (1, 2, 3, 4) if _fits(value, 8 * w))
+        lead |= (width - 1) << (2 * j)
+        body += (value & ((1 << (8 * width)) - 1)).to_bytes(width, 'little')
+    return bytes([lead]) + body
+
+
+@lru_cache(maxsize=65536)
+def _tag8_4s16(*values: int) -> bytes:
+    # data version 2, fields are packed in nibbles, big endian
+    selector, nibbles = 0, []
+    for j, value in enumerate(values):
+        kind = 0 if value == 0 else 1 if _fits(value, 4) else 2 if _fits(value, 8) else 3
+        selector |= kind << (2 * j)
+        nibbles += [(value >> shift) & 0xF for shift in (12, 8, 4, 0)[4 - (0, 1, 2, 4)[kind]:]]
+    if len(nibbles) % 2:
+        nibbles.append(0)
+    return bytes([selector]) + bytes((nibbles[k] << 4) | nibbles[k + 1] for k in range(0, len(nibbles), 2))
+
+
+def main(args) -> int:
+    headers, fields = generate(args.rate, args.duration, args.step_rate, args.step_size, args.natural_freq,
+                               args.damping, args.delay, args.noise, seed=args.seed)
+    write(clean_path(args.log_path), headers, fields)
+    log.info('Wrote %r' % args.log_path)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generates a synthetic log with a known step response.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('log_path', metavar='LOG_PATH', help='log to write, .bbl or .csv')
+    parser.add_argument('--rate', type=float, default=4000., help='loop and logging rate in Hz')
+    parser.add_argument('--duration', type=float, default=30., help='length of the log in s')
+    parser.add_argument('--step-rate', type=float, default=1.5, help='setpoint steps per s and axis')
+    parser.add_argument('--step-size', type=float, default=600., help='max setpoint in deg/s')
+    parser.add_argument('--natural-freq', type=float, default=25., help='natural frequency of the response in Hz')
+    parser.add_argument('--damping', type=float, default=0.6, help='damping ratio of the response')
+    parser.add_argument('--delay', type=float, default=0.004, help='delay of the response in s')
+    parser.add_argument('--noise', type=float, default=4., help='rms of the white gyro noise in deg/s')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random numbers')
+
+    sys.exit(main(parser.parse_args()))
@@ -1,22 +1,44 @@
+from functools import lru_cache
+from typing import Iterator, Optional, Sequence
+
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.ndimage import gaussian_filter1d
-from scipy.optimize import minimize
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import common
+from .profiling import span, traced
+
+# scipy is imported by the functions using it, importing it takes longer than the rest of the startup.
+# Traces are created in common.DTYPE, the analysis keeps the dtype of its input, except for time.
 
+# high and valid inputs of fewer response windows are ignored
+MIN_WINDOWS = 10
 
+
+@traced
 def create_hist2d(x, y, weights, bins):  # bins[nx,ny]
-    """Generates a 2d hist from input 1d axis for x,y. repeats them to match shape of weights X*Y (data points)
+    """Generates a 2d hist from input 1d axis for x,y. weights are of shape X*Y (data points)
        x will be 0-100%
     """
-    freqs = np.repeat(np.array([y], dtype=np.float64), len(x), axis=0)
-    throts = np.repeat(np.array([x], dtype=np.float64), len(y), axis=0).transpose()
-    throt_hist_avr, throt_scale_avr = np.histogram(x, 101, [0, 100])
+    return finish_hist2d(x, hist2d_counts(x, y, weights, bins), bins)
 
-    hist2d = np.histogram2d(throts.flatten(), freqs.flatten(),
-                            range=[[0, 100], [y[0], y[-1]]],
-                            bins=bins, weights=weights.flatten(), density=False)[0].transpose()
 
-    hist2d = np.array(abs(hist2d), dtype=np.float64)
+def hist2d_counts(x, y, weights, bins):
+    """Weighted counts of create_hist2d, which can be summed up over parts of x.
+    """
+    nx, ny = bins
+    # out of range values land in the extra last row/column, which is dropped
+    flat = bin_index(x, 0, 100, nx)[:, np.newaxis] * (ny + 1) + bin_index(y, y[0], y[-1], ny)[np.newaxis, :]
+    return np.bincount(flat.ravel(), weights=np.ravel(weights), minlength=(nx + 1) * (ny + 1))
+
+
+def finish_hist2d(x, counts, bins):
+    """Returns the 2d hist of create_hist2d from the counts of all x.
+    """
+    nx, ny = bins
+    throt_hist_avr, throt_scale_avr = np.histogram(x, 101, [0, 100])
+    hist2d = counts.reshape(nx + 1, ny + 1)[:-1, :-1].transpose()
+
+    hist2d = np.array(abs(hist2d), dtype=x.dtype)
     hist2d_norm = np.copy(hist2d)
     hist2d_norm /= (throt_hist_avr + 1e-9)
 
@@ -37,11 +59,37 @@ def spectrum(time, traces):
 def equalize(time, data):
     """Equalizes time scale
     """
+    from scipy.interpolate import interp1d
     data_f = interp1d(time, data)
     newtime = np.linspace(time[0], time[-1], len(time), dtype=np.float64)
     return newtime, data_f(newtime)
 
 
+@traced
+def equalize_channels(time, channels, tol=0.):
+    """Equalizes time scale of a dict of channels sharing the same time in one pass.
+       Resampling is skipped if time deviates less than tol samples from the uniform time scale.
+    """
+    newtime = np.linspace(time[0], time[-1], len(time), dtype=np.float64)
+    if np.max(np.abs(time - newtime)) <= tol * np.abs(newtime[1] - newtime[0]):
+        return newtime, {key: np.asarray(value, dtype=common.DTYPE) for key, value in channels.items()}
+    if np.any(np.diff(time) < 0.):
+        order = np.argsort(time)
+        time = time[order]
+        channels = {key: np.asarray(value)[order] for key, value in channels.items()}
+    # interpolation indices and distances are shared by all channels, same scheme as interp1d
+    hi = np.searchsorted(time, newtime).clip(1, len(time) - 1)
+    lo = hi - 1
+    dt_new = newtime - time[lo]
+    dt_old = time[hi] - time[lo]
+    result = {}
+    for key, value in channels.items():
+        value = np.asarray(value, dtype=common.DTYPE)
+        y_lo = value[lo]
+        result[key] = ((value[hi] - y_lo) / dt_old * dt_new + y_lo).astype(common.DTYPE, copy=False)
+    return newtime, result
+
+
 def stepcalc(time, duration):
     """Calculates frequency and resulting windowlength
     """
@@ -51,6 +99,35 @@ def stepcalc(time, duration):
     return int(arr_len)
 
 
+def window_view(trace, flen, shift, wins):
+    """Returns a read-only (wins, flen) view of overlapping windows of trace, each shifted by shift samples.
+    """
+    trace = np.ascontiguousarray(trace, dtype=np.result_type(trace, common.DTYPE))
+    return sliding_window_view(trace, flen)[::shift][:wins]
+
+
+def batches(length: int, size: int) -> Iterator[slice]:
+    # consecutive slices of at most size elements
+    for start in range(0, length, size):
+        yield slice(start, min(start + size, length))
+
+
+def bin_index(values, lo, hi, nbins):
+    """Returns the index of the uniform bin in [lo, hi] each value falls in, nbins for values outside.
+       Binning is the same as np.histogram/np.histogram2d with a given range.
+    """
+    edges = np.linspace(lo, hi, nbins + 1, dtype=np.float64)
+    inside = (values >= lo) & (values <= hi)
+    vals = np.where(inside, values, lo)
+    ind = ((vals - lo) * (nbins / (hi - lo))).astype(np.intp)
+    np.clip(ind, 0, nbins - 1, out=ind)
+    # correct for rounding at the bin edges
+    ind -= vals < edges[ind]
+    ind += (vals >= edges[ind + 1]) & (ind != nbins - 1)
+    ind[~inside] = nbins
+    return ind
+
+
 def weighted_avg_and_std(values, weights) -> tuple:
     """Calculates weighted avverage and resulting errors
     """
@@ -59,16 +136,16 @@ def weighted_avg_and_std(values, weights) -> tuple:
     return average, np.sqrt(variance)
 
 
-def tukeywin(num: int, alpha: float = 0.5) -> np.ndarray:
+def tukeywin(num: int, alpha: float = 0.5, dtype: type = np.float64) -> np.ndarray:
     """Makes tukey widow for enveloping
     """
     if alpha <= 0:
-        return np.ones(num)  # rectangular window
+        return np.ones(num, dtype=dtype)  # rectangular window
     elif alpha >= 1:
-        return np.hanning(num)
+        return np.hanning(num).astype(dtype, copy=False)
     # Normal case
-    x = np.linspace(0, 1, num, dtype=np.float64)
-    w = np.ones(x.shape)
+    x = np.linspace(0, 1, num, dtype=dtype)
+    w = np.ones(x.shape, dtype=dtype)
     # first condition 0 <= x < alpha/2
     first_condition = x < alpha / 2
     w[first_condition] = 0.5 * (1 + np.cos(2 * np.pi / alpha * (x[first_condition] - alpha / 2)))
@@ -82,6 +159,8 @@ def tukeywin(num: int, alpha: float = 0.5) -> np.ndarray:
 def calc_delay(time, trace1, trace2):
     """Minimizes trace1-trace2 by shifting trace1
     """
+    from scipy.interpolate import interp1d
+    from scipy.optimize import minimize
     tf1 = interp1d(time[2000:-2000], trace1[2000:-2000], fill_value=0., bounds_error=False)
     tf2 = interp1d(time[2000:-2000], trace2[2000:-2000], fill_value=0., bounds_error=False)
     fun = lambda x: ((tf1(time - x * 0.5) - tf2(time + x * 0.5)) ** 2).mean()
@@ -107,45 +186,225 @@ def to_mask(clipped: np.ndarray) -> np.ndarray:
     return clipped
 
 
-def stackspectrum(time, throttle, trace, window):
-    # calculates spectrogram from stack of windows against throttle.
-    # slicing off last 2s to get rid of landing
-    gyro = trace[:-int(Trace.noise_superpos * 2. / Trace.noise_framelen), :] * window
-    thr = throttle[:-int(Trace.noise_superpos * 2. / Trace.noise_framelen), :] * window
-    time = time[:-int(Trace.noise_superpos * 2. / Trace.noise_framelen), :]
-
-    freq, spec = spectrum(time[0], gyro)
-
-    weights = abs(spec.real)
-    avr_thr = np.abs(thr).max(axis=1)
-
-    _hist2d = create_hist2d(avr_thr, freq, weights, [101, int(len(freq) / 4)])
+@lru_cache(maxsize=16)
+def wiener_sn(nfft, dt, cutfreq, dtype=np.float64):
+    """Signal to noise filter of the wiener deconvolution for the one-sided spectrum of nfft samples.
+       It is calculated in float64 and returned as dtype.
+    """
+    from scipy.ndimage import gaussian_filter1d
+    freq = np.abs(np.fft.fftfreq(nfft, dt))
+    sn = to_mask(np.clip(freq, cutfreq - 1e-9, cutfreq))
+    len_lpf = np.sum(np.ones_like(sn) - sn)
+    sn = to_mask(gaussian_filter1d(sn, len_lpf / 6.))
+    sn = 10. * (-sn + 1. + 1e-9)  # +1e-9 to prohibit 0/0 situations
+    sn = sn[:nfft // 2 + 1].astype(dtype)
+    sn.flags.writeable = False
+    return sn
 
-    filt_width = 3  # width of gaussian smoothing for hist data
-    hist2d_sm = gaussian_filter1d(_hist2d['hist2d_norm'], filt_width, axis=1, mode='constant')
 
-    # get max value in histogram >100hz
-    thresh = 100.
-    mask = to_mask(freq[:-1:4].clip(thresh - 1e-9, thresh))
-    maxval = np.max(hist2d_sm.transpose() * mask)
+def stackspectrum(time, throttle, trace, window):
+    # calculates spectrogram from stack of windows against throttle.
+    return stackspectra(time, throttle, [trace], window)[0]
 
-    return {'throt_hist_avr': _hist2d['throt_hist'], 'throt_axis': _hist2d['throt_scale'], 'freq_axis': freq[::4],
-            'hist2d_norm': _hist2d['hist2d_norm'], 'hist2d_sm': hist2d_sm, 'hist2d': _hist2d['hist2d'], 'max': maxval}
 
+@traced
+def stackspectra(time, throttle, traces, window, batch=None):
+    # calculates spectrograms from several stacks of windows sharing time and throttle.
+    # throttle binning is shared, the spectra of all stacks are computed in batches of one real fft.
+    # batch is the max number of samples in one batch, Trace.noise_batch by default.
+    # slicing off last 2s to get rid of landing
+    cut = int(Trace.noise_superpos * 2. / Trace.noise_framelen)
+    nwin = len(throttle) - cut
+    hist = NoiseHist(time[0][1] - time[0][0], window, len(traces))
+    batch = max(1, (batch or Trace.noise_batch) // (len(traces) * hist.nfft))
+    for start in range(0, nwin, batch):
+        stop = min(start + batch, nwin)
+        hist.add(throttle[start:stop], [trace[start:stop] for trace in traces])
+    return hist.result()
+
+
+class NoiseHist:
+    """Accumulates the spectrograms of stackspectra from batches of windows.
+    """
 
-def low_high_mask(signal, threshold):
+    def __init__(self, dt, window, count):
+        """
+        :param dt: sample interval
+        :param window: window function, its length is the window length
+        :param count: number of stacks of windows, sharing time and throttle
+        """
+        winlen = len(window)
+        self.window = window
+        self.nfft = winlen + 1024 - (winlen % 1024)  # same padding as in spectrum
+        self.freq = np.fft.rfftfreq(self.nfft, dt)
+        self.nx, self.ny = 101, int(len(self.freq) / 4)
+        self.yind = bin_index(self.freq, self.freq[0], self.freq[-1], self.ny)
+        self.avr_thr = []
+        # the counts of np.bincount are float64, they are summed up as such and converted by result
+        self.hist2d = np.zeros((count, (self.nx + 1) * (self.ny + 1)), dtype=np.float64)
+
+    def add(self, throttle, traces):
+        # adds the spectra of a batch of windows of each stack, and the throttle windows shared by them.
+        from scipy.fft import rfft
+        nx, ny = self.nx, self.ny
+        avr_thr = np.abs(throttle * self.window).max(axis=1)
+        self.avr_thr.append(avr_thr)
+        wins = np.stack(traces) * self.window
+        weights = np.abs(rfft(wins, n=self.nfft, axis=-1, norm='ortho').real)
+        flat = (bin_index(avr_thr, 0, 100, nx)[:, np.newaxis] * (ny + 1) + self.yind[np.newaxis, :]).ravel()
+        for i in range(len(traces)):
+            self.hist2d[i] += np.bincount(flat, weights=weights[i].ravel(), minlength=(nx + 1) * (ny + 1))
+
+    def result(self):
+        # spectrogram of each stack, as returned by stackspectrum
+        from scipy.ndimage import gaussian_filter1d
+        nx, ny, freq = self.nx, self.ny, self.freq
+        avr_thr = np.concatenate(self.avr_thr) if self.avr_thr else np.zeros(0)
+        throt_hist_avr, throt_scale_avr = np.histogram(avr_thr, 101, [0, 100])
+        count = len(self.hist2d)
+        dtype = self.window.dtype
+        hist2d = self.hist2d.reshape(count, nx + 1, ny + 1)[:, :-1, :-1].transpose(0, 2, 1).astype(dtype, copy=False)
+
+        hist2d_norm = hist2d / (throt_hist_avr + 1e-9).astype(dtype)
+        filt_width = 3  # width of gaussian smoothing for hist data
+        hist2d_sm = gaussian_filter1d(hist2d_norm, filt_width, axis=2, mode='constant')
+
+        # get max value in histogram >100hz
+        thresh = 100.
+        mask = to_mask(freq[:-1:4].clip(thresh - 1e-9, thresh))
+        maxval = np.max(hist2d_sm * mask[:, np.newaxis], axis=(1, 2))
+
+        return [{'throt_hist_avr': throt_hist_avr, 'throt_axis': throt_scale_avr, 'freq_axis': freq[::4],
+                 'hist2d_norm': hist2d_norm[i], 'hist2d_sm': hist2d_sm[i], 'hist2d': hist2d[i], 'max': maxval[i]}
+                for i in range(count)]
+
+
+# attributes of a trace holding the noise spectrogram of each source
+NOISE_ATTRS = {'gyro': 'noise_gyro', 'd_err': 'noise_d', 'debug': 'noise_debug'}
+
+
+def plotted_noise_sources(name):
+    # keys of NOISE_ATTRS plotted for an axis, the D-term of yaw is not plotted
+    return ('gyro', 'd_err', 'debug') if name != 'yaw' else ('gyro', 'debug')
+
+
+@traced
+def noise_analysis(traces, sources=None, batch=None):
+    """Calculates the noise spectrograms of all traces in one batch.
+       sources lists the keys of NOISE_ATTRS to analyse for each trace, all of them by default.
+       batch is the max number of samples in one batched fft, see stackspectra.
+       The traces have to share time and throttle, as traces of the same log do.
+    """
+    if sources is None:
+        sources = [tuple(NOISE_ATTRS)] * len(traces)
+    stacks = []
+    for trace, keys in zip(traces, sources):
+        trace.noise_winlen = stepcalc(trace.time, Trace.noise_framelen)
+        stack = trace.winstacker({key: [] for key in ('time', 'throttle') + tuple(keys)},
+                                 trace.noise_winlen, Trace.noise_superpos)
+        trace.noise_stack = dict(trace.__dict__.get('noise_stack', {}), **stack)
+        trace.noise_win = np.hanning(trace.noise_winlen).astype(stack['throttle'].dtype, copy=False)
+        stacks += [trace.noise_stack[key] for key in keys]
+
+    stack = traces[0].noise_stack
+    spectra = iter(stackspectra(stack['time'], stack['throttle'], stacks, traces[0].noise_win, batch))
+
+    for trace, keys in zip(traces, sources):
+        for key in keys:
+            setattr(trace, NOISE_ATTRS[key], next(spectra))
+        if 'd_err' in keys:
+            trace._computed.add('calc_noise_d')
+        if 'gyro' not in keys or 'debug' not in keys:
+            continue
+        trace._computed.add('calc_noise')
+        trace.filter_trans = filter_transmission(trace.noise_gyro, trace.noise_debug)
+
+
+def filter_transmission(noise_gyro, noise_debug):
+    # transmission of the gyro filters, from the noise spectrograms of filtered gyro and debug (unfiltered gyro)
+    if noise_debug['hist2d'].sum() > 0:
+        # mask 0 entries
+        thr_mask = noise_gyro['throt_hist_avr'].clip(0, 1)
+        return np.average(noise_gyro['hist2d'], axis=1, weights=thr_mask) / \
+               np.average(noise_debug['hist2d'], axis=1, weights=thr_mask)
+    else:
+        return noise_gyro['hist2d'].mean(axis=1) * 0.
+
+
+def low_high_mask(signal, threshold, min_windows=MIN_WINDOWS):
     low = np.copy(signal)
 
     low[low <= threshold] = 1.
     low[low > threshold] = 0.
     high = -low + 1.
 
-    if high.sum() < 10:  # ignore high pinput that is too short
+    if high.sum() < min_windows:  # ignore high pinput that is too short
         high *= 0.
 
     return low, high
 
 
+def input_masks(max_in, threshold, min_windows=MIN_WINDOWS):
+    """Masks of the response windows by their max input.
+
+    :param min_windows: high inputs of fewer windows are ignored, see low_high_mask. 0 for batches of windows,
+        the windows of all batches are counted by the caller then.
+    :return: low and high input masks, toolow mask of the windows with enough input for a valid response
+    """
+    low_mask, high_mask = low_high_mask(max_in, threshold, min_windows)
+    toolow_mask = low_high_mask(max_in, 20, min_windows)[1]  # mask for ignoring noisy low input
+    return low_mask, high_mask, toolow_mask
+
+
+def response_weights(low_mask, high_mask, toolow_mask, always_high=False):
+    """
+    :param always_high: include the weights of resp_high if there are no high inputs, e.g. for batches of windows
+    :return: weights of the windows in the histograms of resp_sm, resp_low and, with high inputs, resp_high
+    """
+    weights = [toolow_mask, low_mask * toolow_mask]
+    if always_high or high_mask.sum() > 0:
+        weights.append(high_mask * toolow_mask)
+    return weights
+
+
+def response_deviation(spec_sm, resp_sm):
+    # mean deviation of the responses of the windows from the most common response
+    return np.abs(spec_sm - resp_sm).mean(axis=1)
+
+
+def response_quality(deviation, fixed=False):
+    """Rates the responses of the windows by their deviation from the most common response, see
+       response_deviation. Responses deviating less than 0.5 are rated 1, others 0.
+
+    :param fixed: scale by the clip range instead of the range of the deviations, both are the same if there
+        are responses of good and bad quality. For batches of windows, which may lack either.
+    """
+    lo, hi = 0.5 - 1e-9, 0.5
+    clipped = deviation.clip(lo, hi)
+    if fixed:
+        return 1. - (clipped - lo) / (hi - lo)
+    return -to_mask(clipped) + 1.
+
+
+def masked_throttle(max_thr, toolow_mask, quality):
+    # masking by setting trottle of unwanted windows to neg, which leaves them out of thr_response
+    return max_thr * (2. * (toolow_mask * quality) - 1.)
+
+
+@traced
+def thr_response_counts(thr, time_resp, spec_sm, toolow_mask):
+    """Counts of thr_response, which can be summed up over batches of windows, see hist2d_counts.
+
+    :param thr: masked throttle of the windows, see masked_throttle
+    """
+    return hist2d_counts(thr, time_resp, spec_sm * toolow_mask[:, np.newaxis], [101, len(time_resp) - 1])
+
+
+def thr_response_hist(thr, counts, time_resp):
+    # thr_response from the counts of all windows, see thr_response_counts
+    return finish_hist2d(thr, counts, [101, len(time_resp) - 1])
+
+
 class Trace:
     framelen = 10.  # length of each single frame over which to compute response
     resplen = 0.5  # length of respose window
@@ -155,12 +414,24 @@ class Trace:
     threshold = 500.  # threshold for 'high input rate'
     noise_framelen = 0.3  # window width for noise analysis
     noise_superpos = 16  # subsampling for noise analysis windows
+    noise_batch = 2 ** 24  # max number of samples in one batched noise fft
+    response_batch = 2 ** 22  # max number of samples in one batch of windowed response stacks
+    # lazily computed attributes and the method computing them
+    _lazy_attrs = dict.fromkeys(['flen', 'rlen', 'time_resp', 'stacks', 'window', 'spec_sm', 'avr_t', 'avr_in',
+                                 'max_in', 'max_thr', 'low_mask', 'high_mask', 'toolow_mask', 'resp_sm',
+                                 'resp_quality', 'thr_response', 'resp_low', 'resp_high'], 'calc_response')
+    _lazy_attrs.update(dict.fromkeys(['noise_winlen', 'noise_stack', 'noise_win', 'noise_gyro', 'noise_debug',
+                                      'filter_trans'], 'calc_noise'))
+    _lazy_attrs.update({'noise_d': 'calc_noise_d'})
+    equalize_tol = 0.01  # max deviation from a uniform time base in samples, below which no resampling is done
+    # analysis results used by the figures and the export, the compact results of a trace, see results()
+    result_attrs = ('time_resp', 'low_mask', 'high_mask', 'toolow_mask', 'thr_response', 'resp_low', 'resp_high',
+                    'noise_gyro', 'noise_debug', 'noise_d', 'filter_trans')
 
     def __init__(self, data):
         self.data = data
-        self.input = equalize(data['time'], pid_in(data['p_err'], data['gyro'], data['P']))[1]  # /20.
-        self.data.update({'input': pid_in(data['p_err'], data['gyro'], data['P'])})
         self.equalize_data()
+        self.data.update({'input': pid_in(self.data['p_err'], self.data['gyro'], self.data['P'])})
 
         self.name = self.data['name']
         self.time = self.data['time']
@@ -175,48 +446,72 @@ class Trace:
         self.throt_hist, self.throt_scale = np.histogram(self.throttle, np.linspace(0, 100, 101, dtype=np.float64),
                                                          density=True)
 
+        self._computed = set()
+
+    def __getattr__(self, name):
+        # analysis results are computed on first access
+        # each computation runs once, attributes it doesn't set (e.g. resp_high) stay missing.
+        calc = Trace._lazy_attrs.get(name)
+        computed = self.__dict__.get('_computed')
+        if calc is None or computed is None or calc in computed:
+            raise AttributeError("'Trace' object has no attribute '%s'" % name)
+        self.compute(calc)
+        return object.__getattribute__(self, name)
+
+    def compute(self, calc):
+        # runs one of the lazy computations, if not done yet
+        if calc not in self._computed:
+            with span(calc, axis=self.name):
+                getattr(self, calc)()
+            self._computed.add(calc)
+
+    def results(self, attrs: Optional[Sequence[str]] = None) -> dict:
+        # computed analysis results, without the window stacks, which are views on the data.
+        # attrs limits them e.g. to result_attrs, the per window responses (spec_sm) are large.
+        results = {key: value for key, value in self.__dict__.items()
+                   if key in Trace._lazy_attrs and key not in ('stacks', 'noise_stack')
+                   and (attrs is None or key in attrs)}
+        results['_computed'] = set(self._computed)
+        return results
+
+    def restore(self, results: dict):
+        # takes over analysis results of another trace of the same data, see results()
+        results = dict(results)
+        self._computed.update(results.pop('_computed'))
+        self.__dict__.update(results)
+
+    def calc_response(self):
+        # step response by deconvolution of input and gyro
         self.flen = stepcalc(self.time, Trace.framelen)  # array len corresponding to framelen in s
         self.rlen = stepcalc(self.time, Trace.resplen)  # array len corresponding to resplen in s
         self.time_resp = self.time[0:self.rlen] - self.time[0]
 
         self.stacks = self.winstacker({'time': [], 'input': [], 'gyro': [], 'throttle': []}, self.flen,
                                       Trace.superpos)  # [[time, input, output],]
-        self.window = np.hanning(self.flen)  # self.tukeywin(self.flen, self.tuk_alpha)
+        self.window = np.hanning(self.flen).astype(self.input.dtype, copy=False)  # tukeywin(self.flen, self.tuk_alpha)
         self.spec_sm, self.avr_t, self.avr_in, self.max_in, self.max_thr = self.stack_response(self.stacks, self.window)
-        self.low_mask, self.high_mask = low_high_mask(self.max_in,
-                                                      self.threshold)  # calcs masks for high and low inputs according to threshold
-        self.toolow_mask = low_high_mask(self.max_in, 20)[1]  # mask for ignoring noisy low input
-
-        self.resp_sm = self.weighted_mode_avr(self.spec_sm, self.toolow_mask, [-1.5, 3.5], 1000)
-        self.resp_quality = -to_mask(
-            (np.abs(self.spec_sm - self.resp_sm[0]).mean(axis=1)).clip(0.5 - 1e-9, 0.5)) + 1.
-        # masking by setting trottle of unwanted traces to neg
-        self.thr_response = create_hist2d(self.max_thr * (2. * (self.toolow_mask * self.resp_quality) - 1.),
-                                          self.time_resp,
-                                          (self.spec_sm.transpose() * self.toolow_mask).transpose(), [101, self.rlen - 1])
-
-        self.resp_low = self.weighted_mode_avr(self.spec_sm, self.low_mask * self.toolow_mask, [-1.5, 3.5], 1000)
+        # calcs masks for high and low inputs according to threshold
+        self.low_mask, self.high_mask, self.toolow_mask = input_masks(self.max_in, self.threshold)
+
+        masks = response_weights(self.low_mask, self.high_mask, self.toolow_mask)
+        resps = self.weighted_mode_avrs(self.spec_sm, masks, [-1.5, 3.5], 1000)
+        self.resp_sm = resps[0]
+        self.resp_quality = response_quality(response_deviation(self.spec_sm, self.resp_sm[0]))
+        thr = masked_throttle(self.max_thr, self.toolow_mask, self.resp_quality)
+        self.thr_response = thr_response_hist(thr, thr_response_counts(thr, self.time_resp, self.spec_sm,
+                                                                       self.toolow_mask), self.time_resp)
+
+        self.resp_low = resps[1]
         if self.high_mask.sum() > 0:
-            self.resp_high = self.weighted_mode_avr(self.spec_sm, self.high_mask * self.toolow_mask, [-1.5, 3.5], 1000)
-
-        self.noise_winlen = stepcalc(self.time, Trace.noise_framelen)
-        self.noise_stack = self.winstacker({'time': [], 'gyro': [], 'throttle': [], 'd_err': [], 'debug': []},
-                                           self.noise_winlen, Trace.noise_superpos)
-        self.noise_win = np.hanning(self.noise_winlen)
-
-        self.noise_gyro = stackspectrum(self.noise_stack['time'], self.noise_stack['throttle'],
-                                        self.noise_stack['gyro'], self.noise_win)
-        self.noise_d = stackspectrum(self.noise_stack['time'], self.noise_stack['throttle'],
-                                     self.noise_stack['d_err'], self.noise_win)
-        self.noise_debug = stackspectrum(self.noise_stack['time'], self.noise_stack['throttle'],
-                                         self.noise_stack['debug'], self.noise_win)
-        if self.noise_debug['hist2d'].sum() > 0:
-            # mask 0 entries
-            thr_mask = self.noise_gyro['throt_hist_avr'].clip(0, 1)
-            self.filter_trans = np.average(self.noise_gyro['hist2d'], axis=1, weights=thr_mask) / \
-                                np.average(self.noise_debug['hist2d'], axis=1, weights=thr_mask)
-        else:
-            self.filter_trans = self.noise_gyro['hist2d'].mean(axis=1) * 0.
+            self.resp_high = resps[2]
+
+    def calc_noise(self):
+        # noise spectrograms of gyro and debug and the resulting filter transmission
+        noise_analysis([self], [('gyro', 'debug')])
+
+    def calc_noise_d(self):
+        # noise spectrogram of the D-term
+        noise_analysis([self], [('d_err',)])
 
     def toy_out(self, inp, delay=0.01, length=0.01, noise=5., mode='normal', sinfreq=100.):
         # generates artificial output for benchmarking
@@ -234,55 +529,57 @@ class Trace:
         return toyout + noise_sig
 
     def equalize_data(self):
-        # equalizes full dict of data
+        # equalizes full dict of data. no resampling if data is already on a uniform time base.
         time = self.data['time']
-        newtime = np.linspace(time[0], time[-1], len(time), dtype=np.float64)
-        for key in self.data:
-            if isinstance(self.data[key], np.ndarray):
-                if len(self.data[key]) == len(time):
-                    self.data[key] = interp1d(time, self.data[key])(newtime)
+        channels = {key: value for key, value in self.data.items()
+                    if key != 'time' and isinstance(value, np.ndarray) and len(value) == len(time)}
+        newtime, channels = equalize_channels(time, channels, Trace.equalize_tol)
+        self.data.update(channels)
         self.data['time'] = newtime
 
+    @traced
     def winstacker(self, stackdict, flen, superpos):
-        # makes stack of windows for deconvolution
+        # makes stack of windows for deconvolution.
+        # stacks are read-only strided views on the equalized data, windowing is applied by the consumer.
         tlen = len(self.data['time'])
         shift = int(flen / superpos)
         wins = int(tlen / shift) - superpos
-        for i in np.arange(wins):
-            for key in stackdict.keys():
-                stackdict[key].append(self.data[key][i * shift:i * shift + flen])
-        for k in stackdict.keys():
-            # print 'key',k
-            # print stackdict[k]
-            stackdict[k] = np.array(stackdict[k], dtype=np.float64)
+        for key in stackdict.keys():
+            stackdict[key] = window_view(self.data[key], flen, shift, wins)
         return stackdict
 
+    @traced
     def wiener_deconvolution(self, vin, vout, cutfreq):  # vin/vout are two-dimensional
-        pad = 1024 - (len(vin[0]) % 1024)  # padding to power of 2, increases transform speed
-        vin = np.pad(vin, [[0, 0], [0, pad]], mode='constant')
-        vout = np.pad(vout, [[0, 0], [0, pad]], mode='constant')
-        H = np.fft.fft(vin, axis=-1)
-        G = np.fft.fft(vout, axis=-1)
-        freq = np.abs(np.fft.fftfreq(len(vin[0]), self.dt))
-        sn = to_mask(np.clip(np.abs(freq), cutfreq - 1e-9, cutfreq))
-        len_lpf = np.sum(np.ones_like(sn) - sn)
-        sn = to_mask(gaussian_filter1d(sn, len_lpf / 6.))
-        sn = 10. * (-sn + 1. + 1e-9)  # +1e-9 to prohibit 0/0 situations
+        """Wiener deconvolution of the stacked windows of input and output, zero padded by the response length.
+        """
+        from scipy.fft import irfft, next_fast_len, rfft
+        # the padding keeps the first rlen samples of the response free of circular wrap
+        nfft = next_fast_len(len(vin[0]) + self.rlen, real=True)
+        H = rfft(vin, n=nfft, axis=-1)
+        G = rfft(vout, n=nfft, axis=-1)
+        sn = wiener_sn(nfft, abs(self.dt), cutfreq, vin.dtype)
         hcon = np.conj(H)
-        deconvolved_sm = np.real(np.fft.ifft(G * hcon / (H * hcon + 1. / sn), axis=-1))
+        deconvolved_sm = irfft(G * hcon / (H * hcon + 1. / sn), n=nfft, axis=-1)
         return deconvolved_sm
 
+    @traced
     def stack_response(self, stacks, window):
-        inp = stacks['input'] * window
-        outp = stacks['gyro'] * window
-        thr = stacks['throttle'] * window
-
-        deconvolved_sm = self.wiener_deconvolution(inp, outp, self.cutfreq)[:, :self.rlen]
-        delta_resp = deconvolved_sm.cumsum(axis=1)
-
-        max_thr = np.abs(np.abs(thr)).max(axis=1)
-        avr_in = np.abs(np.abs(inp)).mean(axis=1)
-        max_in = np.max(np.abs(inp), axis=1)
+        # the window is applied to batches of the stacks, windowed copies of the whole stacks aren't made
+        wins = len(stacks['time'])
+        delta_resp = np.empty((wins, self.rlen), dtype=np.result_type(stacks['input'], window))
+        avr_in = np.empty(wins, dtype=delta_resp.dtype)
+        max_in = np.empty(wins, dtype=delta_resp.dtype)
+        max_thr = np.empty(wins, dtype=np.result_type(stacks['throttle'], window))
+        for part in batches(wins, max(1, Trace.response_batch // len(window))):
+            inp = stacks['input'][part] * window
+            outp = stacks['gyro'][part] * window
+
+            deconvolved_sm = self.wiener_deconvolution(inp, outp, self.cutfreq)[:, :self.rlen]
+            delta_resp[part] = deconvolved_sm.cumsum(axis=1)
+
+            max_thr[part] = np.abs(stacks['throttle'][part] * window).max(axis=1)
+            avr_in[part] = np.abs(inp).mean(axis=1)
+            max_in[part] = np.max(np.abs(inp), axis=1)
         avr_t = stacks['time'].mean(axis=1)
 
         return delta_resp, avr_t, avr_in, max_in, max_thr
@@ -305,32 +602,53 @@ class Trace:
 
     def weighted_mode_avr(self, values, weights, vertrange, vertbins):
         # finds the most common trace and std
-        threshold = 0.5  # threshold for std calculation
-        filt_width = 7  # width of gaussian smoothing for hist data
-
-        resp_y = np.linspace(vertrange[0], vertrange[-1], vertbins, dtype=np.float64)
-        times = np.repeat(np.array([self.time_resp], dtype=np.float64), len(values), axis=0)
-        weights = np.repeat(weights, len(values[0]))
-
-        hist2d = np.histogram2d(times.flatten(), values.flatten(),
-                                range=[[self.time_resp[0], self.time_resp[-1]], vertrange],
-                                bins=[len(times[0]), vertbins], weights=weights.flatten())[0].transpose()
-        # shift outer edges by +-1e-5 (10us) bacause of dtype32. Otherwise different precisions lead to artefacting.
-        # solution to this --> somethings strage here. In outer most edges some bins are doubled, some are empty.
-        # Hence sometimes produces "divide by 0 error" in "/=" operation.
-
-        if hist2d.sum():
-            hist_sm = gaussian_filter1d(hist2d, filt_width, axis=0, mode='constant')
-            hist_sm /= np.max(hist_sm, 0)
-            pixelpos = np.repeat(resp_y.reshape(len(resp_y), 1), len(times[0]), axis=1)
-            avr = np.average(pixelpos, 0, weights=pow(hist_sm, 2))
-        else:
-            hist_sm = hist2d
-            avr = np.zeros_like(self.time_resp)
-        # only used for monochrome error width
-        hist2d[hist2d <= threshold] = 0.
-        hist2d[hist2d > threshold] = 0.5 / (vertbins / (vertrange[-1] - vertrange[0]))
+        return self.weighted_mode_avrs(values, [weights], vertrange, vertbins)[0]
+
+    def weighted_mode_avrs(self, values, weights, vertrange, vertbins):
+        # finds the most common trace and std for several sets of window weights at once.
+        hist2d = mode_hist(values, weights, self.time_resp, vertrange, vertbins)
+        return mode_avrs(hist2d, self.time_resp, vertrange, vertbins)
 
-        std = np.sum(hist2d, 0)
 
-        return avr, std, [self.time_resp, resp_y, hist_sm]
+@traced
+def mode_hist(values, weights, time_resp, vertrange, vertbins):
+    """Histograms of the windows in values for several sets of window weights, see Trace.weighted_mode_avrs.
+       Bins of values are computed once and shared, only the weights differ between the histograms.
+       The histograms can be summed up over parts of the windows.
+    """
+    xbins = len(time_resp)
+    xind = bin_index(time_resp, time_resp[0], time_resp[-1], xbins)
+    yind = bin_index(values, vertrange[0], vertrange[-1], vertbins)
+    flat = yind * xbins + xind
+    flat[(yind == vertbins) | (xind == xbins)] = vertbins * xbins  # overflow bin, dropped below
+
+    hist2d = np.empty((len(weights), vertbins, xbins), dtype=values.dtype)
+    for i, w in enumerate(weights):
+        nonzero = w != 0
+        hist2d[i] = np.bincount(flat[nonzero].ravel(), weights=np.repeat(w[nonzero], values.shape[1]),
+                                minlength=vertbins * xbins + 1)[:-1].reshape(vertbins, xbins)
+    return hist2d
+
+
+@traced
+def mode_avrs(hist2d, time_resp, vertrange, vertbins):
+    """Most common trace and std of each of the histograms of mode_hist.
+    """
+    from scipy.ndimage import gaussian_filter1d
+    threshold = 0.5  # threshold for std calculation
+    filt_width = 7  # width of gaussian smoothing for hist data
+
+    resp_y = np.linspace(vertrange[0], vertrange[-1], vertbins, dtype=hist2d.dtype)
+    empty = hist2d.sum(axis=(1, 2)) == 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hist_sm = gaussian_filter1d(hist2d, filt_width, axis=1, mode='constant')
+        hist_sm /= np.max(hist_sm, 1, keepdims=True)
+        hist_sq = hist_sm ** 2
+        avr = np.einsum('j,ijk->ik', resp_y, hist_sq) / hist_sq.sum(axis=1)
+    hist_sm[empty] = hist2d[empty]
+    avr[empty] = 0.
+    # only used for monochrome error width
+    std = np.count_nonzero(hist2d > threshold, axis=1) * (0.5 / (vertbins / (vertrange[-1] - vertrange[0])))
+
+    return [(avr[i], std[i], [time_resp, resp_y, hist_sm[i]]) for i in range(len(hist2d))]
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from . import batch, cache, common, profiling
+from .common import *
+from .analysis import export_session
+from .errors import PidAnalyzerException
+from .loaders.bbl_loader import LOG_EXTENSIONS
+
+WATCH_EXTENSIONS = tuple(LOG_EXTENSIONS) + ('.csv',)
+# content hashes of processed logs, in the output directory
+LEDGER_FILE = 'processed.json'
+# queue depth and latencies of recent jobs, in the output directory
+STATUS_FILE = 'status.json'
+# number of finished jobs listed in the status file
+STATUS_JOBS = 100
+
+
+class Job:
+    """A log queued for analysis.
+    """
+
+    def __init__(self, path: str, digest: str, stat: Tuple[int, int]):
+        """
+        :param digest: content hash of the log
+        :param stat: size and modification time of the log when it was hashed
+        """
+        self.path = path
+        self.digest = digest
+        self.stat = stat
+        self.queued = time.time()
+        self.started = None
+        self.attempts = 0
+        # not run before this time, when retried
+        self.not_before = 0.
+
+    def summary(self, status: str, error: Optional[str] = None) -> dict:
+        now = time.time()
+        started = self.started or now
+        return {'path': self.path, 'status': status, 'error': error, 'attempts': self.attempts,
+                'wait_s': round(started - self.queued, 3), 'run_s': round(now - started, 3),
+                'latency_s': round(now - self.queued, 3), 'finished': now}
+
+
+class Watcher:
+    """Watches directories for new or changed logs and analyzes them in a pool of worker processes.
+
+    Directories are polled. A log is queued once its size and modification time stayed the same for one poll,
+    so that logs still being copied are not read, and it is skipped if a log of the same content was processed
+    before. At most max_queue logs are queued, further logs are picked up by later polls. Jobs failing with an
+    OSError are retried with exponential backoff, other failures are final.
+
+    The plots of each watched directory go to its own subdirectory of the output directory, see output_dir, so
+    that logs of the same name in different directories don't overwrite each other. Logs of the same output names
+    in one directory, e.g. LOG.bbl and LOG.csv, are not run at the same time.
+    """
+
+    def __init__(self, directories: Sequence[str], output: str, name: str, noise_bounds: list,
+                 axes: Sequence[str] = AXES, analyses: Sequence[str] = ANALYSES, jobs: int = 1,
+                 stream: Optional[int] = None, poll: float = 2., max_queue: int = 64, retries: int = 3,
+                 figures: bool = True):
+        """
+        :param directories: directories to watch, not recursively
+        :param output: directory of the ledger of processed logs and the status file, with a subdirectory of the
+            plots of each watched directory
+        :param name: plot name
+        :param jobs: number of worker processes
+        :param stream: memory budget in MB of streaming analysis, see batch.run
+        :param poll: poll interval in s
+        :param max_queue: max number of logs queued and running
+        :param retries: max number of retries of a job after transient failures
+        :param figures: save figures, else only the results of the analysis, see analysis.export_session
+        """
+        self.directories = directories
+        self.output = output
+        self.name = name
+        self.noise_bounds = noise_bounds
+        self.axes = axes
+        self.analyses = analyses
+        self.jobs = jobs
+        self.stream = stream
+        self.poll = poll
+        self.max_queue = max_queue
+        self.retries = retries
+        self.figures = figures
+
+        self._ledger_path = os.path.join(output, LEDGER_FILE)
+        self._ledger = self._read_ledger()
+        # size and modification time of logs by path, as seen by the last poll and when queued
+        self._polled = {}  # type: Dict[str, Tuple[int, int]]
+        self._queued = {}  # type: Dict[str, Tuple[int, int]]
+        self._queue = deque()  # type: Deque[Job]
+        self._running = {}
+        self._finished = deque(maxlen=STATUS_JOBS)
+        self._counts = {'done': 0, 'failed': 0, 'retried': 0, 'skipped': 0}
+
+    def run(self) -> int:
+        """Watches until interrupted.
+
+        :return: 0
+        """
+        os.makedirs(self.output, exist_ok=True)
+        log.info('Watching %s, output in %r. (Ctrl-C to stop.)' % (', '.join(map(repr, self.directories)),
+                                                                   self.output))
+        pool = self._pool()
+        try:
+            while True:
+                self._scan()
+                pool = self._submit(pool)
+                self._write_status()
+                if self._running:
+                    done, _ = wait(self._running, timeout=self.poll, return_when=FIRST_COMPLETED)
+                    self._collect(done)
+                else:
+                    time.sleep(self.poll)
+        except KeyboardInterrupt:
+            log.info('Stopping, waiting for %d running job(s).' % len(self._running))
+            pool.shutdown(wait=True, cancel_futures=True)
+            self._collect([future for future in self._running if future.done()])
+            self._write_status()
+        return 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # workers are kept running, so imports are only done once per worker
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                   initargs=(common.BLACKBOX_DECODE_PATH, common.NATIVE_DECODER, common.CACHE_DIR,
+                                             common.DTYPE))
+
+    def output_dir(self, path: str) -> str:
+        """
+        :param path: path of a watched log
+        :return: subdirectory of the output directory of the plots, results and temporary files of the log. It is
+            named after the directory of the log and a hash of its path, which tells directories of the same name
+            apart.
+        """
+        directory = os.path.normcase(os.path.abspath(os.path.dirname(path)))
+        digest = hashlib.sha256(directory.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.output, '%s_%s' % (os.path.basename(directory) or 'root', digest))
+
+    def _scan(self):
+        polled = {}
+        output = os.path.normcase(os.path.abspath(self.output))
+        for directory in self.directories:
+            directory_path = os.path.normcase(os.path.abspath(directory))
+            if os.path.commonpath([directory_path, output]) == output:
+                # decoded CSVs are written there
+                continue
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                log.warning('Could not scan %r' % directory, exc_info=True)
+                continue
+            for entry in sorted(entries, key=lambda e: e.name):
+                if os.path.splitext(entry.name)[1].lower() not in WATCH_EXTENSIONS:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                polled[entry.path] = (stat.st_size, stat.st_mtime_ns)
+
+        for path, stat in polled.items():
+            if len(self._queue) + len(self._running) >= self.max_queue:
+                # backpressure, the remaining logs are queued by later polls
+                break
+            if self._queued.get(path) == stat or self._polled.get(path) != stat:
+                # unchanged since queued, or still being written
+                continue
+            try:
+                digest = cache.content_hash(path).hexdigest()
+            except OSError:
+                log.warning('Could not read %r' % path, exc_info=True)
+                continue
+            self._queued[path] = stat
+            if digest in self._ledger or any(job.digest == digest for job in self._jobs()):
+                self._counts['skipped'] += 1
+                continue
+            log.info('Queued %r' % path)
+            self._queue.append(Job(path, digest, stat))
+        self._polled = polled
+
+    def _jobs(self) -> List[Job]:
+        return list(self._queue) + list(self._running.values())
+
+    def _submit(self, pool: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        now = time.time()
+        # output roots of the running jobs, jobs of the same root would write the same temporary files and plots
+        roots = {batch.output_root(job.path, self.output_dir(job.path)) for job in self._running.values()}
+        for job in list(self._queue):
+            if len(self._running) >= self.jobs:
+                break
+            root = batch.output_root(job.path, self.output_dir(job.path))
+            if job.not_before > now or root in roots:
+                continue
+            try:
+                future = pool.submit(profiling.collecting(_process), job.path, self.output_dir(job.path), self.name,
+                                     self.noise_bounds, self.axes, self.analyses, self.stream, self.figures)
+            except BrokenProcessPool:
+                log.warning('Worker pool broke, restarting it')
+                pool.shutdown(wait=False)
+                pool = self._pool()
+                continue
+            self._queue.remove(job)
+            roots.add(root)
+            job.started = time.time()
+            job.attempts += 1
+            self._running[future] = job
+        return pool
+
+    def _collect(self, futures):
+        for future in futures:
+            job = self._running.pop(future)
+            try:
+                sessions, error, transient = profiling.merge(future.result())
+            except BrokenProcessPool as e:
+                # a worker process died, possibly from another job
+                sessions, error, transient = 0, '%s: %s' % (type(e).__name__, e), True
+            if error is None:
+                log.info('Done %r: %d session(s) in %.1f s' % (job.path, sessions, time.time() - job.started))
+                self._finish(job, 'done')
+            elif transient and job.attempts <= self.retries:
+                log.warning('Retrying %r: %s' % (job.path, error))
+                self._counts['retried'] += 1
+                self._finished.append(job.summary('retrying', error))
+                job.not_before = time.time() + self.poll * 2 ** job.attempts
+                job.started = None
+                self._queue.append(job)
+            else:
+                log.error('Failed %r: %s' % (job.path, error))
+                self._finish(job, 'failed', error)
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        summary = job.summary(status, error)
+        self._counts[status] += 1
+        self._finished.append(summary)
+        self._ledger[job.digest] = {'path': job.path, 'status': status, 'error': error,
+                                    'finished': summary['finished']}
+        _write_json(self._ledger_path, self._ledger)
+
+    def _read_ledger(self) -> dict:
+        try:
+            with open(self._ledger_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            log.warning('Could not read %r, processing all logs again' % self._ledger_path, exc_info=True)
+            return {}
+
+    def _write_status(self):
+        now = time.time()
+        finished = [job for job in self._finished if job['status'] != 'retrying']
+        latencies = [job['latency_s'] for job in finished]
+        _write_json(os.path.join(self.output, STATUS_FILE), {
+            'updated': now,
+            'queue_depth': len(self._queue),
+            'running': [{'path': job.path, 'attempts': job.attempts, 'run_s': round(now - job.started, 3)}
+                        for job in self._running.values()],
+            'counts': self._counts,
+            'mean_latency_s': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'jobs': list(self._finished),
+        })
+
+
+def _write_json(path: str, value):
+    # written next to the file and renamed, so that readers never see partial files
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(blackbox_decode_path: str, native_decoder: bool, cache_dir: str, dtype: str):
+    batch._init_worker(blackbox_decode_path, native_decoder, cache_dir, dtype)
+    # Ctrl-C stops the watcher, which lets running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _process(path: str, output: str, name: str, noise_bounds: list, axes: Sequence[str],
+             analyses: Sequence[str], stream: Optional[int] = None,
+             figures: bool = True) -> Tuple[int, Optional[str], bool]:
+    """Analyzes all sessions of a log, with the plots or results in output.
+
+    :return: number of sessions, error or None and whether the error is transient
+    """
+    loader = None
+    try:
+        # an absolute subdirectory puts temporary files and plots into output
+        os.makedirs(output, exist_ok=True)
+        loader = cache.resolve(path, output, not stream)
+        for i in range(len(loader.headers)):
+            if figures:
+                batch._plot_session(loader, i, name, noise_bounds, axes, analyses, stream)
+            else:
+                export_session(loader, i, name, axes, analyses, stream=stream)
+        return len(loader.headers), None if loader.headers else 'no session to analyze', False
+    except OSError as e:
+        # e.g. the log was moved or the disk is full
+        log.error('Analysis of %r failed' % path, exc_info=True)
+        return 0, '%s: %s' % (type(e).__name__, e), True
+    except (Exception, PidAnalyzerException) as e:
+        log.error('Analysis of %r failed' % path, exc_info=True)
+        return 0, '%s: %s' % (type(e).__name__, e), False
+    finally:
+        if loader is not None:
+            loader.clean_up()
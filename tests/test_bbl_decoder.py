@@ -0,0 +1,95 @@
+"""The native BBL decoder on synthetic logs, and its equivalence with blackbox_decode on real Betaflight logs.
+
+Real logs aren't shipped with the repository. The logs in tests/logs and the paths in PID_ANALYZER_TEST_LOGS,
+separated by os.pathsep, are decoded by both decoders. blackbox_decode is found like by the command line, or
+at BLACKBOX_DECODE. The test is skipped without logs or blackbox_decode:
+
+    PID_ANALYZER_TEST_LOGS=LOG.BBL python -m pytest tests
+"""
+import glob
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from pidanalyzer import common, synthetic
+from pidanalyzer.common import get_blackbox_decode_path
+from pidanalyzer.loaders import BblLoader, NativeBblLoader, bbl_decoder
+from pidanalyzer.loaders.bbl_loader import LOG_EXTENSIONS
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), 'logs')
+
+
+def _logs() -> list:
+    paths = [path for path in os.environ.get('PID_ANALYZER_TEST_LOGS', '').split(os.pathsep) if path]
+    paths += sorted(glob.glob(os.path.join(LOG_DIR, '*')))
+    return [path for path in paths if os.path.splitext(path)[1].lower() in LOG_EXTENSIONS]
+
+
+def _write_bbl(path: str, fields: dict, unsigned: tuple = ()) -> bytes:
+    headers, _ = synthetic.generate(rate=2000., duration=1.)
+    synthetic.write_bbl(path, headers, fields)
+    with open(path, 'rb') as f:
+        content = f.read()
+    # write_bbl flags all fields signed
+    signed = ','.join('0' if name in unsigned else '1' for name in fields)
+    return content.replace(b'Field I signed:' + b','.join([b'1'] * len(fields)),
+                           b'Field I signed:' + signed.encode())
+
+
+def test_decode_synthetic_log(tmp_path):
+    _, fields = synthetic.generate(rate=2000., duration=5.)
+    content = _write_bbl(str(tmp_path / 'LOG.bbl'), fields)
+    headers, values = bbl_decoder.decode(content)
+
+    assert headers['Field I name'].split(',') == list(fields)
+    assert values.keys() == fields.keys()
+    for name, expected in fields.items():
+        np.testing.assert_array_equal(values[name], expected, err_msg=name)
+
+
+def test_decode_wraps_to_32_bits(tmp_path):
+    # a single I frame, the P frames cross the limits of the 32 bit values
+    _, fields = synthetic.generate(rate=2000., duration=1.)
+    fields = {name: values[:synthetic.I_INTERVAL].copy() for name, values in fields.items()}
+    steps = np.arange(synthetic.I_INTERVAL)
+    fields['time'] = (1 << 32) - 3000 + 500 * steps
+    fields['axisP[0]'] = 5 - steps
+    fields['axisD[0]'] = (1 << 31) - 10 + steps
+    content = _write_bbl(str(tmp_path / 'LOG.bbl'), fields, unsigned=('time', 'axisP[0]'))
+    _, values = bbl_decoder.decode(content)
+
+    # the time is extended past its rollover, the unsigned field wraps below 0, the signed one above 2**31 - 1
+    np.testing.assert_array_equal(values['time'], fields['time'])
+    np.testing.assert_array_equal(values['axisP[0]'], (5 - steps) % (1 << 32))
+    np.testing.assert_array_equal(values['axisD[0]'], (1 << 31) - 10 + steps - (steps >= 10) * (1 << 32))
+
+
+@pytest.fixture
+def blackbox_decode() -> str:
+    path = os.environ.get('BLACKBOX_DECODE') or get_blackbox_decode_path()
+    if not os.path.isfile(path):
+        pytest.skip('blackbox_decode not found at %r' % path)
+    return path
+
+
+@pytest.mark.parametrize('path', _logs() or [pytest.param(None, marks=pytest.mark.skip(reason='no logs'))])
+def test_native_decoder_matches_blackbox_decode(path, blackbox_decode, tmp_path, monkeypatch):
+    # the sessions are split and decoded next to the log
+    log_path = str(tmp_path / os.path.basename(path))
+    shutil.copy(path, log_path)
+    for tmp_subdir in ('blackbox_decode', 'native'):
+        (tmp_path / tmp_subdir).mkdir()
+    monkeypatch.setattr(common, 'BLACKBOX_DECODE_PATH', blackbox_decode)
+    expected = BblLoader(log_path, 'blackbox_decode')
+    native = NativeBblLoader(log_path, 'native')
+
+    assert len(native.headers) == len(expected.headers) > 0
+    for i, (header, native_header) in enumerate(zip(expected.headers, native.headers)):
+        # the temp files only name the plots
+        assert dict(native_header, tempFile=None) == dict(header, tempFile=None)
+        data, native_data = expected.read_session(i), native.read_session(i)
+        assert native_data.keys() == data.keys()
+        for key, values in data.items():
+            np.testing.assert_array_equal(native_data[key], values, err_msg='session %d, %s' % (i, key))
@@ -0,0 +1,47 @@
+"""BblLoader on synthetic logs, with the CSV output of blackbox_decode written from the generated frames.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from pidanalyzer import synthetic
+from pidanalyzer.loaders import BblLoader, bbl_loader
+from pidanalyzer.loaders.blackbox_decode_csv_loader import BlackboxDecodeCsvLoader
+
+
+@pytest.fixture
+def log_path(tmp_path, monkeypatch) -> str:
+    headers, fields = synthetic.generate(rate=2000., duration=20.)
+    path = str(tmp_path / 'LOG.bbl')
+    synthetic.write_bbl(path, headers, fields)
+    (tmp_path / 'tmp').mkdir()
+
+    def decode(blackbox_decode_path: str, bbl_session: str) -> bool:
+        # names and layout as written by blackbox_decode
+        names = ['time (us)' if name == 'time' else name for name in fields]
+        with open(os.path.splitext(bbl_session)[0] + '.01.csv', 'w') as f:
+            f.write(', '.join(names) + '\n')
+            np.savetxt(f, np.column_stack(list(fields.values())), fmt='%d', delimiter=', ')
+        return True
+
+    monkeypatch.setattr(bbl_loader, '_decode', decode)
+    return path
+
+
+def test_iter_session_reads_chunks(log_path, monkeypatch):
+    loader = BblLoader(log_path)
+    expected = loader.read_session(0)
+
+    def read_data(self, path):
+        raise AssertionError('%r is read at once' % path)
+
+    monkeypatch.setattr(BlackboxDecodeCsvLoader, '_read_data', read_data)
+    chunks = list(loader.iter_session(0, 4096))
+
+    assert len(chunks) == -(-len(expected['time_us']) // 4096)
+    assert all(len(chunk['time_us']) == 4096 for chunk in chunks[:-1])
+    assert chunks[0].keys() == expected.keys()
+    for key, values in expected.items():
+        if isinstance(values, np.ndarray):
+            np.testing.assert_array_equal(np.concatenate([chunk[key] for chunk in chunks]), values, err_msg=key)